@@ -10,10 +10,12 @@ import socks
 import socket
 import urllib
 import logging
+import sockshandler
 import threading
 import subprocess
 
 import basicswap.config as cfg
+import basicswap.metrics as metrics
 import basicswap.contrib.segwit_addr as segwit_addr
 
 from .rpc import (
@@ -44,7 +46,8 @@ class BaseApp:
         self.settings = settings
         self.coin_clients = {}
         self.coin_interfaces = {}
-        self.mxDB = threading.RLock()
+        self.mxDB = metrics.TimedRLock(metrics.registry.histogram('basicswap_db_lock_wait_seconds', 'Time spent waiting to acquire mxDB'),
+                                       metrics.registry.histogram('basicswap_db_lock_hold_seconds', 'Time mxDB was held for'))
         self.debug = self.settings.get('debug', False)
         self.delay_event = threading.Event()
         self._network = None
@@ -170,6 +173,17 @@ class BaseApp:
 
         socket.setdefaulttimeout(timeout)
 
+    def readURL(self, url, timeout=120, headers=None):
+        # Routes through tor per request, without replacing the global socket
+        handlers = []
+        if self.use_tor_proxy:
+            handlers.append(sockshandler.SocksiPyHandler(socks.PROXY_TYPE_SOCKS5, self.tor_proxy_host, self.tor_proxy_port, rdns=True))
+        opener = urllib.request.build_opener(*handlers)
+        opener.addheaders = [('User-agent', 'Mozilla/5.0')]
+        req = urllib.request.Request(url, headers={} if headers is None else headers)
+        with opener.open(req, timeout=timeout) as resp:
+            return resp.read()
+
     def popConnectionParameters(self):
         if self.use_tor_proxy:
             socket.socket = self.default_socket
@@ -14,7 +14,8 @@ import base64
 import random
 import shutil
 import struct
-import urllib.request
+import bisect
+import heapq
 import hashlib
 import secrets
 import datetime as dt
@@ -27,14 +28,6 @@ import concurrent.futures
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.orm.session import close_all_sessions
 
-from .interface.part import PARTInterface, PARTInterfaceAnon, PARTInterfaceBlind
-from .interface.btc import BTCInterface
-from .interface.ltc import LTCInterface
-from .interface.nmc import NMCInterface
-from .interface.xmr import XMRInterface
-from .interface.pivx import PIVXInterface
-from .interface.passthrough_btc import PassthroughBTCInterface
-
 from . import __version__
 from .rpc_xmr import make_xmr_rpc2_func
 from .util import (
@@ -91,6 +84,7 @@ from .db import (
     SmsgAddress,
     Action,
     EventLog,
+    BidSpan,
     XmrOffer,
     XmrSwap,
     XmrSplitData,
@@ -98,16 +92,32 @@ from .db import (
     KnownIdentity,
     AutomationLink,
     AutomationStrategy,
+    bidDescriptionVersion,
+    listenPendingStates,
 )
 from .db_upgrades import upgradeDatabase, upgradeDatabaseData
+from .db_archive import archiveSwaps, attachArchiveDB, detachArchiveDB, archiveSessionFactory
 from .base import BaseApp
+from .summary import SummaryCounters
+from .util.sampling_profile import SamplingProfiler
+from .metrics import (
+    registry as metrics_registry,
+    instrumentEngine,
+    nameRPCEndpoint,
+    threadRPCSeconds,
+)
+from .rates import (
+    RateService,
+    CoinGeckoProvider,
+    BittrexProvider,
+)
 from .explorers import (
     ExplorerInsight,
     ExplorerBitAps,
     ExplorerChainz,
+    queryExplorers,
 )
 import basicswap.config as cfg
-import basicswap.network as bsn
 import basicswap.protocols.atomic_swap_1 as atomic_swap_1
 from .basicswap_util import (
     KeyTypes,
@@ -120,16 +130,19 @@ from .basicswap_util import (
     TxStates,
     TxTypes,
     ActionTypes,
+    ActionStates,
     EventLogTypes,
     XmrSplitMsgTypes,
     DebugTypes,
+    SpanTypes,
     strBidState,
+    strSpanType,
+    summariseDurations,
     describeEventEntry,
     getVoutByAddress,
     getVoutByP2WSH,
     replaceAddrPrefix,
     getOfferProofOfFundsHash,
-    getLastBidState,
     isActiveBidState,
     NotificationTypes as NT,
 )
@@ -162,30 +175,75 @@ def threadPollXMRChainState(swap_client, coin_type):
         try:
             new_height = ci.getChainHeight()
             if new_height != cc['chain_height']:
-                swap_client.log.debug('New {} block at height: {}'.format(str(coin_type), new_height))
-                with swap_client.mxDB:
-                    cc['chain_height'] = new_height
+                swap_client.setChainTip(coin_type, {'blocks': new_height})
         except Exception as e:
             swap_client.log.warning('threadPollXMRChainState {}, error: {}'.format(str(coin_type), str(e)))
         swap_client.delay_event.wait(random.randrange(20, 30))  # random to stagger updates
 
 
 def threadPollChainState(swap_client, coin_type):
+    # New tips are detected from a zmq hashblock notification if configured, else by polling getblockchaininfo.
+    # Long polling waitfornewblock is opt-in with use_waitfornewblock, the open call holds one of the daemon's rpc threads.
     ci = swap_client.ci(coin_type)
     cc = swap_client.coin_clients[coin_type]
+    chain_client_settings = swap_client.getChainClientSettings(coin_type)
+    zmq_url = chain_client_settings.get('zmqpubhashblock', None)
+    zmq_socket = None
+    if zmq_url:
+        zmq_socket = swap_client.zmqContext.socket(zmq.SUB)
+        zmq_socket.connect(zmq_url)
+        zmq_socket.setsockopt_string(zmq.SUBSCRIBE, 'hashblock')
+    use_waitfornewblock = chain_client_settings.get('use_waitfornewblock', False)
+    last_polled = 0
+    try:
+        while not swap_client.delay_event.is_set():
+            try:
+                now = time.time()
+                if cc['chain_best_block'] is None or now - last_polled >= swap_client.chain_poll_seconds:
+                    last_polled = now
+                    chain_state = ci.getBlockchainInfo()
+                    if chain_state['bestblockhash'] != cc['chain_best_block']:
+                        swap_client.setChainTip(coin_type, chain_state)
+                    continue
+
+                if zmq_socket:
+                    if zmq_socket.poll(timeout=swap_client.chain_wait_seconds * 1000):
+                        zmq_socket.recv_multipart()
+                        last_polled = 0
+                    continue
+
+                if use_waitfornewblock:
+                    try:
+                        block = ci.waitForNewBlock(swap_client.chain_wait_seconds * 1000)
+                    except Exception as e:
+                        if 'Method not found' not in str(e):
+                            raise e
+                        swap_client.log.info('waitfornewblock unavailable for {}, polling instead.'.format(str(coin_type)))
+                        use_waitfornewblock = False
+                        continue
+                    if block['hash'] != cc['chain_best_block']:
+                        last_polled = 0
+                    continue
+
+                swap_client.delay_event.wait(swap_client.chain_poll_seconds)
+                last_polled = 0
+                continue
+            except Exception as e:
+                swap_client.log.warning('threadPollChainState {}, error: {}'.format(str(coin_type), str(e)))
+            swap_client.delay_event.wait(random.randrange(20, 30))  # random to stagger updates
+    finally:
+        if zmq_socket:
+            zmq_socket.close()
+
+
+def threadFlushEventLog(swap_client):
     while not swap_client.delay_event.is_set():
-        try:
-            chain_state = ci.getBlockchainInfo()
-            if chain_state['bestblockhash'] != cc['chain_best_block']:
-                swap_client.log.debug('New {} block at height: {}'.format(str(coin_type), chain_state['blocks']))
-                with swap_client.mxDB:
-                    cc['chain_height'] = chain_state['blocks']
-                    cc['chain_best_block'] = chain_state['bestblockhash']
-                    if 'mediantime' in chain_state:
-                        cc['chain_median_time'] = chain_state['mediantime']
-        except Exception as e:
-            swap_client.log.warning('threadPollChainState {}, error: {}'.format(str(coin_type), str(e)))
-        swap_client.delay_event.wait(random.randrange(20, 30))  # random to stagger updates
+        swap_client._event_log_flush_event.wait(swap_client.event_log_flush_ms / 1000)
+        swap_client._event_log_flush_event.clear()
+        swap_client.flushEventLog()
+        swap_client.flushPendingKV()
+    swap_client.flushEventLog()
+    swap_client.flushPendingKV()
 
 
 class WatchedOutput():  # Watch for spends
@@ -221,18 +279,83 @@ class BasicSwap(BaseApp):
         self.check_progress_seconds = self.settings.get('check_progress_seconds', 60)
         self.check_watched_seconds = self.settings.get('check_watched_seconds', 60)
         self.check_expired_seconds = self.settings.get('check_expired_seconds', 60 * 5)
-        self.check_actions_seconds = self.settings.get('check_actions_seconds', 10)
+        self.check_actions_seconds = self.settings.get('check_actions_seconds', 60)  # Actions run when due, this is a fallback scan
+        self.max_action_tries = self.settings.get('max_action_tries', 5)
         self.check_xmr_swaps_seconds = self.settings.get('check_xmr_swaps_seconds', 20)
+        self.check_address_pool_seconds = self.settings.get('check_address_pool_seconds', 60)
+        self.check_archive_seconds = self.settings.get('check_archive_seconds', 60 * 60)
+        self.check_summary_seconds = self.settings.get('check_summary_seconds', 10 * 60)  # Recount the index page counters from the db
+        self.archive_after_days = self.settings.get('archive_after_days', 0)  # Opt-in, finished swaps are moved to the archive db after, archived bids are only reachable through listBids
+        self.chain_poll_seconds = self.settings.get('chain_poll_seconds', 30)  # Fallback if no new block notification is received
+        self.chain_wait_seconds = self.settings.get('chain_wait_seconds', 5)  # Max time to wait on a new block notification before checking delay_event
+        self.address_pool_size = self.settings.get('address_pool_size', 10)
         self.startup_tries = self.settings.get('startup_tries', 21)  # Seconds waited for will be (x(1 + x+1) / 2
+        self.startup_min_delay = self.settings.get('startup_min_delay', 0.5)  # Daemon RPC retry delay doubles from min to max
+        self.startup_max_delay = self.settings.get('startup_max_delay', 16)
+        self._startup_threads = {}
+        self._deferred_msgs = {}  # msgid: swap coins, messages left unread until their coins are ready
+        self._check_deferred_msgs = False
         self.debug_ui = self.settings.get('debug_ui', False)
         self._last_checked_progress = 0
         self._last_checked_watched = 0
         self._last_checked_expired = 0
         self._last_checked_actions = 0
         self._last_checked_xmr_swaps = 0
+        self._last_checked_address_pool = 0
+        self._last_checked_archive = 0
+        self._last_checked_summary = 0
+        self._action_triggers = []  # min-heap of trigger_at times for pending actions
+        self._msg_bid = None  # (bid_id, state_time) of the bid the message being processed is for
+
+        # Events logged without a session are buffered and written in batches
+        self.event_log_flush_ms = self.settings.get('event_log_flush_ms', 500)
+        self.event_log_flush_rows = self.settings.get('event_log_flush_rows', 100)
+        self.event_log_coalesce_seconds = self.settings.get('event_log_coalesce_seconds', 5 * 60)
+        self.mxEventLog = threading.Lock()
+        self._event_log_flush_event = threading.Event()
+        self._event_log_buffer = []
+        self._event_log_last_written = {}
+        self._event_log_stats = {
+            'flushes': 0,
+            'rows_written': 0,
+            'rows_coalesced': 0,
+            'last_flush_latency_ms': 0,
+            'max_flush_latency_ms': 0,
+        }
+        # Checks that leave the bid state unchanged are only recorded as spans if slower than this
+        self.bid_span_min_ms = self.settings.get('bid_span_min_ms', 500)
+        self._filling_address_pool = False
         self._possibly_revoked_offers = collections.deque([], maxlen=48)  # TODO: improve
         self._updating_wallets_info = {}
         self._last_updated_wallets_info = 0
+        self.wallet_info_timeout = self.settings.get('wallet_info_timeout', 10)
+        self.mxWalletsInfoFutures = threading.Lock()
+        self._wallets_info_futures = {}
+
+        # Wallet and chain info is kept in memory per coin, the wallets table is only read at startup
+        # A snapshot is current while its version matches the coin's and it's younger than wallet_snapshot_seconds
+        self.wallet_snapshot_seconds = self.settings.get('wallet_snapshot_seconds', 30)
+        self.mxWalletSnapshots = threading.Lock()
+        self._wallet_snapshots = {}  # coin_id: {'chain', 'wallet', 'updated', 'version'}
+        self._wallet_versions = {}  # coin_id: incremented when the wallet may have changed
+
+        # Fee rates are cached per (coin, conf_target) until a new block is seen or the entry expires
+        self.fee_rate_cache_seconds = self.settings.get('fee_rate_cache_seconds', 5 * 60)
+        self.mxFeeRates = threading.Lock()
+        self._fee_rate_cache = {}
+        self._fee_rate_cache_hits = 0
+        self._fee_rate_cache_misses = 0
+
+        # Spendable wallet outputs grouped by address, rebuilt on a new block, a local spend or expiry
+        self.wallet_unspents_cache_seconds = self.settings.get('wallet_unspents_cache_seconds', 60)
+        self.mxUnspents = threading.Lock()
+        self._unspents_cache = {}
+        self._locked_outpoints_cache = {}  # coin_type: set of (txid hex, n) locked in the wallet
+
+        # Rendered bid descriptions, replaced when the bid, its transactions, events or label change
+        self.bid_description_cache_size = self.settings.get('bid_description_cache_size', 100)
+        self.mxBidDescriptions = threading.Lock()
+        self._bid_descriptions = collections.OrderedDict()  # (bid_id, for_api): (version, description)
 
         # TODO: Adjust ranges
         self.min_delay_event = self.settings.get('min_delay_event', 10)
@@ -253,8 +376,31 @@ class BasicSwap(BaseApp):
         self.SMSG_SECONDS_IN_HOUR = 60 * 60  # Note: Set smsgsregtestadjust=0 for regtest
 
         self.threads = []
+        self._chain_tip_subscribers = [self.onNewChainTip, ]
         self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='bsp')
 
+        # Market rates, rate_sources enables providers and rate_source_urls can override their urls
+        self.rate_service = RateService(self.log, self.readURL,
+                                        cache_seconds=self.settings.get('rate_cache_seconds', 60),
+                                        stale_seconds=self.settings.get('rate_stale_seconds', 10 * 60),
+                                        history_length=self.settings.get('rate_history_length', 288),
+                                        timeout=self.settings.get('rate_timeout', 10))
+        rate_sources = self.settings.get('rate_sources', {})
+        rate_source_urls = self.settings.get('rate_source_urls', {})
+        for provider_class in (CoinGeckoProvider, BittrexProvider):
+            if rate_sources.get(provider_class.name, True):
+                self.rate_service.addProvider(provider_class(rate_source_urls.get(provider_class.name, None)))
+
+        # explorer_quorum: 'any' tries the explorers in turn from a random offset,
+        # 'first' queries them in parallel and takes the first answer, 'majority' the answer most agree on
+        self.explorer_quorum = self.settings.get('explorer_quorum', 'any')
+        ensure(self.explorer_quorum in ('any', 'first', 'majority'), 'Unknown explorer_quorum')
+        self.explorer_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='explorer')
+
+        # Started from the debug page or api, samples the stacks of all threads
+        self.profiler = SamplingProfiler()
+        self.profile_max_seconds = self.settings.get('profile_max_seconds', 300)
+
         # Encode key to match network
         wif_prefix = chainparams[Coins.PART][self.chain]['key_prefix']
         self.network_key = toWIF(wif_prefix, decodeWif(self.settings['network_key']))
@@ -264,6 +410,8 @@ class BasicSwap(BaseApp):
 
         self.db_echo = self.settings.get('db_echo', False)
         self.sqlite_file = os.path.join(self.data_dir, 'db{}.sqlite'.format('' if self.chain == 'mainnet' else ('_' + self.chain)))
+        self.archive_file = os.path.join(self.data_dir, 'db{}_archive.sqlite'.format('' if self.chain == 'mainnet' else ('_' + self.chain)))
+        self._archive_session_factory = None
         db_exists = os.path.exists(self.sqlite_file)
 
         # HACK: create_all hangs when using tox, unless create_engine is called with echo=True
@@ -278,30 +426,46 @@ class BasicSwap(BaseApp):
 
         self.engine = sa.create_engine('sqlite:///' + self.sqlite_file, echo=self.db_echo)
         self.session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+        listenPendingStates(self.session_factory)
+        instrumentEngine(self.engine, metrics_registry.histogram('basicswap_db_query_seconds', 'SQL statement duration', ('statement', )))
+
+        # Kept up to date from committed bids and offers so the summary doesn't scan the tables
+        self._summary_counters = SummaryCounters()
+        self._summary_counters.listen(self.session_factory)
+
+        # Served at /metrics, the gauges are read when rendered
+        self._metric_update_phase = metrics_registry.histogram('basicswap_update_phase_seconds', 'Duration of each update() phase', ('phase', ))
+        self._metric_smsg_lag = metrics_registry.histogram('basicswap_smsg_ingest_lag_seconds', 'Time from an smsg being sent to being processed', ('msg_type', ),
+                                                           buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0))
+        metrics_registry.gauge('basicswap_bids', 'Active bids by state', ('state', )).setFunction(self.countBidsByState)
+        metrics_registry.gauge('basicswap_swaps_in_progress', 'Swaps in progress by state', ('state', )).setFunction(self.countSwapsInProgress)
+        metrics_registry.gauge('basicswap_websocket_clients', 'Connected websocket clients').setFunction(self.countWebsocketClients)
+
+        # Write-through cache of the kv_int and kv_string tables
+        self.mxKV = threading.Lock()
+        self._kv_int = {}
+        self._kv_string = {}
+        self._kv_pending = {}  # Deferred writes, (table, key): value
+        sa.event.listen(self.session_factory, 'after_commit', self.applyKVChanges)
+        sa.event.listen(self.session_factory, 'after_rollback', self.discardKVChanges)
 
         session = scoped_session(self.session_factory)
-        try:
-            self.db_version = session.query(DBKVInt).filter_by(key='db_version').first().value
-        except Exception:
+        for kv in session.query(DBKVInt):
+            self._kv_int[kv.key] = kv.value
+        for kv in session.query(DBKVString):
+            self._kv_string[kv.key] = kv.value
+
+        self.db_version = self.getIntKV('db_version')
+        if self.db_version is None:
             self.log.info('First run')
             self.db_version = CURRENT_DB_VERSION
-            session.add(DBKVInt(
-                key='db_version',
-                value=self.db_version
-            ))
+            self.setIntKVInSession('db_version', self.db_version, session)
             session.commit()
-        try:
-            self.db_data_version = session.query(DBKVInt).filter_by(key='db_data_version').first().value
-        except Exception:
-            self.db_data_version = 0
-        try:
-            self._contract_count = session.query(DBKVInt).filter_by(key='contract_count').first().value
-        except Exception:
+        self.db_data_version = self.getIntKV('db_data_version', 0)
+        self._contract_count = self.getIntKV('contract_count')
+        if self._contract_count is None:
             self._contract_count = 0
-            session.add(DBKVInt(
-                key='contract_count',
-                value=self._contract_count
-            ))
+            self.setIntKVInSession('contract_count', self._contract_count, session)
             session.commit()
         session.close()
         session.remove()
@@ -357,6 +521,12 @@ class BasicSwap(BaseApp):
             self.thread_pool.shutdown(cancel_futures=True)
         else:
             self.thread_pool.shutdown()
+        self.rate_service.shutdown()
+        self.explorer_pool.shutdown(wait=False)
+        for c, cc in self.coin_clients.items():
+            for exp in cc['explorers']:
+                exp.close()
+        self.profiler.stop()
 
         self.zmqContext.destroy()
 
@@ -380,13 +550,7 @@ class BasicSwap(BaseApp):
                 rpcauth = chain_client_settings['rpcuser'] + ':' + chain_client_settings['rpcpassword']
                 self.log.debug('Read %s rpc credentials from json settings', coin)
 
-        session = scoped_session(self.session_factory)
-        try:
-            last_height_checked = session.query(DBKVInt).filter_by(key='last_height_checked_' + chainparams[coin]['name']).first().value
-        except Exception:
-            last_height_checked = 0
-        session.close()
-        session.remove()
+        last_height_checked = self.getIntKV('last_height_checked_' + chainparams[coin]['name'], 0)
 
         coin_chainparams = chainparams[coin]
         default_segwit = coin_chainparams.get('has_segwit', False)
@@ -418,6 +582,12 @@ class BasicSwap(BaseApp):
             'chain_height': None,
             'chain_best_block': None,
             'chain_median_time': None,
+
+            # Startup state
+            'ready': False,
+            'startup_state': None,
+            'startup_tries': 0,
+            'startup_seconds': None,
         }
 
         if coin == Coins.PART:
@@ -436,6 +606,8 @@ class BasicSwap(BaseApp):
                     self.coin_clients[coin]['walletrpcauth'] = (chain_client_settings['walletrpcuser'], chain_client_settings['walletrpcpassword'])
                 else:
                     raise ValueError('Missing XMR wallet rpc credentials.')
+                nameRPCEndpoint(self.coin_clients[coin]['walletrpchost'], self.coin_clients[coin]['walletrpcport'], coin_chainparams['name'] + '_wallet')
+            nameRPCEndpoint(self.coin_clients[coin]['rpchost'], self.coin_clients[coin]['rpcport'], coin_chainparams['name'])
 
     def selectXMRRemoteDaemon(self, coin):
         self.log.info('Selecting remote XMR daemon.')
@@ -480,26 +652,34 @@ class BasicSwap(BaseApp):
         return self.coin_clients[coin]['interface']
 
     def createInterface(self, coin):
+        # Interfaces are imported on first use, disabled coins don't load their dependencies
         if coin == Coins.PART:
+            from .interface.part import PARTInterface
             return PARTInterface(self.coin_clients[coin], self.chain, self)
         elif coin == Coins.BTC:
+            from .interface.btc import BTCInterface
             return BTCInterface(self.coin_clients[coin], self.chain, self)
         elif coin == Coins.LTC:
+            from .interface.ltc import LTCInterface
             return LTCInterface(self.coin_clients[coin], self.chain, self)
         elif coin == Coins.NMC:
+            from .interface.nmc import NMCInterface
             return NMCInterface(self.coin_clients[coin], self.chain, self)
         elif coin == Coins.XMR:
+            from .interface.xmr import XMRInterface
             xmr_i = XMRInterface(self.coin_clients[coin], self.chain, self)
             chain_client_settings = self.getChainClientSettings(coin)
             xmr_i.setWalletFilename(chain_client_settings['walletfile'])
             return xmr_i
         elif coin == Coins.PIVX:
+            from .interface.pivx import PIVXInterface
             return PIVXInterface(self.coin_clients[coin], self.chain, self)
         else:
             raise ValueError('Unknown coin type')
 
     def createPassthroughInterface(self, coin):
         if coin == Coins.BTC:
+            from .interface.passthrough_btc import PassthroughBTCInterface
             return PassthroughBTCInterface(self.coin_clients[coin], self.chain)
         else:
             raise ValueError('Unknown coin type')
@@ -552,6 +732,7 @@ class BasicSwap(BaseApp):
         if self.coin_clients[coin]['connection_type'] == 'rpc':
             self.coin_clients[coin]['interface'] = self.createInterface(coin)
             if coin == Coins.PART:
+                from .interface.part import PARTInterfaceAnon, PARTInterfaceBlind
                 self.coin_clients[coin]['interface_anon'] = PARTInterfaceAnon(self.coin_clients[coin], self.chain, self)
                 self.coin_clients[coin]['interface_blind'] = PARTInterfaceBlind(self.coin_clients[coin], self.chain, self)
         elif self.coin_clients[coin]['connection_type'] == 'passthrough':
@@ -564,47 +745,34 @@ class BasicSwap(BaseApp):
 
         upgradeDatabase(self, self.db_version)
         upgradeDatabaseData(self, self.db_data_version)
+        self.loadWalletSnapshots()
+
+        t = threading.Thread(target=threadFlushEventLog, args=(self,))
+        self.threads.append(t)
+        t.start()
 
+        # Interfaces must exist for every coin before initialise() loads the active swaps
         for c in Coins:
             if c not in chainparams:
                 continue
             self.setCoinRunParams(c)
             self.createCoinInterface(c)
 
-            if self.coin_clients[c]['connection_type'] == 'rpc':
-                self.waitForDaemonRPC(c)
-                ci = self.ci(c)
-                core_version = ci.getDaemonVersion()
-                self.log.info('%s Core version %d', ci.coin_name(), core_version)
-                self.coin_clients[c]['core_version'] = core_version
-
-                if c == Coins.XMR:
-                    t = threading.Thread(target=threadPollXMRChainState, args=(self, c))
-                else:
-                    t = threading.Thread(target=threadPollChainState, args=(self, c))
-                self.threads.append(t)
-                t.start()
-
-                if c == Coins.PART:
-                    self.coin_clients[c]['have_spent_index'] = ci.haveSpentIndex()
-
-                    try:
-                        # Sanity checks
-                        rv = self.callcoinrpc(c, 'extkey')
-                        if 'result' in rv and 'No keys to list.' in rv['result']:
-                            raise ValueError('No keys loaded.')
-
-                        if self.callcoinrpc(c, 'getstakinginfo')['enabled'] is not False:
-                            self.log.warning('%s staking is not disabled.', ci.coin_name())
-                    except Exception as e:
-                        self.log.error('Sanity checks failed: %s', str(e))
-
-                elif c == Coins.XMR:
-                    ci.ensureWalletExists()
+        # Coins are brought online concurrently, Particl is required for smsg before initialising
+        for c in Coins:
+            if c not in chainparams or self.coin_clients[c]['connection_type'] != 'rpc':
+                continue
+            t = threading.Thread(target=self.startCoin, args=(c,), name='start_' + self.coin_clients[c]['name'])
+            self._startup_threads[c] = t
+            self.threads.append(t)
+            t.start()
 
-                self.checkWalletSeed(c)
+        self._startup_threads[Coins.PART].join()
+        if not self.isCoinReady(Coins.PART):
+            raise ValueError('Particl failed to start')
 
         if 'p2p_host' in self.settings:
+            import basicswap.network as bsn
             network_key = self.getNetworkKey(1)
             self._network = bsn.Network(self.settings['p2p_host'], self.settings['p2p_port'], network_key, self)
             self._network.startNetwork()
@@ -648,24 +816,178 @@ class BasicSwap(BaseApp):
             if self.coin_clients[c]['connection_type'] == 'rpc' and chain_client_settings['manage_daemon'] is True:
                 self.stopDaemon(c)
 
-    def waitForDaemonRPC(self, coin_type, with_wallet=True):
-        for i in range(self.startup_tries):
-            if not self.is_running:
-                return
+    def subscribeChainTip(self, callback):
+        # callback(coin_type, chain_state) is called from the chain state thread of the coin
+        self._chain_tip_subscribers.append(callback)
+
+    def setChainTip(self, coin_type, chain_state):
+        cc = self.coin_clients[coin_type]
+        self.log.debug('New {} block at height: {}'.format(str(coin_type), chain_state['blocks']))
+        with self.mxDB:
+            cc['chain_height'] = chain_state['blocks']
+            if 'bestblockhash' in chain_state:
+                cc['chain_best_block'] = chain_state['bestblockhash']
+            if 'mediantime' in chain_state:
+                cc['chain_median_time'] = chain_state['mediantime']
+
+        for callback in self._chain_tip_subscribers:
             try:
-                self.coin_clients[coin_type]['interface'].testDaemonRPC(with_wallet)
+                callback(coin_type, chain_state)
+            except Exception as e:
+                self.log.error('Chain tip subscriber {} failed: {}'.format(getattr(callback, '__name__', callback), str(e)))
+
+    def onNewChainTip(self, coin_type, chain_state):
+        self.clearFeeRateCache(coin_type)
+        self.clearUnspentsCache(coin_type)
+        for exp in self.coin_clients[coin_type]['explorers']:
+            exp.setChainHeight(chain_state['blocks'])
+
+        # Run the checks waiting on confirmations at the next update
+        self._last_checked_progress = 0
+        self._last_checked_watched = 0
+        self._last_checked_xmr_swaps = 0
+
+    def startCoin(self, c):
+        cc = self.coin_clients[c]
+        cc['startup_state'] = 'starting'
+        t_start = time.time()
+        try:
+            if not self.waitForDaemonRPC(c):
+                cc['startup_state'] = 'failed'
+                self._check_deferred_msgs = True
                 return
+            ci = self.ci(c)
+            core_version = ci.getDaemonVersion()
+            self.log.info('%s Core version %d', ci.coin_name(), core_version)
+            cc['core_version'] = core_version
+
+            if c == Coins.PART:
+                cc['have_spent_index'] = ci.haveSpentIndex()
+
+                try:
+                    # Sanity checks
+                    rv = self.callcoinrpc(c, 'extkey')
+                    if 'result' in rv and 'No keys to list.' in rv['result']:
+                        raise ValueError('No keys loaded.')
+
+                    if self.callcoinrpc(c, 'getstakinginfo')['enabled'] is not False:
+                        self.log.warning('%s staking is not disabled.', ci.coin_name())
+                except Exception as e:
+                    self.log.error('Sanity checks failed: %s', str(e))
+
+            elif c == Coins.XMR:
+                ci.ensureWalletExists()
+
+            self.checkWalletSeed(c)
+
+            with self.mxDB:
+                if self.delay_event.is_set():
+                    cc['startup_state'] = 'failed'
+                    return
+                if c == Coins.XMR:
+                    t = threading.Thread(target=threadPollXMRChainState, args=(self, c))
+                else:
+                    t = threading.Thread(target=threadPollChainState, args=(self, c))
+                self.threads.append(t)
+                t.start()
+
+                cc['startup_seconds'] = time.time() - t_start
+                cc['startup_state'] = 'ready'
+                cc['ready'] = True
+                # Process swaps waiting on this coin at the next update
+                self._last_checked_progress = 0
+                self._last_checked_actions = 0
+                self._last_checked_xmr_swaps = 0
+                self._check_deferred_msgs = True
+            self.log.info('%s ready in %.2fs after %d RPC tries.', ci.coin_name(), cc['startup_seconds'], cc['startup_tries'])
+        except Exception as ex:
+            cc['startup_state'] = 'failed'
+            self._check_deferred_msgs = True
+            self.log.error('Failed to start %s: %s', cc['name'], str(ex))
+            if self.debug:
+                self.log.error(traceback.format_exc())
+            if c == Coins.PART:
+                # Required for smsg
+                self.stopRunning(1)
+
+    def isCoinReady(self, coin_type):
+        if coin_type in (Coins.PART_ANON, Coins.PART_BLIND):
+            coin_type = Coins.PART
+        cc = self.coin_clients.get(coin_type, None)
+        return cc is not None and cc['ready']
+
+    def isCoinStarting(self, coin_type):
+        cc = self.coin_clients.get(coin_type, None)
+        return cc is not None and cc['connection_type'] == 'rpc' and cc['startup_state'] in (None, 'starting')
+
+    def areSwapCoinsReady(self, offer):
+        return self.isCoinReady(Coins(offer.coin_from)) and self.isCoinReady(Coins(offer.coin_to))
+
+    def waitForCoinsReady(self, timeout=None):
+        for c, t in self._startup_threads.items():
+            t.join(timeout)
+        return all(self.isCoinReady(c) for c in self._startup_threads)
+
+    def startProfile(self, seconds, interval_ms=10):
+        ensure(seconds > 0 and seconds <= self.profile_max_seconds, 'Profile duration must be between 1 and {} seconds'.format(self.profile_max_seconds))
+        ensure(interval_ms >= 1 and interval_ms <= 1000, 'Profile interval must be between 1 and 1000 ms')
+        self.log.info('Profiling all threads for %d seconds every %d ms', seconds, interval_ms)
+        self.profiler.start(seconds, interval_ms / 1000)
+
+    def getProfileStatus(self):
+        rv = self.profiler.getStatus()
+        rv['top_functions'] = [{'function': name, 'self_samples': count, 'total_samples': total} for name, count, total in self.profiler.topFunctions()]
+        return rv
+
+    def getStartupStats(self):
+        rv = []
+        for c in Coins:
+            if c not in chainparams:
+                continue
+            cc = self.coin_clients[c]
+            if cc['connection_type'] != 'rpc':
+                continue
+            rv.append({
+                'name': cc['name'].capitalize(),
+                'state': cc['startup_state'],
+                'tries': cc['startup_tries'],
+                'seconds': cc['startup_seconds'],
+            })
+        return rv
+
+    def waitForDaemonRPC(self, coin_type, with_wallet=True):
+        # Retries with exponential backoff for as long as the startup_tries linear schedule allowed
+        cc = self.coin_clients[coin_type]
+        timeout = self.startup_tries * (self.startup_tries + 1) // 2
+        t_start = time.time()
+        delay = self.startup_min_delay
+        cc['startup_tries'] = 0
+        while self.is_running:
+            cc['startup_tries'] += 1
+            try:
+                cc['interface'].testDaemonRPC(with_wallet)
+                return True
             except Exception as ex:
-                self.log.warning('Can\'t connect to %s RPC: %s.  Trying again in %d second/s.', coin_type, str(ex), (1 + i))
-                time.sleep(1 + i)
+                waited = time.time() - t_start
+                if waited >= timeout:
+                    break
+                delay = min(delay, timeout - waited)
+                self.log.warning('Can\'t connect to %s RPC: %s.  Trying again in %.1f second/s.', coin_type, str(ex), delay)
+                self.delay_event.wait(delay)
+                delay = min(delay * 2, self.startup_max_delay)
+        if not self.is_running:
+            return False
         self.log.error('Can\'t connect to %s RPC, exiting.', coin_type)
         self.stopRunning(1)  # systemd will try to restart the process if fail_code != 0
+        return False
 
     def checkSynced(self, coin_from, coin_to):
         check_coins = (coin_from, coin_to)
         for c in check_coins:
             if self.coin_clients[c]['connection_type'] != 'rpc':
                 continue
+            if not self.isCoinReady(c):
+                raise ValueError('{} is not ready.'.format(self.coin_clients[c]['name']))
             if c == Coins.XMR:
                 continue  # TODO
             synced = round(self.ci(c).getBlockchainInfo()['verificationprogress'], 3)
@@ -714,6 +1036,12 @@ class BasicSwap(BaseApp):
         identity_stats.updated_at = int(time.time())
         session.add(identity_stats)
 
+    def getIntKV(self, str_key, default=None):
+        return self._kv_int.get(str_key, default)
+
+    def getStringKV(self, str_key, default=None):
+        return self._kv_string.get(str_key, default)
+
     def setIntKVInSession(self, str_key, int_val, session):
         kv = session.query(DBKVInt).filter_by(key=str_key).first()
         if not kv:
@@ -721,8 +1049,40 @@ class BasicSwap(BaseApp):
         else:
             kv.value = int_val
         session.add(kv)
+        session.info.setdefault('kv_changes', []).append((DBKVInt, str_key, int_val))
 
-    def setIntKV(self, str_key, int_val):
+    def setStringKVInSession(self, str_key, str_val, session):
+        kv = session.query(DBKVString).filter_by(key=str_key).first()
+        if not kv:
+            kv = DBKVString(key=str_key, value=str_val)
+        else:
+            kv.value = str_val
+        session.add(kv)
+        session.info.setdefault('kv_changes', []).append((DBKVString, str_key, str_val))
+
+    def applyKVChanges(self, session):
+        # The cache is updated once the session commits
+        changes = session.info.pop('kv_changes', None)
+        if not changes:
+            return
+        with self.mxKV:
+            for table, str_key, value in changes:
+                if table == DBKVInt:
+                    self._kv_int[str_key] = value
+                else:
+                    self._kv_string[str_key] = value
+                self._kv_pending.pop((table, str_key), None)
+
+    def discardKVChanges(self, session):
+        session.info.pop('kv_changes', None)
+
+    def setIntKV(self, str_key, int_val, delay_write=False):
+        # delay_write: Only for values that are safe to lose, the write is committed with the next flush
+        if delay_write:
+            with self.mxKV:
+                self._kv_int[str_key] = int_val
+                self._kv_pending[(DBKVInt, str_key)] = int_val
+            return
         self.mxDB.acquire()
         try:
             session = scoped_session(self.session_factory)
@@ -737,43 +1097,52 @@ class BasicSwap(BaseApp):
         with self.mxDB:
             try:
                 session = scoped_session(self.session_factory)
-                kv = session.query(DBKVString).filter_by(key=str_key).first()
-                if not kv:
-                    kv = DBKVString(key=str_key, value=str_val)
-                else:
-                    kv.value = str_val
-                session.add(kv)
+                self.setStringKVInSession(str_key, str_val, session)
                 session.commit()
             finally:
                 session.close()
                 session.remove()
 
-    def getStringKV(self, str_key):
-        self.mxDB.acquire()
+    def flushPendingKV(self):
+        with self.mxKV:
+            if len(self._kv_pending) < 1:
+                return
+            pending = self._kv_pending
+            self._kv_pending = {}
+
         try:
-            session = scoped_session(self.session_factory)
-            v = session.query(DBKVString).filter_by(key=str_key).first()
-            if not v:
-                return None
-            return v.value
-        finally:
-            session.close()
-            session.remove()
-            self.mxDB.release()
+            with self.mxDB:
+                session = scoped_session(self.session_factory)
+                try:
+                    for (table, str_key), value in pending.items():
+                        session.merge(table(key=str_key, value=value))
+                    session.commit()
+                finally:
+                    session.close()
+                    session.remove()
+        except Exception as e:
+            self.log.error('flushPendingKV failed: {}'.format(str(e)))
+            with self.mxKV:
+                for k, v in pending.items():
+                    self._kv_pending.setdefault(k, v)
 
-    def activateBid(self, session, bid):
+    def activateBid(self, session, bid, offer=None, xmr_swap=None, load_txns=True):
+        # offer, xmr_swap and the bid txns can be passed in if already loaded
         if bid.bid_id in self.swaps_in_progress:
             self.log.debug('Bid %s is already in progress', bid.bid_id.hex())
 
         self.log.debug('Loading active bid %s', bid.bid_id.hex())
 
-        offer = session.query(Offer).filter_by(offer_id=bid.offer_id).first()
+        if offer is None:
+            offer = session.query(Offer).filter_by(offer_id=bid.offer_id).first()
         if not offer:
             raise ValueError('Offer not found')
 
-        self.loadBidTxns(bid, session)
+        if load_txns:
+            self.loadBidTxns(bid, session)
         if offer.swap_type == SwapTypes.XMR_SWAP:
-            xmr_swap = session.query(XmrSwap).filter_by(bid_id=bid.bid_id).first()
+            if xmr_swap is None:
+                xmr_swap = session.query(XmrSwap).filter_by(bid_id=bid.bid_id).first()
             self.watchXmrSwap(bid, offer, xmr_swap)
         else:
             self.swaps_in_progress[bid.bid_id] = (bid, offer)
@@ -830,9 +1199,9 @@ class BasicSwap(BaseApp):
 
             # Remove any delayed events
             if self.debug:
-                use_session.execute('UPDATE actions SET active_ind = 2 WHERE linked_id = x\'{}\' '.format(bid.bid_id.hex()))
+                use_session.execute('UPDATE actions SET active_ind = :done WHERE linked_id = :bid_id', {'done': int(ActionStates.DONE), 'bid_id': bid.bid_id})
             else:
-                use_session.execute('DELETE FROM actions WHERE linked_id = x\'{}\' '.format(bid.bid_id.hex()))
+                use_session.execute('DELETE FROM actions WHERE linked_id = :bid_id', {'bid_id': bid.bid_id})
 
             # Unlock locked inputs (TODO)
             if offer.swap_type == SwapTypes.XMR_SWAP:
@@ -858,27 +1227,57 @@ class BasicSwap(BaseApp):
                 use_session.remove()
                 self.mxDB.release()
 
+    def loadActiveBids(self, session, batch_size=500):
+        # Returns (bid, offer, xmr_swap) for each bid that should be in progress, bid txns are set
+        # in_progress is split into = 0 and IS NULL so each term can use bids_progress_index
+        bids = session.query(Bid).filter(sa.or_(
+            Bid.in_progress == 1,
+            sa.and_(Bid.in_progress == 0, Bid.state > BidStates.BID_RECEIVED, Bid.state < BidStates.SWAP_COMPLETED),
+            sa.and_(Bid.in_progress.is_(None), Bid.state > BidStates.BID_RECEIVED, Bid.state < BidStates.SWAP_COMPLETED))).all()
+
+        bid_ids = [bid.bid_id for bid in bids]
+        offer_ids = list(set([bid.offer_id for bid in bids]))
+        offers = {}
+        xmr_swaps = {}
+        bid_txns = {bid_id: [] for bid_id in bid_ids}
+        for i in range(0, len(offer_ids), batch_size):
+            for offer in session.query(Offer).filter(Offer.offer_id.in_(offer_ids[i: i + batch_size])):
+                offers[offer.offer_id] = offer
+        for i in range(0, len(bid_ids), batch_size):
+            batch_ids = bid_ids[i: i + batch_size]
+            for stx in session.query(SwapTx).filter(SwapTx.bid_id.in_(batch_ids)):
+                bid_txns[stx.bid_id].append(stx)
+            for xmr_swap in session.query(XmrSwap).filter(XmrSwap.bid_id.in_(batch_ids)):
+                xmr_swaps[xmr_swap.bid_id] = xmr_swap
+
+        rv = []
+        for bid in bids:
+            self.setBidTxns(bid, bid_txns[bid.bid_id])
+            rv.append((bid, offers.get(bid.offer_id, None), xmr_swaps.get(bid.bid_id, None)))
+        return rv
+
     def loadFromDB(self):
         self.log.info('Loading data from db')
         self.mxDB.acquire()
         try:
             session = scoped_session(self.session_factory)
-            for bid in session.query(Bid):
-                if bid.in_progress == 1 or (bid.state and bid.state > BidStates.BID_RECEIVED and bid.state < BidStates.SWAP_COMPLETED):
+            for bid, offer, xmr_swap in self.loadActiveBids(session):
+                try:
+                    self.activateBid(session, bid, offer, xmr_swap, load_txns=False)
+                except Exception as ex:
+                    self.log.error('Failed to activate bid! Error: %s', str(ex))
+                    if self.debug:
+                        self.log.error(traceback.format_exc())
                     try:
-                        self.activateBid(session, bid)
+                        bid.setState(BidStates.BID_ERROR, 'Failed to activate')
+                        self.deactivateBid(session, offer, bid)
                     except Exception as ex:
-                        self.log.error('Failed to activate bid! Error: %s', str(ex))
+                        self.log.error('Further error deactivating: %s', str(ex))
                         if self.debug:
                             self.log.error(traceback.format_exc())
-                        try:
-                            bid.setState(BidStates.BID_ERROR, 'Failed to activate')
-                            offer = session.query(Offer).filter_by(offer_id=bid.offer_id).first()
-                            self.deactivateBid(session, offer, bid)
-                        except Exception as ex:
-                            self.log.error('Further error deactivating: %s', str(ex))
-                            if self.debug:
-                                self.log.error(traceback.format_exc())
+
+            for row in session.execute('SELECT trigger_at FROM actions WHERE active_ind = 1'):
+                heapq.heappush(self._action_triggers, row[0])
         finally:
             session.close()
             session.remove()
@@ -912,8 +1311,8 @@ class BasicSwap(BaseApp):
         nm = 0
         for msg in ro['messages']:
             # TODO: Remove workaround for smsginbox bug
-            get_msg = self.callrpc('smsg', [msg['msgid'], {'encoding': 'hex', 'setread': True}])
-            self.processMsg(get_msg)
+            get_msg = self.callrpc('smsg', [msg['msgid'], {'encoding': 'hex', 'setread': False}])
+            self.processSmsg(get_msg)
             nm += 1
         self.log.info('Scanned %d unread messages.', nm)
 
@@ -1306,6 +1705,7 @@ class BasicSwap(BaseApp):
             session = scoped_session(self.session_factory)
             record = session.query(PooledAddress).filter(sa.and_(PooledAddress.coin_type == int(coin_type), PooledAddress.bid_id == None)).first()  # noqa: E712,E711
             if not record:
+                self.log.warning('Address pool for %s is empty', str(coin_type))
                 address = self.getReceiveAddressForCoin(coin_type)
                 record = PooledAddress(
                     addr=address,
@@ -1338,13 +1738,108 @@ class BasicSwap(BaseApp):
             session.remove()
             self.mxDB.release()
 
+    def takeAddressFromPool(self, coin_type, session):
+        # Remove an unused address from the pool, returns None if the pool is empty
+        record = session.query(PooledAddress).filter(sa.and_(PooledAddress.coin_type == int(coin_type), PooledAddress.bid_id == None)).first()  # noqa: E712,E711
+        if not record:
+            return None
+        session.delete(record)
+        return record.addr
+
+    def fillAddressPool(self):
+        try:
+            for c in Coins:
+                if c not in chainparams or c in non_script_type_coins:
+                    continue
+                cc = self.coin_clients[c]
+                if cc['connection_type'] != 'rpc' or not cc['ready']:
+                    continue
+                try:
+                    self.fillCoinAddressPool(c, cc)
+                except Exception as e:
+                    self.log.error(f'fillAddressPool {c.name} {e}')
+                    if self.debug:
+                        self.log.error(traceback.format_exc())
+        finally:
+            self._filling_address_pool = False
+
+    def fillCoinAddressPool(self, c, cc):
+        with self.mxDB:
+            session = scoped_session(self.session_factory)
+            try:
+                q = session.execute('SELECT COUNT(*) FROM addresspool WHERE coin_type = :coin_type AND bid_id IS NULL', {'coin_type': int(c)}).first()
+                num_unused = q[0]
+            finally:
+                session.close()
+                session.remove()
+
+        num_new = self.address_pool_size - num_unused
+        if num_new < 1:
+            return
+
+        # Generate outside of mxDB
+        new_addrs = self.ci(c).getNewAddresses(cc['use_segwit'], num_new)
+        self.log.debug('Adding %d addresses to %s pool', len(new_addrs), str(c))
+
+        with self.mxDB:
+            session = scoped_session(self.session_factory)
+            try:
+                for addr in new_addrs:
+                    session.add(PooledAddress(addr=addr, coin_type=int(c)))
+                session.commit()
+            finally:
+                session.close()
+                session.remove()
+
+    def checkAddressPool(self):
+        if self._filling_address_pool:
+            return
+        self._filling_address_pool = True
+        self.thread_pool.submit(self.fillAddressPool)
+
     def getReceiveAddressForCoin(self, coin_type):
         new_addr = self.ci(coin_type).getNewAddress(self.coin_clients[coin_type]['use_segwit'])
         self.log.debug('Generated new receive address %s for %s', new_addr, str(coin_type))
         return new_addr
 
+    def getCachedFeeRate(self, cache_key, coin_type, lookup_func):
+        cc = self.coin_clients[coin_type]
+        chain_tip = (cc['chain_height'], cc['chain_best_block'])
+        now = time.time()
+        with self.mxFeeRates:
+            cached = self._fee_rate_cache.get(cache_key, None)
+            if cached is not None and cached[1] == chain_tip and now - cached[2] < self.fee_rate_cache_seconds:
+                self._fee_rate_cache_hits += 1
+                return cached[0]
+            self._fee_rate_cache_misses += 1
+
+        rv = lookup_func()
+        with self.mxFeeRates:
+            self._fee_rate_cache[cache_key] = (rv, chain_tip, now)
+        return rv
+
+    def clearFeeRateCache(self, coin_type=None):
+        with self.mxFeeRates:
+            if coin_type is None:
+                self._fee_rate_cache.clear()
+                return
+            for k in [k for k in self._fee_rate_cache if k[0] == coin_type]:
+                del self._fee_rate_cache[k]
+
+    def getFeeRateCacheStats(self):
+        with self.mxFeeRates:
+            num_lookups = self._fee_rate_cache_hits + self._fee_rate_cache_misses
+            return {
+                'entries': len(self._fee_rate_cache),
+                'hits': self._fee_rate_cache_hits,
+                'misses': self._fee_rate_cache_misses,
+                'hit_rate': 0.0 if num_lookups == 0 else self._fee_rate_cache_hits / num_lookups,
+                'ttl_seconds': self.fee_rate_cache_seconds,
+            }
+
     def getRelayFeeRateForCoin(self, coin_type):
-        return self.callcoinrpc(coin_type, 'getnetworkinfo')['relayfee']
+        return self.getCachedFeeRate((coin_type, 'relayfee'), coin_type,
+                                     lambda: self.callcoinrpc(coin_type, 'getnetworkinfo')['relayfee'])
 
     def getFeeRateForCoin(self, coin_type, conf_target=2):
         chain_client_settings = self.getChainClientSettings(coin_type)
@@ -1353,7 +1848,8 @@ class BasicSwap(BaseApp):
             self.log.debug('Fee rate override used for %s: %f', str(coin_type), override_feerate)
             return override_feerate, 'override_feerate'
 
-        return self.ci(coin_type).get_fee_rate(conf_target)
+        return self.getCachedFeeRate((coin_type, conf_target), coin_type,
+                                     lambda: self.ci(coin_type).get_fee_rate(conf_target))
 
     def estimateWithdrawFee(self, coin_type, fee_rate):
         if coin_type == Coins.XMR:
@@ -1368,6 +1864,7 @@ class BasicSwap(BaseApp):
         self.log.info('withdrawCoin %s %s to %s %s', value, ci.ticker(), addr_to, ' subfee' if subfee else '')
 
         txid = ci.withdrawCoin(value, addr_to, subfee)
+        self.clearUnspentsCache(coin_type)
         self.log.debug('In txn: {}'.format(txid))
         return txid
 
@@ -1381,6 +1878,7 @@ class BasicSwap(BaseApp):
 
         ci = self.ci(Coins.PART)
         txid = ci.sendTypeTo(type_from, type_to, value, addr_to, subfee)
+        self.clearUnspentsCache(Coins.PART)
         self.log.debug('In txn: {}'.format(txid))
         return txid
 
@@ -1447,17 +1945,18 @@ class BasicSwap(BaseApp):
         # TODO: auto refresh after used
 
         key_str = 'receive_addr_' + chainparams[coin_type]['name']
+        addr = self.getStringKV(key_str)
+        if addr is not None:
+            return addr
         self.mxDB.acquire()
         try:
             session = scoped_session(self.session_factory)
-            try:
-                addr = session.query(DBKVString).filter_by(key=key_str).first().value
-            except Exception:
-                addr = self.getReceiveAddressForCoin(coin_type)
-                session.add(DBKVString(
-                    key=key_str,
-                    value=addr
-                ))
+            addr = self.getStringKV(key_str)
+            if addr is None:
+                addr = self.takeAddressFromPool(coin_type, session)
+                if addr is None:
+                    addr = self.getReceiveAddressForCoin(coin_type)
+                self.setStringKVInSession(key_str, addr, session)
                 session.commit()
         finally:
             session.close()
@@ -1470,18 +1969,17 @@ class BasicSwap(BaseApp):
 
         ci = self.ci(coin_type)
         key_str = 'stealth_addr_' + ci.coin_name().lower()
+        addr = self.getStringKV(key_str)
+        if addr is not None:
+            return addr
         self.mxDB.acquire()
         try:
             session = scoped_session(self.session_factory)
-            try:
-                addr = session.query(DBKVString).filter_by(key=key_str).first().value
-            except Exception:
+            addr = self.getStringKV(key_str)
+            if addr is None:
                 addr = ci.getNewStealthAddress()
                 self.log.info('Generated new stealth address for %s', coin_type)
-                session.add(DBKVString(
-                    key=key_str,
-                    value=addr
-                ))
+                self.setStringKVInSession(key_str, addr, session)
                 session.commit()
         finally:
             session.close()
@@ -1493,18 +1991,17 @@ class BasicSwap(BaseApp):
         self.log.debug('getCachedWalletRestoreHeight %s', ci.coin_name())
 
         key_str = 'restore_height_' + ci.coin_name().lower()
+        wrh = self.getIntKV(key_str)
+        if wrh is not None:
+            return wrh
         self.mxDB.acquire()
         try:
             session = scoped_session(self.session_factory)
-            try:
-                wrh = session.query(DBKVInt).filter_by(key=key_str).first().value
-            except Exception:
+            wrh = self.getIntKV(key_str)
+            if wrh is None:
                 wrh = ci.getWalletRestoreHeight()
                 self.log.info('Found restore height for %s, block %d', ci.coin_name(), wrh)
-                session.add(DBKVInt(
-                    key=key_str,
-                    value=wrh
-                ))
+                self.setIntKVInSession(key_str, wrh, session)
                 session.commit()
         finally:
             session.close()
@@ -1527,13 +2024,14 @@ class BasicSwap(BaseApp):
             session = scoped_session(self.session_factory)
             session.execute('UPDATE kv_int SET value = {} WHERE KEY="contract_count"'.format(self._contract_count))
             session.commit()
+            self._kv_int['contract_count'] = self._contract_count
         finally:
             session.close()
             session.remove()
             self.mxDB.release()
         return self._contract_count
 
-    def getUnspentsByAddr(self, coin_type):
+    def loadUnspentsForCoin(self, coin_type):
         ci = self.ci(coin_type)
 
         unspent_addr = dict()
@@ -1543,7 +2041,50 @@ class BasicSwap(BaseApp):
                 continue
             unspent_addr[u['address']] = unspent_addr.get(u['address'], 0) + ci.make_int(u['amount'], r=1)
 
-        return unspent_addr
+        by_value = sorted((value, addr) for addr, value in unspent_addr.items())
+        return unspent_addr, by_value
+
+    def getUnspentsCacheEntry(self, coin_type, use_cache=True):
+        cc = self.coin_clients[coin_type]
+        chain_tip = (cc['chain_height'], cc['chain_best_block'])
+        now = time.time()
+        if use_cache:
+            with self.mxUnspents:
+                cached = self._unspents_cache.get(coin_type, None)
+                if cached is not None and cached['chain_tip'] == chain_tip and now - cached['time'] < self.wallet_unspents_cache_seconds:
+                    return cached
+
+        unspent_addr, by_value = self.loadUnspentsForCoin(coin_type)
+        entry = {
+            'chain_tip': chain_tip,
+            'time': now,
+            'by_addr': unspent_addr,
+            'by_value': by_value,
+            'values': [v[0] for v in by_value],
+        }
+        with self.mxUnspents:
+            self._unspents_cache[coin_type] = entry
+        return entry
+
+    def getLockedOutpoints(self, coin_type):
+        with self.mxUnspents:
+            locked = self._locked_outpoints_cache.get(coin_type, None)
+        if locked is not None:
+            return locked
+        locked = frozenset((a['txid'], a['vout']) for a in self.ci(coin_type).rpc_callback('listlockunspent'))
+        with self.mxUnspents:
+            self._locked_outpoints_cache[coin_type] = locked
+        return locked
+
+    def clearUnspentsCache(self, coin_type):
+        with self.mxUnspents:
+            self._unspents_cache.pop(coin_type, None)
+            self._locked_outpoints_cache.pop(coin_type, None)
+        # Called after local spends and new blocks, the balances may have changed too
+        self.invalidateWalletSnapshot(coin_type)
+
+    def getUnspentsByAddr(self, coin_type, use_cache=True):
+        return dict(self.getUnspentsCacheEntry(coin_type, use_cache)['by_addr'])
 
     def getProofOfFunds(self, coin_type, amount_for, extra_commit_bytes):
         ci = self.ci(coin_type)
@@ -1553,13 +2094,13 @@ class BasicSwap(BaseApp):
             return (None, None)
 
         # TODO: Lock unspent and use same output/s to fund bid
-        unspent_addr = self.getUnspentsByAddr(coin_type)
+        unspents = self.getUnspentsCacheEntry(coin_type)
 
+        # Pick the address with the smallest balance that covers amount_for
         sign_for_addr = None
-        for addr, value in unspent_addr.items():
-            if value >= amount_for:
-                sign_for_addr = addr
-                break
+        i = bisect.bisect_left(unspents['values'], amount_for)
+        if i < len(unspents['by_value']):
+            sign_for_addr = unspents['by_value'][i][1]
 
         ensure(sign_for_addr is not None, 'Could not find address with enough funds for proof')
 
@@ -1629,6 +2170,8 @@ class BasicSwap(BaseApp):
             action_type=action_type,
             linked_id=linked_id)
         session.add(action)
+        with self.mxDB:
+            heapq.heappush(self._action_triggers, action.trigger_at)
 
     def createAction(self, delay, action_type, linked_id):
         # self.log.debug('createAction %d %s', action_type, linked_id.hex())
@@ -1654,23 +2197,167 @@ class BasicSwap(BaseApp):
         if session is not None:
             session.add(entry)
             return
+
+        coalesce_key = (linked_type, linked_id, entry.event_type, event_msg)
+        with self.mxEventLog:
+            last_written = self._event_log_last_written.get(coalesce_key, None)
+            if last_written is not None and entry.created_at - last_written < self.event_log_coalesce_seconds:
+                self._event_log_stats['rows_coalesced'] += 1
+                return
+            self._event_log_last_written[coalesce_key] = entry.created_at
+            self._event_log_buffer.append((time.time(), entry))
+            num_buffered = len(self._event_log_buffer)
+        if num_buffered >= self.event_log_flush_rows:
+            self._event_log_flush_event.set()
+
+    def flushEventLog(self):
+        with self.mxEventLog:
+            if len(self._event_log_buffer) < 1:
+                return
+            buffered = self._event_log_buffer
+            self._event_log_buffer = []
+
+        try:
+            with self.mxDB:
+                session = scoped_session(self.session_factory)
+                try:
+                    session.add_all([b[1] for b in buffered])
+                    session.commit()
+                finally:
+                    session.close()
+                    session.remove()
+        except Exception as e:
+            self.log.error('flushEventLog failed: {}'.format(str(e)))
+            with self.mxEventLog:
+                self._event_log_buffer = buffered + self._event_log_buffer
+            return
+
+        now = time.time()
+        latency_ms = int((now - buffered[0][0]) * 1000)
+        with self.mxEventLog:
+            stats = self._event_log_stats
+            stats['flushes'] += 1
+            stats['rows_written'] += len(buffered)
+            stats['last_flush_latency_ms'] = latency_ms
+            stats['max_flush_latency_ms'] = max(stats['max_flush_latency_ms'], latency_ms)
+
+            for k in [k for k, v in self._event_log_last_written.items() if now - v >= self.event_log_coalesce_seconds]:
+                del self._event_log_last_written[k]
+
+    def getEventLogStats(self):
+        with self.mxEventLog:
+            rv = dict(self._event_log_stats)
+            rv['rows_buffered'] = len(self._event_log_buffer)
+            return rv
+
+    def getBufferedEvents(self, linked_type, linked_id):
+        with self.mxEventLog:
+            return [b[1] for b in self._event_log_buffer if isinstance(b[1], EventLog) and b[1].linked_type == linked_type and b[1].linked_id == linked_id]
+
+    def addBidSpan(self, bid_id, span_type, name, started_at, duration, rpc_duration=0.0):
+        # Times in seconds, written with the buffered event log
+        entry = BidSpan(
+            bid_id=bid_id,
+            span_type=int(span_type),
+            name=name,
+            started_at=int(started_at * 1000),
+            duration=int(duration * 1000),
+            rpc_duration=int(rpc_duration * 1000))
+        with self.mxEventLog:
+            self._event_log_buffer.append((time.time(), entry))
+            num_buffered = len(self._event_log_buffer)
+        if num_buffered >= self.event_log_flush_rows:
+            self._event_log_flush_event.set()
+
+    def getBidSpans(self, bid_id, session=None, archived=False):
+        # Returns (span_type, name, started_at, duration, rpc_duration) tuples, times in milliseconds
+        use_session = None
+        try:
+            if session:
+                use_session = session
+            else:
+                self.mxDB.acquire()
+                use_session = scoped_session(archiveSessionFactory(self) if archived else self.session_factory)
+            q = use_session.execute('SELECT span_type, name, started_at, duration, rpc_duration FROM bid_spans WHERE bid_id = :bid_id ORDER BY started_at ASC', {'bid_id': bid_id})
+            spans = [(row[0], row[1], row[2], row[3], row[4]) for row in q]
+        finally:
+            if session is None:
+                use_session.close()
+                use_session.remove()
+                self.mxDB.release()
+        with self.mxEventLog:
+            spans += [(e.span_type, e.name, e.started_at, e.duration, e.rpc_duration) for _, e in self._event_log_buffer if isinstance(e, BidSpan) and e.bid_id == bid_id]
+        spans.sort(key=lambda x: x[2])
+        return spans
+
+    def getBidSpanStats(self, since):
+        # Duration percentiles in seconds per coin pair for bids active since the given time
+        pairs = {}
+
+        def getPair(coin_from, coin_to):
+            key = (coin_from, coin_to)
+            if key not in pairs:
+                pairs[key] = {'spans': {}, 'rpc': {}, 'confirmations': {}, 'total': []}
+            return pairs[key]
+
         self.mxDB.acquire()
         try:
             session = scoped_session(self.session_factory)
-            session.add(entry)
-            session.commit()
+            q = session.execute('''SELECT offers.coin_from, offers.coin_to, bid_spans.span_type, bid_spans.duration, bid_spans.rpc_duration FROM bid_spans
+                                   JOIN bids ON bids.bid_id = bid_spans.bid_id JOIN offers ON offers.offer_id = bids.offer_id
+                                   WHERE bid_spans.started_at >= :since_ms''', {'since_ms': since * 1000})
+            for row in q:
+                pair = getPair(row[0], row[1])
+                pair['spans'].setdefault(row[2], []).append(row[3] / 1000)
+                pair['rpc'].setdefault(row[2], []).append(zeroIfNone(row[4]) / 1000)
+
+            # From broadcast to confirmed for each swap txn
+            q = session.execute('''SELECT offers.coin_from, offers.coin_to, bid_state_history.tx_type,
+                                   MIN(CASE WHEN bid_state_history.state = :tx_sent THEN bid_state_history.created_at END),
+                                   MIN(CASE WHEN bid_state_history.state = :tx_confirmed THEN bid_state_history.created_at END) FROM bid_state_history
+                                   JOIN bids ON bids.bid_id = bid_state_history.bid_id JOIN offers ON offers.offer_id = bids.offer_id
+                                   WHERE bid_state_history.tx_type IS NOT NULL AND bid_state_history.created_at >= :since
+                                   GROUP BY bid_state_history.bid_id, bid_state_history.tx_type''',
+                                {'tx_sent': int(TxStates.TX_SENT), 'tx_confirmed': int(TxStates.TX_CONFIRMED), 'since': since})
+            for row in q:
+                if row[3] is not None and row[4] is not None:
+                    getPair(row[0], row[1])['confirmations'].setdefault(row[2], []).append(row[4] - row[3])
+
+            # From the first bid state to completed
+            q = session.execute('''SELECT offers.coin_from, offers.coin_to, MIN(bid_state_history.created_at),
+                                   MIN(CASE WHEN bid_state_history.state = :completed THEN bid_state_history.created_at END) FROM bid_state_history
+                                   JOIN bids ON bids.bid_id = bid_state_history.bid_id JOIN offers ON offers.offer_id = bids.offer_id
+                                   WHERE bid_state_history.tx_type IS NULL
+                                   GROUP BY bid_state_history.bid_id HAVING MIN(bid_state_history.created_at) >= :since''',
+                                {'completed': int(BidStates.SWAP_COMPLETED), 'since': since})
+            for row in q:
+                if row[3] is not None:
+                    getPair(row[0], row[1])['total'].append(row[3] - row[2])
         finally:
             session.close()
             session.remove()
             self.mxDB.release()
 
+        rv = []
+        for (coin_from, coin_to), pair in sorted(pairs.items()):
+            rv.append({
+                'coin_from': Coins(coin_from).name,
+                'coin_to': Coins(coin_to).name,
+                'completed': summariseDurations(pair['total']),
+                'spans': {strSpanType(k): dict(summariseDurations(v), rpc=summariseDurations(pair['rpc'][k])) for k, v in sorted(pair['spans'].items())},
+                'confirmations': {TxTypes(k).name: summariseDurations(v) for k, v in sorted(pair['confirmations'].items())},
+            })
+        return rv
+
     def logBidEvent(self, bid_id, event_type, event_msg, session):
         self.log.debug('logBidEvent %s %s', bid_id.hex(), event_type)
         self.logEvent(Concepts.BID, bid_id, event_type, event_msg, session)
 
     def countBidEvents(self, bid, event_type, session):
-        q = session.execute('SELECT COUNT(*) FROM eventlog WHERE linked_type = {} AND linked_id = x\'{}\' AND event_type = {}'.format(int(Concepts.BID), bid.bid_id.hex(), int(event_type))).first()
-        return q[0]
+        q = session.execute('SELECT COUNT(*) FROM eventlog WHERE linked_type = :linked_type AND linked_id = :linked_id AND event_type = :event_type',
+                            {'linked_type': int(Concepts.BID), 'linked_id': bid.bid_id, 'event_type': int(event_type)}).first()
+        num_buffered = sum(1 for e in self.getBufferedEvents(Concepts.BID, bid.bid_id) if e.event_type == int(event_type))
+        return q[0] + num_buffered
 
     def getEvents(self, linked_type, linked_id):
         events = []
@@ -1679,7 +2366,7 @@ class BasicSwap(BaseApp):
             session = scoped_session(self.session_factory)
             for entry in session.query(EventLog).filter(sa.and_(EventLog.linked_type == linked_type, EventLog.linked_id == linked_id)):
                 events.append(entry)
-            return events
+            return events + self.getBufferedEvents(linked_type, linked_id)
         finally:
             session.close()
             session.remove()
@@ -1784,8 +2471,11 @@ class BasicSwap(BaseApp):
             self.mxDB.release()
 
     def loadBidTxns(self, bid, session):
+        self.setBidTxns(bid, session.query(SwapTx).filter(sa.and_(SwapTx.bid_id == bid.bid_id)))
+
+    def setBidTxns(self, bid, swap_txns):
         bid.txns = {}
-        for stx in session.query(SwapTx).filter(sa.and_(SwapTx.bid_id == bid.bid_id)):
+        for stx in swap_txns:
             if stx.tx_type == TxTypes.ITX:
                 bid.initiate_tx = stx
             elif stx.tx_type == TxTypes.PTX:
@@ -1852,6 +2542,39 @@ class BasicSwap(BaseApp):
                 use_session.remove()
                 self.mxDB.release()
 
+    def getBidStateHistory(self, bid_id, session=None, archived=False):
+        # Returns (created_at, tx_type, state) tuples, tx_type is None for bid states
+        use_session = None
+        try:
+            if session:
+                use_session = session
+            else:
+                self.mxDB.acquire()
+                use_session = scoped_session(archiveSessionFactory(self) if archived else self.session_factory)
+            q = use_session.execute('SELECT created_at, tx_type, state FROM bid_state_history WHERE bid_id = :bid_id ORDER BY record_id ASC', {'bid_id': bid_id})
+            return [(row[0], row[1], row[2]) for row in q]
+        finally:
+            if session is None:
+                use_session.close()
+                use_session.remove()
+                self.mxDB.release()
+
+    def getPreviousBidState(self, bid_id, session=None, archived=False):
+        use_session = None
+        try:
+            if session:
+                use_session = session
+            else:
+                self.mxDB.acquire()
+                use_session = scoped_session(archiveSessionFactory(self) if archived else self.session_factory)
+            q = use_session.execute('SELECT state FROM bid_state_history WHERE bid_id = :bid_id AND tx_type IS NULL ORDER BY record_id DESC LIMIT 1 OFFSET 1', {'bid_id': bid_id}).first()
+            return BidStates.BID_STATE_UNKNOWN if q is None else q[0]
+        finally:
+            if session is None:
+                use_session.close()
+                use_session.remove()
+                self.mxDB.release()
+
     def getBidAndOffer(self, bid_id, session=None):
         try:
             if session:
@@ -1871,31 +2594,93 @@ class BasicSwap(BaseApp):
                 use_session.remove()
                 self.mxDB.release()
 
-    def getXmrBidAndOffer(self, bid_id, list_events=True):
+    def getXmrBidAndOfferFromSession(self, session, bid_id, list_events=True):
+        xmr_swap = None
+        offer = None
+        xmr_offer = None
+        events = []
+
+        bid = session.query(Bid).filter_by(bid_id=bid_id).first()
+        if bid:
+            offer = session.query(Offer).filter_by(offer_id=bid.offer_id).first()
+            if offer and offer.swap_type == SwapTypes.XMR_SWAP:
+                xmr_swap = session.query(XmrSwap).filter_by(bid_id=bid.bid_id).first()
+                xmr_offer = session.query(XmrOffer).filter_by(offer_id=bid.offer_id).first()
+            self.loadBidTxns(bid, session)
+            if list_events:
+                events = self.list_bid_events(bid.bid_id, session)
+
+        return bid, xmr_swap, offer, xmr_offer, events
+
+    def getXmrBidAndOffer(self, bid_id, list_events=True, include_archived=False):
         self.mxDB.acquire()
         try:
             session = scoped_session(self.session_factory)
-            xmr_swap = None
-            offer = None
-            xmr_offer = None
-            events = []
-
-            bid = session.query(Bid).filter_by(bid_id=bid_id).first()
-            if bid:
-                offer = session.query(Offer).filter_by(offer_id=bid.offer_id).first()
-                if offer and offer.swap_type == SwapTypes.XMR_SWAP:
-                    xmr_swap = session.query(XmrSwap).filter_by(bid_id=bid.bid_id).first()
-                    xmr_offer = session.query(XmrOffer).filter_by(offer_id=bid.offer_id).first()
-                self.loadBidTxns(bid, session)
-                if list_events:
-                    events = self.list_bid_events(bid.bid_id, session)
+            rv = self.getXmrBidAndOfferFromSession(session, bid_id, list_events)
+            if rv[0] is not None or not include_archived or archiveSessionFactory(self) is None:
+                return rv
 
+            archive_session = scoped_session(archiveSessionFactory(self))
+            try:
+                bid, xmr_swap, offer, xmr_offer, events = self.getXmrBidAndOfferFromSession(archive_session, bid_id, list_events)
+                if bid is not None and offer is None:
+                    # The offer of an archived bid stays in the main db until it expires
+                    offer, xmr_offer = self.getXmrOfferFromSession(session, bid.offer_id)
+                    if offer and offer.swap_type == SwapTypes.XMR_SWAP:
+                        xmr_swap = archive_session.query(XmrSwap).filter_by(bid_id=bid_id).first()
+            finally:
+                archive_session.close()
+                archive_session.remove()
+            if bid is not None:
+                bid.archived = True
             return bid, xmr_swap, offer, xmr_offer, events
         finally:
             session.close()
             session.remove()
             self.mxDB.release()
 
+    def getBidDescriptionVersion(self, bid_id, include_archived=False):
+        self.mxDB.acquire()
+        try:
+            session = scoped_session(self.session_factory)
+            version = bidDescriptionVersion(session, bid_id)
+            if version is not None:
+                return version + (len(self.getBufferedEvents(Concepts.BID, bid_id)), )
+            if not include_archived or archiveSessionFactory(self) is None:
+                return None
+            archive_session = scoped_session(archiveSessionFactory(self))
+            try:
+                # Archived bids no longer change, and the archive has no identities table
+                q = archive_session.execute('SELECT state, state_time, debug_ind, bid_addr FROM bids WHERE bid_id = :bid_id', {'bid_id': bid_id}).first()
+            finally:
+                archive_session.close()
+                archive_session.remove()
+            if q is None:
+                return None
+            label = session.execute('SELECT label FROM knownidentities WHERE address = :address LIMIT 1', {'address': q[3]}).scalar()
+            return ('archived', q[0], q[1], q[2], label)
+        finally:
+            session.close()
+            session.remove()
+            self.mxDB.release()
+
+    def getCachedBidDescription(self, cache_key, version):
+        with self.mxBidDescriptions:
+            cached = self._bid_descriptions.get(cache_key, None)
+            if cached is None or cached[0] != version:
+                return None
+            self._bid_descriptions.move_to_end(cache_key)
+            return cached[1]
+
+    def setCachedBidDescription(self, cache_key, version, description):
+        if self.bid_description_cache_size < 1:
+            return
+        with self.mxBidDescriptions:
+            self._bid_descriptions[cache_key] = (version, description)
+            self._bid_descriptions.move_to_end(cache_key)
+            while len(self._bid_descriptions) > self.bid_description_cache_size:
+                self._bid_descriptions.popitem(last=False)
+
     def getIdentity(self, address):
         self.mxDB.acquire()
         try:
@@ -1929,6 +2714,8 @@ class BasicSwap(BaseApp):
         events = []
         for row in q:
             events.append({'at': row[0], 'desc': describeEventEntry(row[1], row[2])})
+        for entry in self.getBufferedEvents(Concepts.BID, bid_id):
+            events.append({'at': entry.created_at, 'desc': describeEventEntry(entry.event_type, entry.event_msg)})
 
         query_str = 'SELECT created_at, trigger_at FROM actions ' + \
                     'WHERE active_ind = 1 AND linked_id = x\'{}\' '.format(bid_id.hex())
@@ -2190,7 +2977,7 @@ class BasicSwap(BaseApp):
 
             last_bid_state = bid.state
             if last_bid_state == BidStates.SWAP_DELAYING:
-                last_bid_state = getLastBidState(bid.states)
+                last_bid_state = self.getPreviousBidState(bid_id)
 
             ensure(last_bid_state == BidStates.BID_RECEIVED, 'Wrong bid state: {}'.format(str(BidStates(last_bid_state))))
 
@@ -2235,6 +3022,7 @@ class BasicSwap(BaseApp):
                 xmr_swap.pkal, xmr_swap.pkaf, xmr_swap.vkbv
             )
             xmr_swap.a_lock_tx = ci_from.fundScriptLockTx(xmr_swap.a_lock_tx, xmr_offer.a_fee_rate, xmr_swap.vkbv)
+            self.clearUnspentsCache(coin_from)
 
             xmr_swap.a_lock_tx_id = ci_from.getTxid(xmr_swap.a_lock_tx)
             a_lock_tx_dest = ci_from.getScriptDest(xmr_swap.a_lock_tx_script)
@@ -2389,6 +3177,7 @@ class BasicSwap(BaseApp):
         self.log.debug('Create initiate txn for coin %s to %s for bid %s', str(coin_type), addr_to, bid_id.hex())
 
         txn_signed = ci.createRawSignedTransaction(addr_to, bid.amount)
+        self.clearUnspentsCache(coin_type)
         return txn_signed
 
     def deriveParticipateScript(self, bid_id, bid, offer):
@@ -2454,6 +3243,7 @@ class BasicSwap(BaseApp):
             addr_to = ci.encode_p2sh(participate_script)
 
         txn_signed = ci.createRawSignedTransaction(addr_to, amount_to)
+        self.clearUnspentsCache(coin_to)
 
         refund_txn = self.createRefundTxn(coin_to, txn_signed, offer, bid, participate_script, tx_type=TxTypes.PTX_REFUND)
         bid.participate_txn_refund = bytes.fromhex(refund_txn)
@@ -2780,13 +3570,12 @@ class BasicSwap(BaseApp):
 
         # bid saved in checkBidState
 
+    def queryExplorers(self, coin_type, method_name, *args):
+        return queryExplorers(self, coin_type, method_name, *args)
+
     def getAddressBalance(self, coin_type, address):
         if self.coin_clients[coin_type]['chain_lookups'] == 'explorer':
-            explorers = self.coin_clients[coin_type]['explorers']
-
-            # TODO: random offset into explorers, try blocks
-            for exp in explorers:
-                return exp.getBalance(address)
+            return self.queryExplorers(coin_type, 'getBalance', address)
         return self.lookupUnspentByAddress(coin_type, address, sum_output=True)
 
     def lookupChainHeight(self, coin_type):
@@ -2796,22 +3585,15 @@ class BasicSwap(BaseApp):
 
         ci = self.ci(coin_type)
         if self.coin_clients[coin_type]['chain_lookups'] == 'explorer':
-            explorers = self.coin_clients[coin_type]['explorers']
-
-            # TODO: random offset into explorers, try blocks
-            for exp in explorers:
-
-                # TODO: ExplorerBitAps use only gettransaction if assert_txid is set
-                rv = exp.lookupUnspentByAddress(address)
+            # TODO: ExplorerBitAps use only gettransaction if assert_txid is set
+            rv = self.queryExplorers(coin_type, 'lookupUnspentByAddress', address)
 
-                if assert_amount is not None:
-                    ensure(rv['value'] == int(assert_amount), 'Incorrect output amount in txn {}: {} != {}.'.format(assert_txid, rv['value'], int(assert_amount)))
-                if assert_txid is not None:
-                    ensure(rv['txid)'] == assert_txid, 'Incorrect txid')
+            if assert_amount is not None:
+                ensure(rv['value'] == int(assert_amount), 'Incorrect output amount in txn {}: {} != {}.'.format(assert_txid, rv['value'], int(assert_amount)))
+            if assert_txid is not None:
+                ensure(rv['txid)'] == assert_txid, 'Incorrect txid')
 
-                return rv
-
-            raise ValueError('No explorer for lookupUnspentByAddress {}'.format(str(coin_type)))
+            return rv
 
         if self.coin_clients[coin_type]['connection_type'] != 'rpc':
             raise ValueError('No RPC connection for lookupUnspentByAddress {}'.format(str(coin_type)))
@@ -3546,7 +4328,7 @@ class BasicSwap(BaseApp):
                 last_height_checked += 1
             if c['last_height_checked'] != last_height_checked:
                 c['last_height_checked'] = last_height_checked
-                self.setIntKV('last_height_checked_' + chainparams[coin_type]['name'], last_height_checked)
+                self.setIntKV('last_height_checked_' + chainparams[coin_type]['name'], last_height_checked, delay_write=True)
 
     def expireMessages(self):
         self.mxDB.acquire()
@@ -3570,17 +4352,24 @@ class BasicSwap(BaseApp):
             if num_messages + num_removed > 0:
                 self.log.info('Expired {} / {} messages.'.format(num_removed, num_messages))
 
-            self.log.debug('TODO: Expire records from db')
-
         finally:
             if rpc_conn:
                 ci_part.close_rpc(rpc_conn)
             self.mxDB.release()
 
+    def archiveSwaps(self):
+        self.flushEventLog()
+        older_than = int(time.time()) - self.archive_after_days * 24 * 60 * 60
+        return archiveSwaps(self, older_than)
+
     def countQueuedActions(self, session, bid_id, action_type):
         q = session.query(Action).filter(sa.and_(Action.active_ind == 1, Action.linked_id == bid_id, Action.action_type == int(action_type)))
         return q.count()
 
+    def actionsDue(self, now):
+        with self.mxDB:
+            return len(self._action_triggers) > 0 and self._action_triggers[0] <= now
+
     def checkQueuedActions(self):
         self.mxDB.acquire()
         now = int(time.time())
@@ -3588,8 +4377,22 @@ class BasicSwap(BaseApp):
         try:
             session = scoped_session(self.session_factory)
 
-            q = session.query(Action).filter(sa.and_(Action.active_ind == 1, Action.trigger_at <= now))
-            for row in q:
+            while len(self._action_triggers) > 0 and self._action_triggers[0] <= now:
+                heapq.heappop(self._action_triggers)
+
+            known_action_types = set(ActionTypes)
+
+            # Ordered so actions for the same bid run in the sequence they were queued
+            q = session.query(Action).filter(sa.and_(Action.active_ind == 1, Action.trigger_at <= now)).order_by(Action.trigger_at.asc(), Action.action_id.asc())
+            for row in q.all():
+                v = self.swaps_in_progress.get(row.linked_id, None)
+                if v is not None and not self.areSwapCoinsReady(v[1]):
+                    continue  # Runs once the coins are online
+                action_name = ActionTypes(row.action_type).name if row.action_type in known_action_types else str(row.action_type)
+                t_start = time.time()
+                rpc_start = threadRPCSeconds()
+                if not row.num_tries and row.created_at:
+                    self.addBidSpan(row.linked_id, SpanTypes.ACTION_DELAY, action_name, row.created_at, max(0, t_start - row.created_at))
                 try:
                     if row.action_type == ActionTypes.ACCEPT_BID:
                         self.acceptBid(row.linked_id)
@@ -3614,16 +4417,35 @@ class BasicSwap(BaseApp):
                     elif row.action_type == ActionTypes.REDEEM_ITX:
                         atomic_swap_1.redeemITx(self, row.linked_id, session)
                     else:
-                        self.log.warning('Unknown event type: %d', row.event_type)
+                        self.log.warning('Unknown action type: %d', row.action_type)
                 except Exception as ex:
                     if self.debug:
                         self.log.error(traceback.format_exc())
                     self.log.error('checkQueuedActions failed: {}'.format(str(ex)))
+                    self.addBidSpan(row.linked_id, SpanTypes.RUN_ACTION, action_name + ' failed', t_start, time.time() - t_start, threadRPCSeconds() - rpc_start)
+
+                    # Handlers can fail after sending a message or txn, only errors marked transient by the app or coin interfaces are retried
+                    is_transient = self.is_transient_error(ex)
+                    if not is_transient and v is not None:
+                        is_transient = self.ci(v[1].coin_from).is_transient_error(ex) or self.ci(v[1].coin_to).is_transient_error(ex)
+
+                    row.num_tries = zeroIfNone(row.num_tries) + 1
+                    if is_transient and row.num_tries < self.max_action_tries:
+                        delay = min(self.min_delay_retry * (2 ** (row.num_tries - 1)), self.max_delay_retry)
+                        self.log.info('Retrying action {} for {} in {} seconds'.format(row.action_type, row.linked_id.hex(), delay))
+                        row.trigger_at = now + delay
+                        heapq.heappush(self._action_triggers, row.trigger_at)
+                    else:
+                        row.active_ind = ActionStates.FAILED
+                    session.add(row)
+                    continue
+                self.addBidSpan(row.linked_id, SpanTypes.RUN_ACTION, action_name, t_start, time.time() - t_start, threadRPCSeconds() - rpc_start)
 
-            if self.debug:
-                session.execute('UPDATE actions SET active_ind = 2 WHERE trigger_at <= {}'.format(now))
-            else:
-                session.execute('DELETE FROM actions WHERE trigger_at <= {}'.format(now))
+                if self.debug:
+                    row.active_ind = ActionStates.DONE
+                    session.add(row)
+                else:
+                    session.delete(row)
 
             session.commit()
         finally:
@@ -3641,7 +4463,7 @@ class BasicSwap(BaseApp):
             session = scoped_session(self.session_factory)
             q = session.query(Bid).filter(Bid.state == BidStates.BID_RECEIVING)
             for bid in q:
-                q = session.execute('SELECT COUNT(*) FROM xmr_split_data WHERE bid_id = x\'{}\' AND msg_type = {}'.format(bid.bid_id.hex(), XmrSplitMsgTypes.BID)).first()
+                q = session.execute('SELECT COUNT(*) FROM xmr_split_data WHERE bid_id = :bid_id AND msg_type = :msg_type', {'bid_id': bid.bid_id, 'msg_type': int(XmrSplitMsgTypes.BID)}).first()
                 num_segments = q[0]
                 if num_segments > 1:
                     try:
@@ -3661,7 +4483,7 @@ class BasicSwap(BaseApp):
 
             q = session.query(Bid).filter(Bid.state == BidStates.BID_RECEIVING_ACC)
             for bid in q:
-                q = session.execute('SELECT COUNT(*) FROM xmr_split_data WHERE bid_id = x\'{}\' AND msg_type = {}'.format(bid.bid_id.hex(), XmrSplitMsgTypes.BID_ACCEPT)).first()
+                q = session.execute('SELECT COUNT(*) FROM xmr_split_data WHERE bid_id = :bid_id AND msg_type = :msg_type', {'bid_id': bid.bid_id, 'msg_type': int(XmrSplitMsgTypes.BID_ACCEPT)}).first()
                 num_segments = q[0]
                 if num_segments > 1:
                     try:
@@ -4011,6 +4833,7 @@ class BasicSwap(BaseApp):
             bid.created_at = msg['sent']
             bid.expire_at = msg['sent'] + bid_data.time_valid
             bid.was_received = True
+        self.noteMsgBid(bid)
         if len(bid_data.proof_address) > 0:
             bid.proof_address = bid_data.proof_address
 
@@ -4040,6 +4863,7 @@ class BasicSwap(BaseApp):
         bid_id = bid_accept_data.bid_msg_id
         bid, offer = self.getBidAndOffer(bid_id)
         ensure(bid is not None and bid.was_sent is True, 'Unknown bidid')
+        self.noteMsgBid(bid)
         ensure(offer, 'Offer not found ' + bid.offer_id.hex())
         coin_from = Coins(offer.coin_from)
         ci_from = self.ci(coin_from)
@@ -4275,6 +5099,7 @@ class BasicSwap(BaseApp):
             bid.created_at = msg['sent']
             bid.expire_at = msg['sent'] + bid_data.time_valid
             bid.was_received = True
+        self.noteMsgBid(bid)
 
         bid.setState(BidStates.BID_RECEIVING)
 
@@ -4304,6 +5129,7 @@ class BasicSwap(BaseApp):
         self.log.debug('for bid %s', msg_data.bid_msg_id.hex())
         bid, xmr_swap = self.getXmrBid(msg_data.bid_msg_id)
         ensure(bid, 'Bid not found: {}.'.format(msg_data.bid_msg_id.hex()))
+        self.noteMsgBid(bid)
         ensure(xmr_swap, 'XMR swap not found: {}.'.format(msg_data.bid_msg_id.hex()))
 
         offer, xmr_offer = self.getXmrOffer(bid.offer_id, sent=True)
@@ -4531,6 +5357,7 @@ class BasicSwap(BaseApp):
             self.logBidEvent(bid.bid_id, EventLogTypes.DEBUG_TWEAK_APPLIED, 'ind {}'.format(bid.debug_ind), session)
         try:
             b_lock_tx_id = ci_to.publishBLockTx(xmr_swap.pkbv, xmr_swap.pkbs, bid.amount_to, xmr_offer.b_fee_rate)
+            self.clearUnspentsCache(coin_to)
         except Exception as ex:
             error_msg = 'publishBLockTx failed for bid {} with error {}'.format(bid_id.hex(), str(ex))
             num_retries = self.countBidEvents(bid, EventLogTypes.FAILED_TX_B_LOCK_PUBLISH, session)
@@ -4798,6 +5625,7 @@ class BasicSwap(BaseApp):
 
         bid, xmr_swap = self.getXmrBid(bid_id)
         ensure(bid, 'Bid not found: {}.'.format(bid_id.hex()))
+        self.noteMsgBid(bid)
         ensure(xmr_swap, 'XMR swap not found: {}.'.format(bid_id.hex()))
 
         offer, xmr_offer = self.getXmrOffer(bid.offer_id, sent=False)
@@ -4860,6 +5688,7 @@ class BasicSwap(BaseApp):
 
         bid, xmr_swap = self.getXmrBid(bid_id)
         ensure(bid, 'Bid not found: {}.'.format(bid_id.hex()))
+        self.noteMsgBid(bid)
         ensure(xmr_swap, 'XMR swap not found: {}.'.format(bid_id.hex()))
 
         offer, xmr_offer = self.getXmrOffer(bid.offer_id, sent=False)
@@ -4904,7 +5733,8 @@ class BasicSwap(BaseApp):
         if msg_data.msg_type == XmrSplitMsgTypes.BID or msg_data.msg_type == XmrSplitMsgTypes.BID_ACCEPT:
             try:
                 session = scoped_session(self.session_factory)
-                q = session.execute('SELECT COUNT(*) FROM xmr_split_data WHERE bid_id = x\'{}\' AND msg_type = {} AND msg_sequence = {}'.format(msg_data.msg_id.hex(), msg_data.msg_type, msg_data.sequence)).first()
+                q = session.execute('SELECT COUNT(*) FROM xmr_split_data WHERE bid_id = :bid_id AND msg_type = :msg_type AND msg_sequence = :msg_sequence',
+                                    {'bid_id': msg_data.msg_id, 'msg_type': msg_data.msg_type, 'msg_sequence': msg_data.sequence}).first()
                 num_exists = q[0]
                 if num_exists > 0:
                     self.log.warning('Ignoring duplicate xmr_split_data entry: ({}, {}, {})'.format(msg_data.msg_id.hex(), msg_data.msg_type, msg_data.sequence))
@@ -4935,6 +5765,7 @@ class BasicSwap(BaseApp):
         bid_id = msg_data.bid_msg_id
         bid, xmr_swap = self.getXmrBid(bid_id)
         ensure(bid, 'Bid not found: {}.'.format(bid_id.hex()))
+        self.noteMsgBid(bid)
         ensure(xmr_swap, 'XMR swap not found: {}.'.format(bid_id.hex()))
 
         offer, xmr_offer = self.getXmrOffer(bid.offer_id, sent=False)
@@ -4964,10 +5795,21 @@ class BasicSwap(BaseApp):
         self.saveBid(bid_id, bid, xmr_swap=xmr_swap)
         self.swaps_in_progress[bid_id] = (bid, offer)
 
+    def noteMsgBid(self, bid):
+        # Called by the message handlers once the bid is known, processMsg records the timing spans of the message against it
+        if self._msg_bid is None:
+            self._msg_bid = (bid.bid_id, bid.state_time)
+
     def processMsg(self, msg):
         self.mxDB.acquire()
+        failed = False
         try:
+            self._msg_bid = None
+            t_start = time.time()
+            rpc_start = threadRPCSeconds()
             msg_type = int(msg['hex'][:2], 16)
+            if 'sent' in msg:
+                self._metric_smsg_lag.observe(max(0, t_start - msg['sent']), str(msg_type))
 
             rv = None
             if msg_type == MessageTypes.OFFER:
@@ -4992,6 +5834,7 @@ class BasicSwap(BaseApp):
                 self.processOfferRevoke(msg)
 
         except Exception as ex:
+            failed = True
             self.log.error('processMsg %s', str(ex))
             if self.debug:
                 self.log.error(traceback.format_exc())
@@ -5002,6 +5845,14 @@ class BasicSwap(BaseApp):
                               None)
 
         finally:
+            if self._msg_bid is not None:
+                bid_id, state_time = self._msg_bid
+                self._msg_bid = None
+                # A bid without a state time was created by the message, and is not saved if the message failed
+                if state_time is not None and state_time <= t_start:
+                    self.addBidSpan(bid_id, SpanTypes.PEER_WAIT, MessageTypes(msg_type).name, state_time, t_start - state_time)
+                if state_time is not None or not failed:
+                    self.addBidSpan(bid_id, SpanTypes.PROCESS_MSG, MessageTypes(msg_type).name + (' failed' if failed else ''), t_start, time.time() - t_start, threadRPCSeconds() - rpc_start)
             self.mxDB.release()
 
     def processZmqSmsg(self):
@@ -5012,7 +5863,7 @@ class BasicSwap(BaseApp):
             return  # TODO: Switch to paid?
 
         msg_id = message[2:]
-        options = {'encoding': 'hex', 'setread': True}
+        options = {'encoding': 'hex', 'setread': False}
         num_tries = 5
         for i in range(num_tries + 1):
             try:
@@ -5024,8 +5875,74 @@ class BasicSwap(BaseApp):
                 else:
                     raise e
 
+        self.processSmsg(msg)
+
+    def getMsgSwapCoins(self, msg):
+        # Coins of the offer a message is for, None if the message doesn't need them or the offer is unknown
+        msg_type = int(msg['hex'][:2], 16)
+        msg_bytes = bytes.fromhex(msg['hex'][2:-2])
+        if msg_type == MessageTypes.OFFER:
+            msg_data = OfferMessage()
+            msg_data.ParseFromString(msg_bytes)
+            return (msg_data.coin_from, msg_data.coin_to)
+
+        if msg_type == MessageTypes.BID or msg_type == MessageTypes.XMR_BID_FL:
+            msg_data = BidMessage() if msg_type == MessageTypes.BID else XmrBidMessage()
+            msg_data.ParseFromString(msg_bytes)
+            query_str = 'SELECT coin_from, coin_to FROM offers WHERE offer_id = :msg_id'
+            msg_id = msg_data.offer_msg_id
+        else:
+            message_classes = {
+                MessageTypes.BID_ACCEPT: BidAcceptMessage,
+                MessageTypes.XMR_BID_ACCEPT_LF: XmrBidAcceptMessage,
+                MessageTypes.XMR_BID_TXN_SIGS_FL: XmrBidLockTxSigsMessage,
+                MessageTypes.XMR_BID_LOCK_SPEND_TX_LF: XmrBidLockSpendTxMessage,
+                MessageTypes.XMR_BID_LOCK_RELEASE_LF: XmrBidLockReleaseMessage,
+            }
+            if msg_type not in message_classes:
+                return None
+            msg_data = message_classes[msg_type]()
+            msg_data.ParseFromString(msg_bytes)
+            query_str = 'SELECT o.coin_from, o.coin_to FROM bids b JOIN offers o ON o.offer_id = b.offer_id WHERE b.bid_id = :msg_id'
+            msg_id = msg_data.bid_msg_id
+
+        with self.mxDB:
+            session = scoped_session(self.session_factory)
+            try:
+                q = session.execute(query_str, {'msg_id': msg_id}).first()
+            finally:
+                session.close()
+                session.remove()
+        return None if q is None else (q[0], q[1])
+
+    def processSmsg(self, msg):
+        # Messages for a coin that is still starting are left unread and processed once it is ready
+        try:
+            coins = self.getMsgSwapCoins(msg)
+        except Exception as e:
+            # Rejected by the handler
+            self.log.debug('getMsgSwapCoins %s', str(e))
+            coins = None
+        if coins is not None and any(self.isCoinStarting(c) for c in coins):
+            self.log.debug('Deferring message %s until its coins are ready.', msg['msgid'])
+            self._deferred_msgs[msg['msgid']] = coins
+            return
+        self._deferred_msgs.pop(msg['msgid'], None)
+        self.callrpc('smsg', [msg['msgid'], {'encoding': 'none', 'setread': True}])
         self.processMsg(msg)
 
+    def processDeferredMsgs(self):
+        for msg_id, coins in list(self._deferred_msgs.items()):
+            if any(self.isCoinStarting(c) for c in coins):
+                continue
+            try:
+                msg = self.callrpc('smsg', [msg_id, {'encoding': 'hex', 'setread': False}])
+            except Exception as e:
+                self.log.warning('Deferred message %s: %s', msg_id, str(e))
+                self._deferred_msgs.pop(msg_id, None)
+                continue
+            self.processSmsg(msg)
+
     def update(self):
         try:
             # while True:
@@ -5039,49 +5956,88 @@ class BasicSwap(BaseApp):
             if self.debug:
                 self.log.error(traceback.format_exc())
 
+        if self._check_deferred_msgs:
+            self._check_deferred_msgs = False
+            try:
+                self.processDeferredMsgs()
+            except Exception as ex:
+                self.log.error('processDeferredMsgs %s', str(ex))
+                if self.debug:
+                    self.log.error(traceback.format_exc())
+
         self.mxDB.acquire()
         try:
             # TODO: Wait for blocks / txns, would need to check multiple coins
             now = int(time.time())
             if now - self._last_checked_progress >= self.check_progress_seconds:
-                to_remove = []
-                for bid_id, v in self.swaps_in_progress.items():
-                    try:
-                        if self.checkBidState(bid_id, v[0], v[1]) is True:
-                            to_remove.append((bid_id, v[0], v[1]))
-                    except Exception as ex:
-                        if self.debug:
-                            self.log.error('checkBidState %s', traceback.format_exc())
-                        if self.is_transient_error(ex):
-                            self.log.warning('checkBidState %s %s', bid_id.hex(), str(ex))
-                            self.logBidEvent(bid_id, EventLogTypes.SYSTEM_WARNING, 'No connection to daemon', session=None)
-                        else:
-                            self.log.error('checkBidState %s %s', bid_id.hex(), str(ex))
-                            self.setBidError(bid_id, v[0], str(ex))
-
-                for bid_id, bid, offer in to_remove:
-                    self.deactivateBid(None, offer, bid)
-                self._last_checked_progress = now
+                with self._metric_update_phase.time('progress'):
+                    to_remove = []
+                    for bid_id, v in self.swaps_in_progress.items():
+                        if not self.areSwapCoinsReady(v[1]):
+                            continue
+                        prev_state = v[0].state
+                        t_start = time.time()
+                        rpc_start = threadRPCSeconds()
+                        try:
+                            if self.checkBidState(bid_id, v[0], v[1]) is True:
+                                to_remove.append((bid_id, v[0], v[1]))
+                        except Exception as ex:
+                            if self.debug:
+                                self.log.error('checkBidState %s', traceback.format_exc())
+                            if self.is_transient_error(ex):
+                                self.log.warning('checkBidState %s %s', bid_id.hex(), str(ex))
+                                self.logBidEvent(bid_id, EventLogTypes.SYSTEM_WARNING, 'No connection to daemon', session=None)
+                            else:
+                                self.log.error('checkBidState %s %s', bid_id.hex(), str(ex))
+                                self.setBidError(bid_id, v[0], str(ex))
+                        duration = time.time() - t_start
+                        if v[0].state != prev_state or duration * 1000 >= self.bid_span_min_ms:
+                            self.addBidSpan(bid_id, SpanTypes.CHECK_STATE, strBidState(prev_state), t_start, duration, threadRPCSeconds() - rpc_start)
+
+                    for bid_id, bid, offer in to_remove:
+                        self.deactivateBid(None, offer, bid)
+                    self._last_checked_progress = now
 
             if now - self._last_checked_watched >= self.check_watched_seconds:
-                for k, c in self.coin_clients.items():
-                    if k == Coins.PART_ANON or k == Coins.PART_BLIND:
-                        continue
-                    if len(c['watched_outputs']) > 0:
-                        self.checkForSpends(k, c)
-                self._last_checked_watched = now
+                with self._metric_update_phase.time('watched'):
+                    for k, c in self.coin_clients.items():
+                        if k == Coins.PART_ANON or k == Coins.PART_BLIND:
+                            continue
+                        if len(c['watched_outputs']) > 0 and c['ready']:
+                            self.checkForSpends(k, c)
+                    self._last_checked_watched = now
 
             if now - self._last_checked_expired >= self.check_expired_seconds:
-                self.expireMessages()
-                self._last_checked_expired = now
+                with self._metric_update_phase.time('expired'):
+                    self.expireMessages()
+                    self._last_checked_expired = now
 
-            if now - self._last_checked_actions >= self.check_actions_seconds:
-                self.checkQueuedActions()
-                self._last_checked_actions = now
+            if self.actionsDue(now) or now - self._last_checked_actions >= self.check_actions_seconds:
+                with self._metric_update_phase.time('actions'):
+                    self.checkQueuedActions()
+                    self._last_checked_actions = now
 
             if now - self._last_checked_xmr_swaps >= self.check_xmr_swaps_seconds:
-                self.checkXmrSwaps()
-                self._last_checked_xmr_swaps = now
+                with self._metric_update_phase.time('xmr_swaps'):
+                    self.checkXmrSwaps()
+                    self._last_checked_xmr_swaps = now
+
+            if now - self._last_checked_address_pool >= self.check_address_pool_seconds:
+                with self._metric_update_phase.time('address_pool'):
+                    self.checkAddressPool()
+                    self._last_checked_address_pool = now
+
+            if self.archive_after_days > 0 and now - self._last_checked_archive >= self.check_archive_seconds:
+                with self._metric_update_phase.time('archive'):
+                    num_bids, num_offers = self.archiveSwaps()
+                    self._last_checked_archive = now
+                if num_bids + num_offers > 0:
+                    self._last_checked_summary = 0  # Archived rows are removed with raw sql
+
+            if now - self._last_checked_summary >= self.check_summary_seconds:
+                with self._metric_update_phase.time('summary'):
+                    self.reconcileSummary()
+                    self._last_checked_summary = now
 
         except Exception as ex:
             self.log.error('update %s', str(ex))
@@ -5270,6 +6226,38 @@ class BasicSwap(BaseApp):
             json.dump(self.settings, fp, indent=4)
         # Client must be restarted
 
+    def reconcileSummary(self):
+        now = int(time.time())
+        self.mxDB.acquire()
+        try:
+            session = scoped_session(self.session_factory)
+            q = session.execute('''SELECT
+                                   COUNT(CASE WHEN was_sent THEN 1 ELSE NULL END) AS count_sent,
+                                   COUNT(CASE WHEN was_received THEN 1 ELSE NULL END) AS count_received
+                                   FROM bids WHERE active_ind = 1''').first()
+            num_sent_bids = q[0]
+            num_recv_bids = q[1]
+            q = session.execute('SELECT bid_id, expire_at FROM bids WHERE active_ind = 1 AND was_received AND state = :state AND expire_at > :now',
+                                {'state': int(BidStates.BID_RECEIVED), 'now': now})
+            available_bids = [(row[0], row[1]) for row in q]
+            active_offers = [(row[0], row[1]) for row in session.execute('SELECT offer_id, expire_at FROM offers WHERE active_ind = 1 AND expire_at > :now', {'now': now})]
+            sent_offers = [row[0] for row in session.execute('SELECT offer_id FROM offers WHERE active_ind = 1 AND was_sent')]
+
+            if self._summary_counters.loaded:
+                counted = self._summary_counters.get(now)
+                if counted['num_sent_bids'] != num_sent_bids or counted['num_recv_bids'] != num_recv_bids or \
+                   counted['num_available_bids'] != len(available_bids) or counted['num_network_offers'] != len(active_offers) or \
+                   counted['num_sent_offers'] != len(sent_offers):
+                    self.log.debug('Summary counters reset, bids sent %d/%d, received %d/%d, available %d/%d, offers %d/%d, sent offers %d/%d',
+                                   counted['num_sent_bids'], num_sent_bids, counted['num_recv_bids'], num_recv_bids,
+                                   counted['num_available_bids'], len(available_bids), counted['num_network_offers'], len(active_offers),
+                                   counted['num_sent_offers'], len(sent_offers))
+            self._summary_counters.reset(num_sent_bids, num_recv_bids, available_bids, active_offers, sent_offers)
+        finally:
+            session.close()
+            session.remove()
+            self.mxDB.release()
+
     def getSummary(self, opts=None):
         num_watched_outputs = 0
         for c, v in self.coin_clients.items():
@@ -5277,37 +6265,36 @@ class BasicSwap(BaseApp):
                 continue
             num_watched_outputs += len(v['watched_outputs'])
 
-        now = int(time.time())
-        q_str = '''SELECT
-                   COUNT(CASE WHEN was_sent THEN 1 ELSE NULL END) AS count_sent,
-                   COUNT(CASE WHEN was_received THEN 1 ELSE NULL END) AS count_received,
-                   COUNT(CASE WHEN was_received AND state = {} AND expire_at > {} THEN 1 ELSE NULL END) AS count_available
-                   FROM bids WHERE active_ind = 1'''.format(BidStates.BID_RECEIVED, now)
-        q = self.engine.execute(q_str).first()
-        bids_sent = q[0]
-        bids_received = q[1]
-        bids_available = q[2]
-
-        q_str = '''SELECT
-                   COUNT(CASE WHEN expire_at > {} THEN 1 ELSE NULL END) AS count_active,
-                   COUNT(CASE WHEN was_sent THEN 1 ELSE NULL END) AS count_sent
-                   FROM offers WHERE active_ind = 1'''.format(now)
-        q = self.engine.execute(q_str).first()
-        num_offers = q[0]
-        num_sent_offers = q[1]
+        if not self._summary_counters.loaded:
+            self.reconcileSummary()
 
+        counted = self._summary_counters.get(int(time.time()))
         rv = {
             'network': self.chain,
             'num_swapping': len(self.swaps_in_progress),
-            'num_network_offers': num_offers,
-            'num_sent_offers': num_sent_offers,
-            'num_recv_bids': bids_received,
-            'num_sent_bids': bids_sent,
-            'num_available_bids': bids_available,
+            'num_network_offers': counted['num_network_offers'],
+            'num_sent_offers': counted['num_sent_offers'],
+            'num_recv_bids': counted['num_recv_bids'],
+            'num_sent_bids': counted['num_sent_bids'],
+            'num_available_bids': counted['num_available_bids'],
             'num_watched_outputs': num_watched_outputs,
         }
         return rv
 
+    def countBidsByState(self):
+        rv = collections.Counter()
+        for row in self.engine.execute('SELECT state, COUNT(*) FROM bids WHERE active_ind = 1 GROUP BY state'):
+            rv[(strBidState(row[0]), )] += row[1]
+        return rv
+
+    def countSwapsInProgress(self):
+        with self.mxDB:
+            states = [v[0].state for v in self.swaps_in_progress.values()]
+        return collections.Counter((strBidState(state), ) for state in states)
+
+    def countWebsocketClients(self):
+        return {(): 0 if self.ws_server is None else len(self.ws_server.clients)}
+
     def getBlockchainInfo(self, coin):
         ci = self.ci(coin)
 
@@ -5357,14 +6344,14 @@ class BasicSwap(BaseApp):
             self.log.warning('getWalletInfo failed with: %s', str(e))
 
     def addWalletInfoRecord(self, coin, info_type, wi):
+        # Only the latest record is needed, to show balances before the daemons respond after a restart
         coin_id = int(coin)
         self.mxDB.acquire()
         try:
             now = int(time.time())
             session = scoped_session(self.session_factory)
+            session.execute('DELETE FROM wallets WHERE coin_id = :coin_id AND balance_type = :balance_type', {'coin_id': coin_id, 'balance_type': info_type})
             session.add(Wallets(coin_id=coin, balance_type=info_type, wallet_data=json.dumps(wi), created_at=now))
-            query_str = f'DELETE FROM wallets WHERE (coin_id = {coin_id} AND balance_type = {info_type}) AND record_id NOT IN (SELECT record_id FROM wallets WHERE coin_id = {coin_id} AND balance_type = {info_type} ORDER BY created_at DESC LIMIT 3 )'
-            session.execute(query_str)
             session.commit()
         except Exception as e:
             self.log.error(f'addWalletInfoRecord {e}')
@@ -5373,17 +6360,68 @@ class BasicSwap(BaseApp):
             session.remove()
             self.mxDB.release()
 
-    def updateWalletInfo(self, coin):
-        # Store wallet info to db so it's available after startup
+    def loadWalletSnapshots(self):
+        session = scoped_session(self.session_factory)
         try:
-            bi = self.getBlockchainInfo(coin)
-            if bi:
-                self.addWalletInfoRecord(coin, 0, bi)
+            inner_str = 'SELECT coin_id, balance_type, MAX(created_at) as max_created_at FROM wallets GROUP BY coin_id, balance_type'
+            query_str = 'SELECT a.coin_id, a.balance_type, wallet_data, created_at FROM wallets a, ({}) b WHERE a.coin_id = b.coin_id AND a.balance_type = b.balance_type AND a.created_at = b.max_created_at'.format(inner_str)
+            with self.mxWalletSnapshots:
+                for row in session.execute(query_str):
+                    # Version -1 is never current, loaded snapshots are refreshed before being returned from getWalletsInfo
+                    snapshot = self._wallet_snapshots.setdefault(row[0], {'chain': None, 'wallet': None, 'updated': 0, 'version': -1})
+                    snapshot['chain' if row[1] == 0 else 'wallet'] = json.loads(row[2])
+                    snapshot['updated'] = max(snapshot['updated'], row[3])
+        finally:
+            session.close()
+            session.remove()
+
+    def invalidateWalletSnapshot(self, coin_type):
+        coin_id = int(Coins.PART if coin_type in (Coins.PART_ANON, Coins.PART_BLIND) else coin_type)
+        with self.mxWalletSnapshots:
+            self._wallet_versions[coin_id] = self._wallet_versions.get(coin_id, 0) + 1
+
+    def getWalletSnapshot(self, coin_type, current_only=False):
+        coin_id = int(coin_type)
+        with self.mxWalletSnapshots:
+            snapshot = self._wallet_snapshots.get(coin_id, None)
+            if snapshot is None:
+                return None
+            if current_only:
+                if snapshot['version'] != self._wallet_versions.get(coin_id, 0):
+                    return None
+                if time.time() - snapshot['updated'] >= self.wallet_snapshot_seconds:
+                    return None
+            return snapshot
+
+    def refreshWalletSnapshot(self, coin):
+        coin_id = int(coin)
+        with self.mxWalletSnapshots:
+            version = self._wallet_versions.get(coin_id, 0)
 
-            # monero-wallet-rpc is slow/unresponsive while syncing
-            wi = self.getWalletInfo(coin)
+        bi = self.getBlockchainInfo(coin)
+        # monero-wallet-rpc is slow/unresponsive while syncing
+        wi = self.getWalletInfo(coin)
+
+        with self.mxWalletSnapshots:
+            snapshot = dict(self._wallet_snapshots.get(coin_id, {'chain': None, 'wallet': None}))
+            if bi:
+                snapshot['chain'] = bi
             if wi:
-                self.addWalletInfoRecord(coin, 1, wi)
+                snapshot['wallet'] = wi
+            snapshot['updated'] = int(time.time())
+            snapshot['version'] = version if (bi and wi) else -1
+            self._wallet_snapshots[coin_id] = snapshot
+
+        # Store wallet info to db so it's available after startup
+        if bi:
+            self.addWalletInfoRecord(coin, 0, bi)
+        if wi:
+            self.addWalletInfoRecord(coin, 1, wi)
+        return snapshot
+
+    def updateWalletInfo(self, coin):
+        try:
+            self.refreshWalletSnapshot(coin)
         except Exception as e:
             self.log.error(f'updateWalletInfo {e}')
         finally:
@@ -5399,9 +6437,9 @@ class BasicSwap(BaseApp):
             if c not in chainparams:
                 continue
             cc = self.coin_clients[c]
-            if cc['connection_type'] == 'rpc':
-                if not force_update and now - cc.get('last_updated_wallet_info', 0) < 30:
-                    return
+            if cc['connection_type'] == 'rpc' and cc['ready']:
+                if not force_update and (self._updating_wallets_info.get(int(c), False) or self.getWalletSnapshot(c, current_only=True) is not None):
+                    continue
                 cc['last_updated_wallet_info'] = int(time.time())
                 self._updating_wallets_info[int(c)] = True
                 handle = self.thread_pool.submit(self.updateWalletInfo, c)
@@ -5411,72 +6449,98 @@ class BasicSwap(BaseApp):
                     except Exception as e:
                         self.log.error(f'updateWalletInfo {e}')
 
+    def collectWalletInfo(self, coin):
+        snapshot = self.refreshWalletSnapshot(coin)
+        ensure(snapshot['version'] != -1, 'getWalletInfo failed')
+        return snapshot
+
+    def formatWalletSnapshot(self, snapshot):
+        rv = dict(snapshot['wallet'])
+        rv.update(snapshot['chain'])
+        rv['updated'] = snapshot['updated']
+        return rv
+
     def getWalletsInfo(self, opts=None):
+        # Current snapshots are returned from memory.
+        # Other coins are refreshed concurrently, a coin that misses its deadline returns the last snapshot marked as stale
         rv = {}
+        handles = []
         for c in Coins:
             if c not in chainparams:
                 continue
-            if self.coin_clients[c]['connection_type'] == 'rpc':
-                key = chainparams[c]['ticker'] if opts.get('ticker_key', False) else c
-                try:
-                    rv[key] = self.getWalletInfo(c)
-                    rv[key].update(self.getBlockchainInfo(c))
-                except Exception as ex:
-                    rv[key] = {'name': chainparams[c]['name'].capitalize(), 'error': str(ex)}
+            if self.coin_clients[c]['connection_type'] != 'rpc':
+                continue
+            key = chainparams[c]['ticker'] if opts is not None and opts.get('ticker_key', False) else c
+            snapshot = self.getWalletSnapshot(c, current_only=True)
+            if snapshot is not None:
+                rv[key] = self.formatWalletSnapshot(snapshot)
+                continue
+            if not self.isCoinReady(c):
+                snapshot = self.getWalletSnapshot(c)
+                if snapshot is None or snapshot['wallet'] is None or snapshot['chain'] is None:
+                    rv[key] = {'name': chainparams[c]['name'].capitalize(), 'error': 'Starting'}
+                else:
+                    rv[key] = self.formatWalletSnapshot(snapshot)
+                    rv[key]['stale'] = True
+                continue
+            with self.mxWalletsInfoFutures:
+                handle = self._wallets_info_futures.get(int(c), None)
+                if handle is None or handle.done():
+                    handle = self.thread_pool.submit(self.collectWalletInfo, c)
+                    self._wallets_info_futures[int(c)] = handle
+            timeout = self.getChainClientSettings(c).get('wallet_info_timeout', self.wallet_info_timeout)
+            handles.append((c, key, handle, time.time() + timeout))
+
+        for c, key, handle, deadline in handles:
+            try:
+                rv[key] = self.formatWalletSnapshot(handle.result(timeout=max(0, deadline - time.time())))
+            except concurrent.futures.TimeoutError:
+                self.log.warning('getWalletsInfo timed out for %s', chainparams[c]['name'])
+                snapshot = self.getWalletSnapshot(c)
+                if snapshot is None or snapshot['wallet'] is None or snapshot['chain'] is None:
+                    rv[key] = {'name': chainparams[c]['name'].capitalize(), 'error': 'Timed out'}
+                else:
+                    rv[key] = self.formatWalletSnapshot(snapshot)
+                rv[key]['stale'] = True
+            except Exception as ex:
+                rv[key] = {'name': chainparams[c]['name'].capitalize(), 'error': str(ex)}
         return rv
 
     def getCachedWalletsInfo(self, opts=None):
+        # Reads from memory only
         rv = {}
-        # Requires? self.mxDB.acquire()
-        try:
-            session = scoped_session(self.session_factory)
-            where_str = ''
-            if opts is not None and 'coin_id' in opts:
-                where_str = 'WHERE coin_id = {}'.format(opts['coin_id'])
-            inner_str = f'SELECT coin_id, balance_type, MAX(created_at) as max_created_at FROM wallets {where_str} GROUP BY coin_id, balance_type'
-            query_str = 'SELECT a.coin_id, a.balance_type, wallet_data, created_at FROM wallets a, ({}) b WHERE a.coin_id = b.coin_id AND a.balance_type = b.balance_type AND a.created_at = b.max_created_at'.format(inner_str)
-
-            q = session.execute(query_str)
-            for row in q:
-                coin_id = row[0]
-
-                if self.coin_clients[coin_id]['connection_type'] != 'rpc':
-                    # Skip cached info if coin was disabled
-                    continue
-
-                wallet_data = json.loads(row[2])
-                if row[1] == 1:
-                    wallet_data['lastupdated'] = row[3]
-                    wallet_data['updating'] = self._updating_wallets_info.get(coin_id, False)
-
-                    # Ensure the latest deposit address is displayed
-                    q = session.execute('SELECT value FROM kv_string WHERE key = "receive_addr_{}"'.format(chainparams[coin_id]['name']))
-                    for row in q:
-                        wallet_data['deposit_address'] = row[0]
-
-                if coin_id in rv:
-                    rv[coin_id].update(wallet_data)
-                else:
-                    rv[coin_id] = wallet_data
-        finally:
-            session.close()
-            session.remove()
-
-        if opts is not None and 'coin_id' in opts:
-            return rv
-
         for c in Coins:
             if c not in chainparams:
                 continue
-            if self.coin_clients[c]['connection_type'] == 'rpc':
-                coin_id = int(c)
-                if coin_id not in rv:
+            if self.coin_clients[c]['connection_type'] != 'rpc':
+                # Skip cached info if coin was disabled
+                continue
+            coin_id = int(c)
+            if opts is not None and 'coin_id' in opts and coin_id != opts['coin_id']:
+                continue
+            snapshot = self.getWalletSnapshot(c)
+            if snapshot is None or (snapshot['chain'] is None and snapshot['wallet'] is None):
+                if opts is None or 'coin_id' not in opts:
                     rv[coin_id] = {
                         'name': chainparams[c]['name'].capitalize(),
                         'no_data': True,
                         'updating': self._updating_wallets_info.get(coin_id, False),
                     }
+                continue
 
+            wallet_data = {}
+            if snapshot['chain'] is not None:
+                wallet_data.update(snapshot['chain'])
+            if snapshot['wallet'] is not None:
+                wallet_data.update(snapshot['wallet'])
+                wallet_data['lastupdated'] = snapshot['updated']
+                wallet_data['updating'] = self._updating_wallets_info.get(coin_id, False)
+
+                # Ensure the latest deposit address is displayed
+                deposit_address = self.getStringKV('receive_addr_' + chainparams[c]['name'])
+                if deposit_address is not None:
+                    wallet_data['deposit_address'] = deposit_address
+            rv[coin_id] = wallet_data
         return rv
 
     def countAcceptedBids(self, offer_id=None):
@@ -5484,58 +6548,79 @@ class BasicSwap(BaseApp):
         try:
             session = scoped_session(self.session_factory)
             if offer_id:
-                q = session.execute('SELECT COUNT(*) FROM bids WHERE state >= {} AND offer_id = x\'{}\''.format(BidStates.BID_ACCEPTED, offer_id.hex())).first()
+                q = session.execute('SELECT COUNT(*) FROM bids WHERE state >= :state AND offer_id = :offer_id', {'state': int(BidStates.BID_ACCEPTED), 'offer_id': offer_id}).first()
             else:
-                q = session.execute('SELECT COUNT(*) FROM bids WHERE state >= {}'.format(BidStates.BID_ACCEPTED)).first()
+                q = session.execute('SELECT COUNT(*) FROM bids WHERE state >= :state', {'state': int(BidStates.BID_ACCEPTED)}).first()
             return q[0]
         finally:
             session.close()
             session.remove()
             self.mxDB.release()
 
+    def queryOffers(self, session, sent, filters, with_bid_info, now):
+        if with_bid_info:
+            subquery = session.query(sa.func.sum(Bid.amount).label('completed_bid_amount')).filter(sa.and_(Bid.offer_id == Offer.offer_id, Bid.state == BidStates.SWAP_COMPLETED)).correlate(Offer).scalar_subquery()
+            q = session.query(Offer, subquery)
+        else:
+            q = session.query(Offer)
+
+        if sent:
+            q = q.filter(Offer.was_sent == True)  # noqa: E712
+        else:
+            q = q.filter(sa.and_(Offer.expire_at > now, Offer.active_ind == 1))
+
+        filter_offer_id = filters.get('offer_id', None)
+        if filter_offer_id is not None:
+            q = q.filter(Offer.offer_id == filter_offer_id)
+        filter_coin_from = filters.get('coin_from', None)
+        if filter_coin_from and filter_coin_from > -1:
+            q = q.filter(Offer.coin_from == int(filter_coin_from))
+        filter_coin_to = filters.get('coin_to', None)
+        if filter_coin_to and filter_coin_to > -1:
+            q = q.filter(Offer.coin_to == int(filter_coin_to))
+
+        order_dir = filters.get('sort_dir', 'desc')
+        order_by = filters.get('sort_by', 'created_at')
+
+        if order_by == 'created_at':
+            q = q.order_by(Offer.created_at.desc() if order_dir == 'desc' else Offer.created_at.asc())
+        elif order_by == 'rate':
+            q = q.order_by(Offer.rate.desc() if order_dir == 'desc' else Offer.rate.asc())
+        return q
+
     def listOffers(self, sent=False, filters={}, with_bid_info=False):
         self.mxDB.acquire()
+        archive_session = None
         try:
             rv = []
             now = int(time.time())
             session = scoped_session(self.session_factory)
 
-            if with_bid_info:
-                subquery = session.query(sa.func.sum(Bid.amount).label('completed_bid_amount')).filter(sa.and_(Bid.offer_id == Offer.offer_id, Bid.state == BidStates.SWAP_COMPLETED)).correlate(Offer).scalar_subquery()
-                q = session.query(Offer, subquery)
-            else:
-                q = session.query(Offer)
+            q = self.queryOffers(session, sent, filters, with_bid_info, now)
+            limit = filters.get('limit', None)
+            offset = filters.get('offset', None)
 
-            if sent:
-                q = q.filter(Offer.was_sent == True)  # noqa: E712
+            if filters.get('include_archived', False) and archiveSessionFactory(self) is not None:
+                archive_session = scoped_session(archiveSessionFactory(self))
+                # Page over both dbs together
+                aq = self.queryOffers(archive_session, sent, filters, with_bid_info, now)
+                if limit is not None:
+                    q = q.limit(limit + (0 if offset is None else offset))
+                    aq = aq.limit(limit + (0 if offset is None else offset))
+                sort_key = filters.get('sort_by', 'created_at')
+                if sort_key not in ('created_at', 'rate'):
+                    sort_key = 'created_at'
+                rows = sorted(list(q) + list(aq), key=lambda r: getattr(r[0] if with_bid_info else r, sort_key), reverse=filters.get('sort_dir', 'desc') == 'desc')
+                start = 0 if offset is None else offset
+                rows = rows[start:] if limit is None else rows[start:start + limit]
             else:
-                q = q.filter(sa.and_(Offer.expire_at > now, Offer.active_ind == 1))
-
-            filter_offer_id = filters.get('offer_id', None)
-            if filter_offer_id is not None:
-                q = q.filter(Offer.offer_id == filter_offer_id)
-            filter_coin_from = filters.get('coin_from', None)
-            if filter_coin_from and filter_coin_from > -1:
-                q = q.filter(Offer.coin_from == int(filter_coin_from))
-            filter_coin_to = filters.get('coin_to', None)
-            if filter_coin_to and filter_coin_to > -1:
-                q = q.filter(Offer.coin_to == int(filter_coin_to))
-
-            order_dir = filters.get('sort_dir', 'desc')
-            order_by = filters.get('sort_by', 'created_at')
-
-            if order_by == 'created_at':
-                q = q.order_by(Offer.created_at.desc() if order_dir == 'desc' else Offer.created_at.asc())
-            elif order_by == 'rate':
-                q = q.order_by(Offer.rate.desc() if order_dir == 'desc' else Offer.rate.asc())
+                if limit is not None:
+                    q = q.limit(limit)
+                if offset is not None:
+                    q = q.offset(offset)
+                rows = q
 
-            limit = filters.get('limit', None)
-            if limit is not None:
-                q = q.limit(limit)
-            offset = filters.get('offset', None)
-            if offset is not None:
-                q = q.offset(offset)
-            for row in q:
+            for row in rows:
                 offer = row[0] if with_bid_info else row
                 # Show offers for enabled coins only
                 try:
@@ -5549,6 +6634,9 @@ class BasicSwap(BaseApp):
                     rv.append(offer)
             return rv
         finally:
+            if archive_session is not None:
+                archive_session.close()
+                archive_session.remove()
             session.close()
             session.remove()
             self.mxDB.release()
@@ -5559,47 +6647,75 @@ class BasicSwap(BaseApp):
             rv = []
             now = int(time.time())
             session = scoped_session(self.session_factory)
+            include_archived = False
+            if filters.get('include_archived', False):
+                include_archived = attachArchiveDB(self, session)
 
             identity_fields = ''
+            query_params = {'itx_type': int(TxTypes.ITX), 'ptx_type': int(TxTypes.PTX)}
             query_str = 'SELECT bids.created_at, bids.expire_at, bids.bid_id, bids.offer_id, bids.amount, bids.state, bids.was_received, tx1.state, tx2.state, offers.coin_from, bids.rate, bids.bid_addr {} FROM bids '.format(identity_fields) + \
                         'LEFT JOIN offers ON offers.offer_id = bids.offer_id ' + \
-                        'LEFT JOIN transactions AS tx1 ON tx1.bid_id = bids.bid_id AND tx1.tx_type = {} '.format(TxTypes.ITX) + \
-                        'LEFT JOIN transactions AS tx2 ON tx2.bid_id = bids.bid_id AND tx2.tx_type = {} '.format(TxTypes.PTX)
+                        'LEFT JOIN transactions AS tx1 ON tx1.bid_id = bids.bid_id AND tx1.tx_type = :itx_type ' + \
+                        'LEFT JOIN transactions AS tx2 ON tx2.bid_id = bids.bid_id AND tx2.tx_type = :ptx_type '
 
-            query_str += 'WHERE bids.active_ind = 1 '
+            where_str = 'WHERE bids.active_ind = 1 '
             filter_bid_id = filters.get('bid_id', None)
             if filter_bid_id is not None:
-                query_str += 'AND bids.bid_id = x\'{}\' '.format(filter_bid_id.hex())
+                where_str += 'AND bids.bid_id = :filter_bid_id '
+                query_params['filter_bid_id'] = filter_bid_id
             if offer_id is not None:
-                query_str += 'AND bids.offer_id = x\'{}\' '.format(offer_id.hex())
+                where_str += 'AND bids.offer_id = :offer_id '
+                query_params['offer_id'] = offer_id
             elif sent:
-                query_str += 'AND bids.was_sent = 1 '
+                where_str += 'AND bids.was_sent = 1 '
             else:
-                query_str += 'AND bids.was_received = 1 '
+                where_str += 'AND bids.was_received = 1 '
 
             bid_state_ind = filters.get('bid_state_ind', -1)
             if bid_state_ind != -1:
-                query_str += 'AND bids.state = {} '.format(bid_state_ind)
+                where_str += 'AND bids.state = :bid_state_ind '
+                query_params['bid_state_ind'] = int(bid_state_ind)
             with_expired = filters.get('with_expired', True)
             if with_expired is not True:
-                query_str += 'AND bids.expire_at > {} '.format(now)
+                where_str += 'AND bids.expire_at > :now '
+                query_params['now'] = now
+            query_str += where_str
 
+            # Column names can't be bound, only known values may be used
             sort_dir = filters.get('sort_dir', 'DESC').upper()
+            ensure(sort_dir in ('ASC', 'DESC'), 'Invalid sort dir')
             sort_by = filters.get('sort_by', 'created_at')
-            query_str += f' ORDER BY bids.{sort_by} {sort_dir}'
+            ensure(sort_by in ('created_at', 'expire_at', 'amount', 'rate'), 'Invalid sort by')
+            if include_archived:
+                # The offer of an archived bid may still be in the main db
+                query_str += 'UNION ALL SELECT bids.created_at, bids.expire_at, bids.bid_id, bids.offer_id, bids.amount, bids.state, bids.was_received, tx1.state, tx2.state, COALESCE(offers.coin_from, archived_offers.coin_from), bids.rate, bids.bid_addr {} FROM archive.bids AS bids '.format(identity_fields) + \
+                             'LEFT JOIN main.offers AS offers ON offers.offer_id = bids.offer_id ' + \
+                             'LEFT JOIN archive.offers AS archived_offers ON archived_offers.offer_id = bids.offer_id ' + \
+                             'LEFT JOIN archive.transactions AS tx1 ON tx1.bid_id = bids.bid_id AND tx1.tx_type = :itx_type ' + \
+                             'LEFT JOIN archive.transactions AS tx2 ON tx2.bid_id = bids.bid_id AND tx2.tx_type = :ptx_type ' + \
+                             where_str
+                query_str = f'SELECT * FROM ({query_str}) ORDER BY {sort_by} {sort_dir}'
+            else:
+                query_str += f' ORDER BY bids.{sort_by} {sort_dir}'
 
             limit = filters.get('limit', None)
             if limit is not None:
-                query_str += f' LIMIT {limit}'
+                query_str += ' LIMIT :limit'
+                query_params['limit'] = int(limit)
             offset = filters.get('offset', None)
             if offset is not None:
-                query_str += f' OFFSET {offset}'
+                if limit is None:
+                    query_str += ' LIMIT -1'
+                query_str += ' OFFSET :offset'
+                query_params['offset'] = int(offset)
 
-            q = session.execute(query_str)
+            q = session.execute(query_str, query_params)
             for row in q:
                 rv.append(row)
             return rv
         finally:
+            if include_archived:
+                detachArchiveDB(session)
             session.close()
             session.remove()
             self.mxDB.release()
@@ -5666,22 +6782,30 @@ class BasicSwap(BaseApp):
             query_str = 'SELECT strats.record_id, strats.label, strats.type_ind FROM automationstrategies AS strats'
             query_str += ' WHERE strats.active_ind = 1 '
 
+            query_params = {}
             type_ind = filters.get('type_ind', None)
             if type_ind is not None:
-                query_str += f' AND strats.type_ind = {type_ind} '
+                query_str += ' AND strats.type_ind = :type_ind '
+                query_params['type_ind'] = int(type_ind)
 
             sort_dir = filters.get('sort_dir', 'DESC').upper()
+            ensure(sort_dir in ('ASC', 'DESC'), 'Invalid sort dir')
             sort_by = filters.get('sort_by', 'created_at')
+            ensure(sort_by in ('created_at', 'label'), 'Invalid sort by')
             query_str += f' ORDER BY strats.{sort_by} {sort_dir}'
 
             limit = filters.get('limit', None)
             if limit is not None:
-                query_str += f' LIMIT {limit}'
+                query_str += ' LIMIT :limit'
+                query_params['limit'] = int(limit)
             offset = filters.get('offset', None)
             if offset is not None:
-                query_str += f' OFFSET {offset}'
+                if limit is None:
+                    query_str += ' LIMIT -1'
+                query_str += ' OFFSET :offset'
+                query_params['offset'] = int(offset)
 
-            q = session.execute(query_str)
+            q = session.execute(query_str, query_params)
             for row in q:
                 rv.append(row)
             return rv
@@ -5724,8 +6848,8 @@ class BasicSwap(BaseApp):
                 self.mxDB.acquire()
                 use_session = scoped_session(self.session_factory)
 
-            v = use_session.query(DBKVString).filter_by(key='smsg_chain_id').first()
-            if not v:
+            smsg_chain_id = self.getStringKV('smsg_chain_id')
+            if smsg_chain_id is None:
                 smsg_account = self.callrpc('extkey', ['deriveAccount', 'smsg keys', '78900'])
                 smsg_account_id = smsg_account['account']
                 self.log.info(f'Creating smsg keys account {smsg_account_id}')
@@ -5742,11 +6866,7 @@ class BasicSwap(BaseApp):
                 if not smsg_chain_id:
                     raise ValueError('External chain not found.')
 
-                use_session.add(DBKVString(
-                    key='smsg_chain_id',
-                    value=smsg_chain_id))
-            else:
-                smsg_chain_id = v.value
+                self.setStringKVInSession('smsg_chain_id', smsg_chain_id, use_session)
 
             smsg_chain = self.callrpc('extkey', ['key', smsg_chain_id])
             num_derives = int(smsg_chain['num_derives'])
@@ -5902,138 +7022,52 @@ class BasicSwap(BaseApp):
     def lookupRates(self, coin_from, coin_to, output_array=False):
         self.log.debug('lookupRates {}, {}'.format(coin_from, coin_to))
 
-        rate_sources = self.settings.get('rate_sources', {})
         ci_from = self.ci(int(coin_from))
         ci_to = self.ci(int(coin_to))
         name_from = ci_from.chainparams()['name']
         name_to = ci_to.chainparams()['name']
         ticker_from = ci_from.chainparams()['ticker']
         ticker_to = ci_to.chainparams()['ticker']
-        headers = {'Connection': 'close'}
-        try:
-            self.setConnectionParameters()
-            rv = {}
-
-            if rate_sources.get('coingecko.com', True):
-                try:
-                    url = 'https://api.coingecko.com/api/v3/simple/price?ids={},{}&vs_currencies=usd,btc'.format(name_from, name_to)
-                    self.log.debug(f'lookupRates: {url}')
-                    start = time.time()
-                    req = urllib.request.Request(url, headers=headers)
-                    js = json.loads(urllib.request.urlopen(req, timeout=10).read())
-                    js['time_taken'] = time.time() - start
-                    rate = float(js[name_from]['usd']) / float(js[name_to]['usd'])
-                    js['rate_inferred'] = ci_to.format_amount(rate, conv_int=True, r=1)
-                    rv['coingecko'] = js
-                except Exception as e:
-                    rv['coingecko_error'] = str(e)
-
-            if rate_sources.get('bittrex.com', True):
-                bittrex_api_v3 = 'https://api.bittrex.com/v3'
-                try:
-                    if ci_from.coin_type() == Coins.BTC:
-                        pair = f'{ticker_to}-{ticker_from}'
-                        url = f'{bittrex_api_v3}/markets/{pair}/ticker'
-                        self.log.debug(f'lookupRates: {url}')
-                        start = time.time()
-                        req = urllib.request.Request(url, headers=headers)
-                        js = json.loads(urllib.request.urlopen(req, timeout=10).read())
-                        js['time_taken'] = time.time() - start
-                        js['pair'] = pair
-                        try:
-                            rate_inverted = ci_from.make_int(1.0 / float(js['lastTradeRate']), r=1)
-                            js['rate_inferred'] = ci_to.format_amount(rate_inverted)
-                        except Exception as e:
-                            self.log.warning('lookupRates error: %s', str(e))
-                            js['rate_inferred'] = 'error'
-                        js['from_btc'] = 1.0
-                        js['to_btc'] = js['lastTradeRate']
-                        rv['bittrex'] = js
-                    elif ci_to.coin_type() == Coins.BTC:
-                        pair = f'{ticker_from}-{ticker_to}'
-                        url = f'{bittrex_api_v3}/markets/{pair}/ticker'
-                        self.log.debug(f'lookupRates: {url}')
-                        start = time.time()
-                        req = urllib.request.Request(url, headers=headers)
-                        js = json.loads(urllib.request.urlopen(req, timeout=10).read())
-                        js['time_taken'] = time.time() - start
-                        js['pair'] = pair
-                        js['rate_last'] = js['lastTradeRate']
-                        js['from_btc'] = js['lastTradeRate']
-                        js['to_btc'] = 1.0
-                        rv['bittrex'] = js
-                    else:
-                        pair = f'{ticker_from}-BTC'
-                        url = f'{bittrex_api_v3}/markets/{pair}/ticker'
-                        self.log.debug(f'lookupRates: {url}')
-                        start = time.time()
-                        req = urllib.request.Request(url, headers=headers)
-                        js_from = json.loads(urllib.request.urlopen(req, timeout=10).read())
-                        js_from['time_taken'] = time.time() - start
-                        js_from['pair'] = pair
-
-                        pair = f'{ticker_to}-BTC'
-                        url = f'{bittrex_api_v3}/markets/{pair}/ticker'
-                        self.log.debug(f'lookupRates: {url}')
-                        start = time.time()
-                        req = urllib.request.Request(url, headers=headers)
-                        js_to = json.loads(urllib.request.urlopen(req, timeout=10).read())
-                        js_to['time_taken'] = time.time() - start
-                        js_to['pair'] = pair
+        rv = self.rate_service.getRates(ci_from, ci_to)
+
+        if output_array:
+
+            def format_float(f):
+                return '{:.12f}'.format(f).rstrip('0').rstrip('.')
+
+            rv_array = []
+            if 'coingecko_error' in rv:
+                rv_array.append(('coingecko.com', 'error', rv['coingecko_error']))
+            if 'coingecko' in rv:
+                js = rv['coingecko']
+                rv_array.append((
+                    'coingecko.com',
+                    ticker_from,
+                    ticker_to,
+                    format_float(float(js[name_from]['usd'])),
+                    format_float(float(js[name_to]['usd'])),
+                    format_float(float(js[name_from]['btc'])),
+                    format_float(float(js[name_to]['btc'])),
+                    format_float(float(js['rate_inferred'])),
+                ))
+            if 'bittrex_error' in rv:
+                rv_array.append(('bittrex.com', 'error', rv['bittrex_error']))
+            if 'bittrex' in rv:
+                js = rv['bittrex']
+                rate = js['rate_last'] if 'rate_last' in js else js['rate_inferred']
+                rv_array.append((
+                    'bittrex.com',
+                    ticker_from,
+                    ticker_to,
+                    '',
+                    '',
+                    format_float(float(js['from_btc'])),
+                    format_float(float(js['to_btc'])),
+                    format_float(float(rate))
+                ))
+            return rv_array
 
-                        try:
-                            rate_inferred = float(js_from['lastTradeRate']) / float(js_to['lastTradeRate'])
-                            rate_inferred = ci_to.format_amount(rate, conv_int=True, r=1)
-                        except Exception as e:
-                            rate_inferred = 'error'
-
-                        rv['bittrex'] = {
-                            'from': js_from,
-                            'to': js_to,
-                            'rate_inferred': rate_inferred,
-                            'from_btc': js_from['lastTradeRate'],
-                            'to_btc': js_to['lastTradeRate']
-                        }
-                except Exception as e:
-                    rv['bittrex_error'] = str(e)
-
-            if output_array:
-
-                def format_float(f):
-                    return '{:.12f}'.format(f).rstrip('0').rstrip('.')
-
-                rv_array = []
-                if 'coingecko_error' in rv:
-                    rv_array.append(('coingecko.com', 'error', rv['coingecko_error']))
-                if 'coingecko' in rv:
-                    js = rv['coingecko']
-                    rv_array.append((
-                        'coingecko.com',
-                        ticker_from,
-                        ticker_to,
-                        format_float(float(js[name_from]['usd'])),
-                        format_float(float(js[name_to]['usd'])),
-                        format_float(float(js[name_from]['btc'])),
-                        format_float(float(js[name_to]['btc'])),
-                        format_float(float(js['rate_inferred'])),
-                    ))
-                if 'bittrex_error' in rv:
-                    rv_array.append(('bittrex.com', 'error', rv['bittrex_error']))
-                if 'bittrex' in rv:
-                    js = rv['bittrex']
-                    rate = js['rate_last'] if 'rate_last' in js else js['rate_inferred']
-                    rv_array.append((
-                        'bittrex.com',
-                        ticker_from,
-                        ticker_to,
-                        '',
-                        '',
-                        format_float(float(js['from_btc'])),
-                        format_float(float(js['to_btc'])),
-                        format_float(float(rate))
-                    ))
-                return rv_array
+        return rv
 
-            return rv
-        finally:
-            self.popConnectionParameters()
+    def getRateHistory(self, coin_from, coin_to):
+        return self.rate_service.getRateHistory(coin_from, coin_to)
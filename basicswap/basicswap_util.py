@@ -5,7 +5,6 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
 
-import struct
 import hashlib
 from enum import IntEnum, auto
 from .util.address import (
@@ -138,6 +137,13 @@ class ActionTypes(IntEnum):
     REDEEM_ITX = auto()
 
 
+class ActionStates(IntEnum):
+    # Values of actions.active_ind
+    PENDING = 1
+    DONE = 2
+    FAILED = 3
+
+
 class EventLogTypes(IntEnum):
     FAILED_TX_B_LOCK_PUBLISH = auto()
     LOCK_TX_A_PUBLISHED = auto()
@@ -164,6 +170,14 @@ class EventLogTypes(IntEnum):
     AUTOMATION_ACCEPTING_BID = auto()
 
 
+class SpanTypes(IntEnum):
+    CHECK_STATE = auto()        # checkBidState changed the bid state or was slow
+    PROCESS_MSG = auto()        # Handling a message from the peer
+    RUN_ACTION = auto()         # Running a queued action
+    ACTION_DELAY = auto()       # Queued action waiting to run
+    PEER_WAIT = auto()          # From the last bid state change to a message from the peer
+
+
 class XmrSplitMsgTypes(IntEnum):
     BID = auto()
     BID_ACCEPT = auto()
@@ -285,6 +299,31 @@ def strTxType(tx_type):
     return 'Unknown'
 
 
+def strSpanType(span_type):
+    if span_type == SpanTypes.CHECK_STATE:
+        return 'Check State'
+    if span_type == SpanTypes.PROCESS_MSG:
+        return 'Process Message'
+    if span_type == SpanTypes.RUN_ACTION:
+        return 'Run Action'
+    if span_type == SpanTypes.ACTION_DELAY:
+        return 'Action Delay'
+    if span_type == SpanTypes.PEER_WAIT:
+        return 'Peer Wait'
+    return 'Unknown'
+
+
+def summariseDurations(values):
+    # Percentiles of a list of durations, nearest rank
+    if len(values) < 1:
+        return {'count': 0}
+    values = sorted(values)
+    rv = {'count': len(values), 'mean': sum(values) / len(values), 'max': values[-1]}
+    for p in (50, 90, 99):
+        rv['p{}'.format(p)] = values[max(0, (len(values) * p + 99) // 100 - 1)]
+    return rv
+
+
 def strAddressType(addr_type):
     if addr_type == AddressTypes.OFFER:
         return 'Offer'
@@ -392,20 +431,6 @@ def getOfferProofOfFundsHash(offer_msg, offer_addr):
     return h.digest()
 
 
-def getLastBidState(packed_states):
-    num_states = len(packed_states) // 12
-    if num_states < 2:
-        return BidStates.BID_STATE_UNKNOWN
-    return struct.unpack_from('<i', packed_states[(num_states - 2) * 12:])[0]
-    try:
-        num_states = len(packed_states) // 12
-        if num_states < 2:
-            return BidStates.BID_STATE_UNKNOWN
-        return struct.unpack_from('<i', packed_states[(num_states - 2) * 12:])[0]
-    except Exception:
-        return BidStates.BID_STATE_UNKNOWN
-
-
 def isActiveBidState(state):
     if state >= BidStates.BID_ACCEPTED and state < BidStates.SWAP_COMPLETED:
         return True
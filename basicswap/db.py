@@ -12,7 +12,7 @@ from enum import IntEnum, auto
 from sqlalchemy.ext.declarative import declarative_base
 
 
-CURRENT_DB_VERSION = 15
+CURRENT_DB_VERSION = 20
 CURRENT_DB_DATA_VERSION = 2
 Base = declarative_base()
 
@@ -101,6 +101,7 @@ class Offer(Base):
 
 class Bid(Base):
     __tablename__ = 'bids'
+    archived = False  # Set when loaded from the archive db
 
     bid_id = sa.Column(sa.LargeBinary, primary_key=True)
     offer_id = sa.Column(sa.LargeBinary, sa.ForeignKey('offers.offer_id'))
@@ -147,6 +148,8 @@ class Bid(Base):
 
     reject_code = sa.Column(sa.Integer)
 
+    __table_args__ = (sa.Index('bids_progress_index', 'in_progress', 'state'), )
+
     initiate_tx = None
     participate_tx = None
     xmr_a_lock_tx = None
@@ -180,10 +183,7 @@ class Bid(Base):
 
         if state_note is not None:
             self.state_note = state_note
-        if self.states is None:
-            self.states = struct.pack('<iq', new_state, now)
-        else:
-            self.states += struct.pack('<iq', new_state, now)
+        addPendingState(self, new_state, now)
 
 
 class SwapTx(Base):
@@ -218,7 +218,93 @@ class SwapTx(Base):
 
     def setState(self, new_state):
         self.state = new_state
-        self.states = (self.states if self.states is not None else bytes()) + struct.pack('<iq', new_state, int(time.time()))
+        addPendingState(self, new_state, int(time.time()))
+
+
+class BidStateHistory(Base):
+    __tablename__ = 'bid_state_history'
+
+    record_id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    bid_id = sa.Column(sa.LargeBinary)
+    tx_type = sa.Column(sa.Integer)  # None for bid states
+    state = sa.Column(sa.Integer)
+    created_at = sa.Column(sa.BigInteger)
+
+    __table_args__ = (sa.Index('bid_state_history_index', 'bid_id'), )
+
+
+class BidSpan(Base):
+    __tablename__ = 'bid_spans'
+    # Timed protocol steps of a bid, times in milliseconds
+
+    record_id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    bid_id = sa.Column(sa.LargeBinary)
+    span_type = sa.Column(sa.Integer)
+    name = sa.Column(sa.String)
+    started_at = sa.Column(sa.BigInteger)
+    duration = sa.Column(sa.Integer)
+    rpc_duration = sa.Column(sa.Integer)
+
+    __table_args__ = (sa.Index('bid_spans_index', 'bid_id'), )
+
+
+def addPendingState(obj, new_state, now):
+    # Written to bid_state_history when the object is next flushed, kept until the session commits
+    pending = obj.__dict__.setdefault('_pending_states', [])
+    pending.append((new_state, now))
+
+
+def writePendingStates(session, flush_context, instances):
+    written = session.info.setdefault('written_states', {})  # id(obj): (obj, number of pending states written)
+    for obj in list(session.new) + list(session.dirty):
+        pending = obj.__dict__.get('_pending_states', None)
+        if not pending:
+            continue
+        num_written = written[id(obj)][1] if id(obj) in written else 0
+        if num_written >= len(pending):
+            continue
+        tx_type = obj.tx_type if isinstance(obj, SwapTx) else None
+        for state, created_at in pending[num_written:]:
+            session.add(BidStateHistory(
+                bid_id=obj.bid_id,
+                tx_type=tx_type,
+                state=state,
+                created_at=created_at))
+        written[id(obj)] = (obj, len(pending))
+
+
+def clearWrittenStates(session):
+    written = session.info.pop('written_states', None)
+    if not written:
+        return
+    for obj, num_written in written.values():
+        del obj.__dict__['_pending_states'][:num_written]
+
+
+def keepPendingStates(session):
+    # Rolled back states are written again at the next flush
+    session.info.pop('written_states', None)
+
+
+def listenPendingStates(session_factory):
+    sa.event.listen(session_factory, 'before_flush', writePendingStates)
+    sa.event.listen(session_factory, 'after_commit', clearWrittenStates)
+    sa.event.listen(session_factory, 'after_rollback', keepPendingStates)
+
+
+def bidDescriptionVersion(session, bid_id):
+    # Changes when anything shown in the bid description changes, None if the bid is unknown
+    q = session.execute('''SELECT state, state_time, debug_ind,
+                           (SELECT COUNT(*) FROM bid_state_history WHERE bid_id = :bid_id),
+                           (SELECT COUNT(*) FROM transactions WHERE bid_id = :bid_id),
+                           (SELECT TOTAL(conf) FROM transactions WHERE bid_id = :bid_id),
+                           (SELECT TOTAL(block_time) FROM transactions WHERE bid_id = :bid_id),
+                           (SELECT COUNT(*) FROM eventlog WHERE active_ind = 1 AND linked_type = :linked_type AND linked_id = :bid_id),
+                           (SELECT COUNT(*) FROM actions WHERE active_ind = 1 AND linked_id = :bid_id),
+                           (SELECT label FROM knownidentities WHERE address = bids.bid_addr LIMIT 1)
+                           FROM bids WHERE bid_id = :bid_id''',
+                        {'bid_id': bid_id, 'linked_type': int(Concepts.BID)}).first()
+    return None if q is None else tuple(q)
 
 
 class PooledAddress(Base):
@@ -230,6 +316,8 @@ class PooledAddress(Base):
     bid_id = sa.Column(sa.LargeBinary)
     tx_type = sa.Column(sa.Integer)
 
+    __table_args__ = (sa.Index('pool_index', 'coin_type', 'bid_id'), )
+
 
 class SentOffer(Base):
     __tablename__ = 'sentoffers'
@@ -259,6 +347,9 @@ class Action(Base):
     linked_id = sa.Column(sa.LargeBinary)
     action_type = sa.Column(sa.Integer)
     action_data = sa.Column(sa.LargeBinary)
+    num_tries = sa.Column(sa.Integer)
+
+    __table_args__ = (sa.Index('actions_index', 'active_ind', 'trigger_at'), )
 
 
 class EventLog(Base):
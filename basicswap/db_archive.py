@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+import os
+import sqlalchemy as sa
+
+from sqlalchemy.orm import sessionmaker
+
+from .db import (
+    CURRENT_DB_VERSION,
+    Base,
+    Bid,
+    Offer,
+    SwapTx,
+    Action,
+    XmrSwap,
+    EventLog,
+    XmrOffer,
+    Concepts,
+    XmrSplitData,
+    BidStateHistory,
+    BidSpan)
+
+from .basicswap_util import (
+    BidStates,
+)
+from .db_upgrades import upgradeArchiveDatabase
+
+
+ARCHIVE_TABLES = (Bid, SwapTx, XmrSwap, XmrSplitData, BidStateHistory, BidSpan, EventLog, Action, Offer, XmrOffer)
+
+# Bids in these states will not be processed further.
+# Failed, errored and timed out bids may need manual recovery and stay in the main db.
+ARCHIVE_BID_STATES = (
+    BidStates.SWAP_COMPLETED,
+    BidStates.XMR_SWAP_FAILED_REFUNDED,
+    BidStates.XMR_SWAP_FAILED_SWIPED,
+    BidStates.BID_ABANDONED,
+    BidStates.BID_REJECTED,
+)
+
+
+def createArchiveDB(self):
+    # Creates or upgrades the archive db to the schema of the main db
+    engine = sa.create_engine('sqlite:///' + self.archive_file)
+    try:
+        with engine.connect() as conn:
+            archive_version = conn.execute('PRAGMA user_version').scalar()
+            if archive_version > 0:
+                upgradeArchiveDatabase(self, conn, archive_version)
+            Base.metadata.create_all(conn, tables=[t.__table__ for t in ARCHIVE_TABLES])
+            conn.execute('PRAGMA user_version = {}'.format(CURRENT_DB_VERSION))
+    finally:
+        engine.dispose()
+
+
+def attachArchiveDB(self, conn):
+    # Returns False if nothing has been archived yet
+    if not os.path.exists(self.archive_file):
+        return False
+    conn.execute('ATTACH DATABASE :archive_file AS archive', {'archive_file': self.archive_file})
+    return True
+
+
+def archiveSessionFactory(self):
+    # Sessions reading the archive db directly, None if nothing has been archived yet
+    if self._archive_session_factory is None:
+        if not os.path.exists(self.archive_file):
+            return None
+        self._archive_session_factory = sessionmaker(bind=sa.create_engine('sqlite:///' + self.archive_file), expire_on_commit=False)
+    return self._archive_session_factory
+
+
+def detachArchiveDB(conn):
+    conn.execute('DETACH DATABASE archive')
+
+
+def surrogateKey(model):
+    # A single integer primary key is an alias for the rowid, sqlite reuses the highest
+    # value once the newest rows are moved out, so the archive assigns its own.
+    pk_columns = list(model.__table__.primary_key.columns)
+    if len(pk_columns) == 1 and isinstance(pk_columns[0].type, sa.Integer):
+        return pk_columns[0].name
+    return None
+
+
+def moveRows(conn, model, where_str):
+    table = model.__tablename__
+    skip_column = surrogateKey(model)
+    columns = ', '.join(c.name for c in model.__table__.columns if c.name != skip_column)
+    conn.execute(f'INSERT INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table} WHERE {where_str}')
+    rv = conn.execute(f'DELETE FROM main.{table} WHERE {where_str}')
+    return rv.rowcount
+
+
+def archiveSwaps(self, older_than, max_bids=500):
+    # Move finished bids and expired offers last changed before older_than into the archive db
+    createArchiveDB(self)
+
+    num_bids = 0
+    num_offers = 0
+    self.mxDB.acquire()
+    try:
+        # The archive is attached to a single connection, ATTACH and DETACH must run outside a transaction
+        with self.engine.connect() as conn:
+            attachArchiveDB(self, conn)
+            try:
+                with conn.begin():
+                    q = conn.execute('SELECT bid_id FROM main.bids WHERE state IN ({}) AND COALESCE(state_time, created_at) < :older_than LIMIT :max_bids'.format(
+                                     ', '.join(str(int(s)) for s in ARCHIVE_BID_STATES)), {'older_than': older_than, 'max_bids': max_bids})
+                    bid_ids = [row[0] for row in q if row[0] not in self.swaps_in_progress]
+
+                    conn.execute('CREATE TEMP TABLE archive_bid_ids (bid_id BLOB PRIMARY KEY)')
+                    for bid_id in bid_ids:
+                        conn.execute('INSERT INTO temp.archive_bid_ids (bid_id) VALUES (:bid_id)', {'bid_id': bid_id})
+
+                    in_bids = 'bid_id IN (SELECT bid_id FROM temp.archive_bid_ids)'
+                    num_bids = moveRows(conn, Bid, in_bids)
+                    for model in (SwapTx, XmrSwap, XmrSplitData, BidStateHistory, BidSpan):
+                        moveRows(conn, model, in_bids)
+                    moveRows(conn, EventLog, 'linked_type = {} AND linked_id IN (SELECT bid_id FROM temp.archive_bid_ids)'.format(int(Concepts.BID)))
+                    moveRows(conn, Action, 'active_ind != 1 AND linked_id IN (SELECT bid_id FROM temp.archive_bid_ids)')
+
+                    # Offers can be archived once expired and all their bids have been archived
+                    conn.execute('CREATE TEMP TABLE archive_offer_ids (offer_id BLOB PRIMARY KEY)')
+                    conn.execute('INSERT INTO temp.archive_offer_ids (offer_id) SELECT offer_id FROM main.offers WHERE expire_at < :older_than '
+                                 'AND NOT EXISTS (SELECT 1 FROM main.bids WHERE bids.offer_id = offers.offer_id)', {'older_than': older_than})
+                    in_offers = 'offer_id IN (SELECT offer_id FROM temp.archive_offer_ids)'
+                    num_offers = moveRows(conn, Offer, in_offers)
+                    moveRows(conn, XmrOffer, in_offers)
+                    moveRows(conn, EventLog, 'linked_type = {} AND linked_id IN (SELECT offer_id FROM temp.archive_offer_ids)'.format(int(Concepts.OFFER)))
+            finally:
+                conn.execute('DROP TABLE IF EXISTS temp.archive_bid_ids')
+                conn.execute('DROP TABLE IF EXISTS temp.archive_offer_ids')
+                detachArchiveDB(conn)
+    finally:
+        self.mxDB.release()
+
+    if num_bids + num_offers > 0:
+        self.log.info('Archived {} bids and {} offers.'.format(num_bids, num_offers))
+    return num_bids, num_offers
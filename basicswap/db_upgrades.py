@@ -6,6 +6,7 @@
 
 import json
 import time
+import struct
 
 from sqlalchemy.orm import scoped_session
 from .db import (
@@ -78,6 +79,7 @@ def upgradeDatabaseData(self, data_version):
 
 
 def upgradeDatabase(self, db_version):
+    # Changes to the archived tables must be repeated in upgradeArchiveDatabase
     if db_version >= CURRENT_DB_VERSION:
         return
 
@@ -215,6 +217,51 @@ def upgradeDatabase(self, db_version):
             db_version += 1
             session.execute('ALTER TABLE xmr_swaps ADD COLUMN coin_a_lock_release_msg_id BLOB')
             session.execute('ALTER TABLE xmr_swaps RENAME COLUMN coin_a_lock_refund_spend_tx_msg_id TO coin_a_lock_spend_tx_msg_id')
+        elif current_version == 15:
+            db_version += 1
+            session.execute('CREATE INDEX IF NOT EXISTS pool_index ON addresspool (coin_type, bid_id)')
+        elif current_version == 16:
+            db_version += 1
+            session.execute('ALTER TABLE actions ADD COLUMN num_tries INTEGER')
+            session.execute('CREATE INDEX IF NOT EXISTS actions_index ON actions (active_ind, trigger_at)')
+        elif current_version == 17:
+            db_version += 1
+            session.execute('''
+                CREATE TABLE bid_state_history (
+                    record_id INTEGER NOT NULL,
+                    bid_id BLOB,
+                    tx_type INTEGER,
+                    state INTEGER,
+                    created_at BIGINT,
+                    PRIMARY KEY (record_id))''')
+            session.execute('CREATE INDEX IF NOT EXISTS bid_state_history_index ON bid_state_history (bid_id)')
+
+            # Unpack the states blobs
+            rows = [(row[0], None, row[1]) for row in session.execute('SELECT bid_id, states FROM bids')]
+            rows += [(row[0], row[1], row[2]) for row in session.execute('SELECT bid_id, tx_type, states FROM transactions')]
+            for bid_id, tx_type, packed_states in rows:
+                if packed_states is None:
+                    continue
+                for i in range(len(packed_states) // 12):
+                    state, created_at = struct.unpack_from('<iq', packed_states, i * 12)
+                    session.execute('INSERT INTO bid_state_history (bid_id, tx_type, state, created_at) VALUES (:bid_id, :tx_type, :state, :created_at)',
+                                    {'bid_id': bid_id, 'tx_type': tx_type, 'state': state, 'created_at': created_at})
+        elif current_version == 18:
+            db_version += 1
+            session.execute('CREATE INDEX IF NOT EXISTS bids_progress_index ON bids (in_progress, state)')
+        elif current_version == 19:
+            db_version += 1
+            session.execute('''
+                CREATE TABLE bid_spans (
+                    record_id INTEGER NOT NULL,
+                    bid_id BLOB,
+                    span_type INTEGER,
+                    name VARCHAR,
+                    started_at BIGINT,
+                    duration INTEGER,
+                    rpc_duration INTEGER,
+                    PRIMARY KEY (record_id))''')
+            session.execute('CREATE INDEX IF NOT EXISTS bid_spans_index ON bid_spans (bid_id)')
 
         if current_version != db_version:
             self.db_version = db_version
@@ -228,3 +275,25 @@ def upgradeDatabase(self, db_version):
 
     if db_version != CURRENT_DB_VERSION:
         raise ValueError('Unable to upgrade database.')
+
+
+def upgradeArchiveDatabase(self, conn, archive_version):
+    # The archive db holds the tables in db_archive.ARCHIVE_TABLES, its version is kept in PRAGMA user_version.
+    # Archives are versioned from creation at version 20, missing tables are created by createArchiveDB after upgrading.
+    if archive_version >= CURRENT_DB_VERSION:
+        return
+
+    self.log.info('Upgrading archive database from version %d to %d.', archive_version, CURRENT_DB_VERSION)
+
+    while True:
+        current_version = archive_version
+        # Steps for changes to the archived tables go here, matching upgradeDatabase
+
+        if current_version != archive_version:
+            conn.execute('PRAGMA user_version = {}'.format(archive_version))
+            self.log.info('Upgraded archive database to version {}'.format(archive_version))
+            continue
+        break
+
+    if archive_version != CURRENT_DB_VERSION:
+        raise ValueError('Unable to upgrade archive database.')
@@ -5,29 +5,191 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
 import json
-import urllib.request
+import time
+import socks
+import random
+import threading
+import collections
+import http.client
+import concurrent.futures
+import urllib.parse
+import sockshandler
 
 
 class Explorer():
-    def __init__(self, swapclient, coin_type, base_url):
+    # Each explorer keeps its own pool of keep-alive connections.
+    # With tor enabled, connections go through the proxy with credentials unique to the explorer,
+    # isolating the circuit, instead of replacing the global socket.
+    # Responses are cached by url until the chain height changes, address lookups are not cached.
+
+    def __init__(self, swapclient, coin_type, base_url, proxy=None):
         self.swapclient = swapclient
         self.coin_type = coin_type
         self.base_url = base_url
         self.log = self.swapclient.log
 
-    def readURL(self, url):
+        settings = swapclient.settings
+        self.timeout = settings.get('explorer_timeout', 120)
+        self.pool_size = settings.get('explorer_pool_size', 4)
+        self.cache_seconds = settings.get('explorer_cache_seconds', 5 * 60)
+        self.cache_size = settings.get('explorer_cache_size', 256)
+
+        parsed = urllib.parse.urlsplit(base_url)
+        self._scheme = parsed.scheme
+        self._host = parsed.hostname
+        self._port = parsed.port
+        if proxy is None and swapclient.use_tor_proxy:
+            proxy = (swapclient.tor_proxy_host, swapclient.tor_proxy_port)
+        self.proxy = proxy
+
+        self._mx = threading.Lock()
+        self._idle = []
+        self._cache = collections.OrderedDict()  # url: (time, data)
+        self._chain_height = None
+
+    def newConnection(self):
+        port = self._port
+        if self.proxy is None:
+            if self._scheme == 'https':
+                return http.client.HTTPSConnection(self._host, port, timeout=self.timeout)
+            return http.client.HTTPConnection(self._host, port, timeout=self.timeout)
+        proxy_args = (socks.PROXY_TYPE_SOCKS5, self.proxy[0], self.proxy[1], True, self._host, 'explorer')
+        if self._scheme == 'https':
+            return sockshandler.SocksiPyConnectionS(*proxy_args, self._host, port, timeout=self.timeout)
+        return sockshandler.SocksiPyConnection(*proxy_args, self._host, port, timeout=self.timeout)
+
+    def request(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path if parsed.query == '' else parsed.path + '?' + parsed.query
+        headers = {'User-Agent': 'Mozilla/5.0', 'Connection': 'keep-alive'}
+
+        for i in range(2):
+            with self._mx:
+                conn = self._idle.pop() if len(self._idle) > 0 else None
+            reused = conn is not None
+            if conn is None:
+                conn = self.newConnection()
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # An idle connection may have been closed by the server, retry once on a new connection
+                if reused and i == 0:
+                    continue
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                with self._mx:
+                    if len(self._idle) < self.pool_size:
+                        self._idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+            if resp.status != 200:
+                raise ValueError('Explorer {} returned HTTP {}'.format(self._host, resp.status))
+            return data
+
+    def readURL(self, url, use_cache=True):
+        if use_cache:
+            with self._mx:
+                entry = self._cache.get(url, None)
+                if entry is not None and time.time() - entry[0] < self.cache_seconds:
+                    self._cache.move_to_end(url)
+                    return entry[1]
+
         self.log.debug('Explorer url: {}'.format(url))
-        try:
-            self.swapclient.setConnectionParameters()
-            req = urllib.request.Request(url)
-            return urllib.request.urlopen(req).read()
-        finally:
-            self.swapclient.popConnectionParameters()
+        data = self.request(url)
+
+        if use_cache:
+            with self._mx:
+                self._cache[url] = (time.time(), data)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return data
+
+    def setChainHeight(self, height):
+        # Cached responses are dropped when a new block is seen
+        with self._mx:
+            if height != self._chain_height:
+                self._chain_height = height
+                self._cache.clear()
+        return height
+
+    def close(self):
+        with self._mx:
+            idle, self._idle = self._idle, []
+            self._cache.clear()
+        for conn in idle:
+            conn.close()
+
+
+# Fields that differ between explorers at different chain heights
+UNSTABLE_FIELDS = ('height', 'n_conf', 'confirmations')
+
+
+def stableAnswer(rv):
+    # The part of an answer explorers must agree on, list order is ignored
+    if isinstance(rv, dict):
+        return {k: stableAnswer(v) for k, v in rv.items() if k not in UNSTABLE_FIELDS}
+    if isinstance(rv, list):
+        return sorted((stableAnswer(v) for v in rv), key=lambda v: json.dumps(v, sort_keys=True))
+    return rv
+
+
+def queryExplorers(swap_client, coin_type, method_name, *args):
+    # Asks the explorers of coin_type as set by swap_client.explorer_quorum, answers of None are ignored
+    explorers = swap_client.coin_clients[coin_type]['explorers']
+    if len(explorers) < 1:
+        raise ValueError('No explorer for {} {}'.format(method_name, str(coin_type)))
+
+    if swap_client.explorer_quorum == 'any':
+        offset = random.randrange(len(explorers))
+        last_error = None
+        for i in range(len(explorers)):
+            exp = explorers[(offset + i) % len(explorers)]
+            try:
+                rv = getattr(exp, method_name)(*args)
+            except Exception as e:
+                swap_client.log.warning('Explorer {} {} failed: {}'.format(exp.base_url, method_name, str(e)))
+                last_error = e
+                continue
+            if rv is not None:
+                return rv
+        raise ValueError('No explorer answered {}: {}'.format(method_name, str(last_error)))
+
+    handles = {swap_client.explorer_pool.submit(getattr(exp, method_name), *args): exp for exp in explorers}
+    votes = {}
+    num_needed = len(explorers) // 2 + 1
+    try:
+        for handle in concurrent.futures.as_completed(handles):
+            exp = handles[handle]
+            try:
+                rv = handle.result()
+            except Exception as e:
+                swap_client.log.warning('Explorer {} {} failed: {}'.format(exp.base_url, method_name, str(e)))
+                continue
+            if rv is None:
+                continue
+            if swap_client.explorer_quorum == 'first':
+                return rv
+            key = json.dumps(stableAnswer(rv), sort_keys=True)
+            num_votes = votes[key][0] + 1 if key in votes else 1
+            votes[key] = (num_votes, rv)
+            if num_votes >= num_needed:
+                return rv
+    finally:
+        for handle in handles:
+            handle.cancel()
+    raise ValueError('No explorer {} for {}'.format('answered' if len(votes) == 0 else 'majority', method_name))
 
 
 class ExplorerInsight(Explorer):
     def getChainHeight(self):
-        return json.loads(self.readURL(self.base_url + '/sync'))['blockChainHeight']
+        return self.setChainHeight(json.loads(self.readURL(self.base_url + '/sync', use_cache=False))['blockChainHeight'])
 
     def getBlock(self, block_hash):
         data = json.loads(self.readURL(self.base_url + '/block/{}'.format(block_hash)))
@@ -38,11 +200,11 @@ class ExplorerInsight(Explorer):
         return data
 
     def getBalance(self, address):
-        data = json.loads(self.readURL(self.base_url + '/addr/{}/balance'.format(address)))
+        data = json.loads(self.readURL(self.base_url + '/addr/{}/balance'.format(address), use_cache=False))
         return data
 
     def lookupUnspentByAddress(self, address):
-        data = json.loads(self.readURL(self.base_url + '/addr/{}/utxo'.format(address)))
+        data = json.loads(self.readURL(self.base_url + '/addr/{}/utxo'.format(address), use_cache=False))
         rv = []
         for utxo in data:
             rv.append({
@@ -57,7 +219,7 @@ class ExplorerInsight(Explorer):
 
 class ExplorerBitAps(Explorer):
     def getChainHeight(self):
-        return json.loads(self.readURL(self.base_url + '/block/last'))['data']['block']['height']
+        return self.setChainHeight(json.loads(self.readURL(self.base_url + '/block/last', use_cache=False))['data']['block']['height'])
 
     def getBlock(self, block_hash):
         data = json.loads(self.readURL(self.base_url + '/block/{}'.format(block_hash)))
@@ -68,19 +230,19 @@ class ExplorerBitAps(Explorer):
         return data
 
     def getBalance(self, address):
-        data = json.loads(self.readURL(self.base_url + '/address/state/' + address))
+        data = json.loads(self.readURL(self.base_url + '/address/state/' + address, use_cache=False))
         return data['data']['balance']
 
     def lookupUnspentByAddress(self, address):
         # Can't get unspents return only if exactly one transaction exists
-        data = json.loads(self.readURL(self.base_url + '/address/transactions/' + address))
+        data = json.loads(self.readURL(self.base_url + '/address/transactions/' + address, use_cache=False))
         try:
             assert data['data']['list'] == 1
         except Exception as ex:
             self.log.debug('Explorer error: {}'.format(str(ex)))
             return None
         tx = data['data']['list'][0]
-        tx_data = json.loads(self.readURL(self.base_url + '/transaction/{}'.format(tx['txId'])))['data']
+        tx_data = json.loads(self.readURL(self.base_url + '/transaction/{}'.format(tx['txId']), use_cache=False))['data']
 
         for i, vout in tx_data['vOut'].items():
             if vout['address'] == address:
@@ -95,7 +257,7 @@ class ExplorerBitAps(Explorer):
 
 class ExplorerChainz(Explorer):
     def getChainHeight(self):
-        return int(self.readURL(self.base_url + '?q=getblockcount'))
+        return self.setChainHeight(int(self.readURL(self.base_url + '?q=getblockcount', use_cache=False)))
 
     def lookupUnspentByAddress(self, address):
         chain_height = self.getChainHeight()
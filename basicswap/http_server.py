@@ -28,6 +28,7 @@ from .basicswap_util import (
     strTxState,
     strAddressType,
 )
+from .metrics import registry as metrics_registry
 from .js_server import (
     js_error,
     js_url_to_function,
@@ -257,11 +258,23 @@ class HttpHandler(BaseHTTPRequestHandler):
                     messages.append('Done.')
                 except Exception as a:
                     messages.append('Failed.')
+            elif have_data_entry(form_data, 'start_profile'):
+                try:
+                    swap_client.startProfile(int(get_data_entry(form_data, 'profile_seconds')), int(get_data_entry(form_data, 'profile_interval_ms')))
+                    messages.append('Profiler started.')
+                except Exception as e:
+                    messages.append('Failed: {}'.format(str(e)))
+            elif have_data_entry(form_data, 'show_profile'):
+                result = swap_client.profiler.collapsedStacks()
 
         template = env.get_template('debug.html')
         return self.render_template(template, {
             'messages': messages,
             'result': result,
+            'fee_rate_cache': swap_client.getFeeRateCacheStats(),
+            'event_log': swap_client.getEventLogStats(),
+            'startup': swap_client.getStartupStats(),
+            'profile': swap_client.getProfileStatus(),
         })
 
     def page_active(self, url_split, post_string):
@@ -513,6 +526,9 @@ class HttpHandler(BaseHTTPRequestHandler):
         url_split = parsed.path.split('/')
         if post_string == '' and len(parsed.query) > 0:
             post_string = parsed.query
+        if len(url_split) > 1 and url_split[1] == 'metrics':
+            self.putHeaders(status_code, 'text/plain; version=0.0.4; charset=utf-8')
+            return bytes(metrics_registry.render(), 'UTF-8')
         if len(url_split) > 1 and url_split[1] == 'json':
             try:
                 self.putHeaders(status_code, 'text/plain')
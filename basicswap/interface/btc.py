@@ -8,9 +8,12 @@
 import json
 import time
 import base64
+import struct
 import hashlib
 import logging
+import threading
 import traceback
+import collections
 from io import BytesIO
 from basicswap.contrib.test_framework import segwit_addr
 
@@ -54,7 +57,9 @@ from basicswap.contrib.test_framework.messages import (
     CTxIn,
     CTxInWitness,
     CTxOut,
-    FromHex)
+    FromHex,
+    hash256,
+    ser_string)
 
 from basicswap.contrib.test_framework.script import (
     CScript, CScriptOp,
@@ -65,14 +70,13 @@ from basicswap.contrib.test_framework.script import (
     OP_CHECKSEQUENCEVERIFY,
     OP_DROP,
     SIGHASH_ALL,
-    SegwitV0SignatureHash,
     hash160)
 
 from basicswap.basicswap_util import (
     TxLockTypes)
 
 from basicswap.chainparams import CoinInterface, Coins
-from basicswap.rpc import make_rpc_func, openrpc
+from basicswap.rpc import make_rpc_func, make_rpc_batch_func, openrpc
 
 
 SEQUENCE_LOCKTIME_GRANULARITY = 9  # 512 seconds
@@ -182,12 +186,18 @@ class BTCInterface(CoinInterface):
         self._rpcport = coin_settings['rpcport']
         self._rpcauth = coin_settings['rpcauth']
         self.rpc_callback = make_rpc_func(self._rpcport, self._rpcauth, host=self._rpc_host)
+        self.rpc_batch_callback = make_rpc_batch_func(self._rpcport, self._rpcauth, host=self._rpc_host)
         self.blocks_confirmed = coin_settings['blocks_confirmed']
         self.setConfTarget(coin_settings['conf_target'])
         self._use_segwit = coin_settings['use_segwit']
         self._connection_type = coin_settings['connection_type']
         self._sc = swap_client
         self._log = self._sc.log if self._sc and self._sc.log else logging
+        self._tx_cache_size = coin_settings.get('tx_cache_size', 64)
+        self._tx_cache = collections.OrderedDict()  # LRU of parsed txns, keyed by sha256 of the tx bytes
+        self._prevout_cache_size = coin_settings.get('prevout_cache_size', 256)
+        self._prevout_cache = collections.OrderedDict()  # (value, scriptPubKey type) by (txid hex, n)
+        self._mx_tx_cache = threading.Lock()
 
     def using_segwit(self):
         return self._use_segwit
@@ -233,6 +243,10 @@ class BTCInterface(CoinInterface):
     def getChainHeight(self):
         return self.rpc_callback('getblockcount')
 
+    def waitForNewBlock(self, timeout_ms):
+        # Returns the tip when a new block is connected or after timeout_ms
+        return self.rpc_callback('waitfornewblock', [timeout_ms])
+
     def getMempoolTx(self, txid):
         return self.rpc_callback('getrawtransaction', [txid.hex()])
 
@@ -303,6 +317,16 @@ class BTCInterface(CoinInterface):
             args.append('bech32')
         return self.rpc_callback('getnewaddress', args)
 
+    def getNewAddresses(self, use_segwit, num_addresses, label='swap_receive'):
+        args = [label]
+        if use_segwit:
+            args.append('bech32')
+        rpc_conn = self.open_rpc()
+        try:
+            return [self.json_request(rpc_conn, 'getnewaddress', args) for i in range(num_addresses)]
+        finally:
+            self.close_rpc(rpc_conn)
+
     def get_fee_rate(self, conf_target=2):
         try:
             fee_rate = self.rpc_callback('estimatesmartfee', [conf_target])['feerate']
@@ -608,8 +632,9 @@ class BTCInterface(CoinInterface):
         # However by checking early we can avoid wasting time processing unmineable txns
         # Check fee is reasonable
 
-        tx = self.loadTx(tx_bytes)
-        txid = self.getTxid(tx)
+        tx_entry = self.loadTxCached(tx_bytes)
+        tx = tx_entry['tx']
+        txid = self.getCachedTxid(tx_entry)
         self._log.info('Verifying lock tx: {}.'.format(b2h(txid)))
 
         ensure(tx.nVersion == self.txVersion(), 'Bad version')
@@ -634,12 +659,10 @@ class BTCInterface(CoinInterface):
             inputs_value = 0
             add_bytes = 0
             add_witness_bytes = getCompactSizeLen(len(tx.vin))
-            for pi in tx.vin:
-                ptx = self.rpc_callback('getrawtransaction', [i2h(pi.prevout.hash), True])
-                prevout = ptx['vout'][pi.prevout.n]
-                inputs_value += make_int(prevout['value'])
+            prevouts = self.getPrevouts([(i2h(pi.prevout.hash), pi.prevout.n) for pi in tx.vin])
+            for prevout_value, prevout_type in prevouts:
+                inputs_value += prevout_value
 
-                prevout_type = prevout['scriptPubKey']['type']
                 if prevout_type == 'witness_v0_keyhash':
                     add_witness_bytes += 107  # sig 72, pk 33 and 2 size bytes
                     add_witness_bytes += getCompactSizeLen(107)
@@ -672,8 +695,9 @@ class BTCInterface(CoinInterface):
         #   Must have only one output to the p2wsh of the lock refund script
         #   Output value must be locked_coin - lock tx fee
 
-        tx = self.loadTx(tx_bytes)
-        txid = self.getTxid(tx)
+        tx_entry = self.loadTxCached(tx_bytes)
+        tx = tx_entry['tx']
+        txid = self.getCachedTxid(tx_entry)
         self._log.info('Verifying lock refund tx: {}.'.format(b2h(txid)))
 
         ensure(tx.nVersion == self.txVersion(), 'Bad version')
@@ -720,8 +744,9 @@ class BTCInterface(CoinInterface):
         # Verify:
         #   Must have only one input with correct prevout (n is always 0) and sequence
         #   Must have only one output sending lock refund tx value - fee to leader's address, TODO: follower shouldn't need to verify destination addr
-        tx = self.loadTx(tx_bytes)
-        txid = self.getTxid(tx)
+        tx_entry = self.loadTxCached(tx_bytes)
+        tx = tx_entry['tx']
+        txid = self.getCachedTxid(tx_entry)
         self._log.info('Verifying lock refund spend tx: {}.'.format(b2h(txid)))
 
         ensure(tx.nVersion == self.txVersion(), 'Bad version')
@@ -764,16 +789,18 @@ class BTCInterface(CoinInterface):
         #   Must have only one input with correct prevout (n is always 0) and sequence
         #   Must have only one output with destination and amount
 
-        tx = self.loadTx(tx_bytes)
-        txid = self.getTxid(tx)
+        tx_entry = self.loadTxCached(tx_bytes)
+        tx = tx_entry['tx']
+        txid = self.getCachedTxid(tx_entry)
         self._log.info('Verifying lock spend tx: {}.'.format(b2h(txid)))
 
         ensure(tx.nVersion == self.txVersion(), 'Bad version')
         ensure(tx.nLockTime == 0, 'nLockTime not 0')
         ensure(len(tx.vin) == 1, 'tx doesn\'t have one input')
 
-        lock_tx = self.loadTx(lock_tx_bytes)
-        lock_tx_id = self.getTxid(lock_tx)
+        lock_tx_entry = self.loadTxCached(lock_tx_bytes)
+        lock_tx = lock_tx_entry['tx']
+        lock_tx_id = self.getCachedTxid(lock_tx_entry)
 
         output_script = CScript([OP_0, hashlib.sha256(lock_tx_script).digest()])
         locked_n = findOutput(lock_tx, output_script)
@@ -805,29 +832,25 @@ class BTCInterface(CoinInterface):
         return True
 
     def signTx(self, key_bytes, tx_bytes, input_n, prevout_script, prevout_value):
-        tx = self.loadTx(tx_bytes)
-        sig_hash = SegwitV0SignatureHash(prevout_script, tx, input_n, SIGHASH_ALL, prevout_value)
+        sig_hash = self.getSigHash(self.loadTxCached(tx_bytes), input_n, prevout_script, prevout_value)
 
         eck = PrivateKey(key_bytes)
         return eck.sign(sig_hash, hasher=None) + bytes((SIGHASH_ALL,))
 
     def signTxOtVES(self, key_sign, pubkey_encrypt, tx_bytes, input_n, prevout_script, prevout_value):
-        tx = self.loadTx(tx_bytes)
-        sig_hash = SegwitV0SignatureHash(prevout_script, tx, input_n, SIGHASH_ALL, prevout_value)
+        sig_hash = self.getSigHash(self.loadTxCached(tx_bytes), input_n, prevout_script, prevout_value)
 
         return ecdsaotves_enc_sign(key_sign, pubkey_encrypt, sig_hash)
 
     def verifyTxOtVES(self, tx_bytes, ct, Ks, Ke, input_n, prevout_script, prevout_value):
-        tx = self.loadTx(tx_bytes)
-        sig_hash = SegwitV0SignatureHash(prevout_script, tx, input_n, SIGHASH_ALL, prevout_value)
+        sig_hash = self.getSigHash(self.loadTxCached(tx_bytes), input_n, prevout_script, prevout_value)
         return ecdsaotves_enc_verify(Ks, Ke, sig_hash, ct)
 
     def decryptOtVES(self, k, esig):
         return ecdsaotves_dec_sig(k, esig) + bytes((SIGHASH_ALL,))
 
     def verifyTxSig(self, tx_bytes, sig, K, input_n, prevout_script, prevout_value):
-        tx = self.loadTx(tx_bytes)
-        sig_hash = SegwitV0SignatureHash(prevout_script, tx, input_n, SIGHASH_ALL, prevout_value)
+        sig_hash = self.getSigHash(self.loadTxCached(tx_bytes), input_n, prevout_script, prevout_value)
 
         pubkey = PublicKey(K)
         return pubkey.verify(sig[: -1], sig_hash, hasher=None)  # Pop the hashtype byte
@@ -849,11 +872,14 @@ class BTCInterface(CoinInterface):
     def listInputs(self, tx_bytes):
         tx = self.loadTx(tx_bytes)
 
-        all_locked = self.rpc_callback('listlockunspent')
+        if self._sc:
+            locked_outpoints = self._sc.getLockedOutpoints(self.coin_type())
+        else:
+            locked_outpoints = set((a['txid'], a['vout']) for a in self.rpc_callback('listlockunspent'))
         inputs = []
         for pi in tx.vin:
             txid_hex = i2h(pi.prevout.hash)
-            islocked = any([txid_hex == a['txid'] and pi.prevout.n == a['vout'] for a in all_locked])
+            islocked = (txid_hex, pi.prevout.n) in locked_outpoints
             inputs.append({'txid': txid_hex, 'vout': pi.prevout.n, 'islocked': islocked})
         return inputs
 
@@ -864,6 +890,8 @@ class BTCInterface(CoinInterface):
         for pi in tx.vin:
             inputs.append({'txid': i2h(pi.prevout.hash), 'vout': pi.prevout.n})
         self.rpc_callback('lockunspent', [True, inputs])
+        if self._sc:
+            self._sc.clearUnspentsCache(self.coin_type())
 
     def signTxWithWallet(self, tx):
         rv = self.rpc_callback('signrawtransactionwithwallet', [tx.hex()])
@@ -881,6 +909,80 @@ class BTCInterface(CoinInterface):
         tx.deserialize(BytesIO(tx_bytes))
         return tx
 
+    def loadTxCached(self, tx_bytes):
+        # Parsed txns are shared between calls and must not be modified, use loadTx for a private copy
+        key = hashlib.sha256(tx_bytes).digest()
+        with self._mx_tx_cache:
+            tx_entry = self._tx_cache.get(key, None)
+            if tx_entry is not None:
+                self._tx_cache.move_to_end(key)
+                return tx_entry
+
+        tx_entry = {'tx': self.loadTx(tx_bytes), 'txid': None, 'midstate': None, 'hash_outputs': None}
+        with self._mx_tx_cache:
+            self._tx_cache[key] = tx_entry
+            while len(self._tx_cache) > self._tx_cache_size:
+                self._tx_cache.popitem(last=False)
+        return tx_entry
+
+    def getCachedTxid(self, tx_entry):
+        if tx_entry['txid'] is None:
+            tx_entry['txid'] = self.getTxid(tx_entry['tx'])
+        return tx_entry['txid']
+
+    def getPrevouts(self, outpoints):
+        # Returns (value, scriptPubKey type) for each (txid hex, n)
+        # Uncached parent txns are fetched in one batched request
+        rv = [None] * len(outpoints)
+        missing = {}
+        with self._mx_tx_cache:
+            for i, outpoint in enumerate(outpoints):
+                prevout = self._prevout_cache.get(outpoint, None)
+                if prevout is None:
+                    missing.setdefault(outpoint[0], []).append(i)
+                    continue
+                self._prevout_cache.move_to_end(outpoint)
+                rv[i] = prevout
+        if len(missing) == 0:
+            return rv
+
+        txids = list(missing.keys())
+        ptxs = self.rpc_batch_callback([('getrawtransaction', [txid, True]) for txid in txids])
+        with self._mx_tx_cache:
+            for txid, ptx in zip(txids, ptxs):
+                for i in missing[txid]:
+                    txo = ptx['vout'][outpoints[i][1]]
+                    prevout = (make_int(txo['value']), txo['scriptPubKey']['type'])
+                    rv[i] = prevout
+                    self._prevout_cache[outpoints[i]] = prevout
+            while len(self._prevout_cache) > self._prevout_cache_size:
+                self._prevout_cache.popitem(last=False)
+        return rv
+
+    def getSigHash(self, tx_entry, input_n, prevout_script, prevout_value):
+        # SegwitV0SignatureHash for SIGHASH_ALL
+        # The sha256 state after the version, hashPrevouts and hashSequence is the same for every input and kept with the tx
+        tx = tx_entry['tx']
+        if tx_entry['midstate'] is None:
+            hash_prevouts = hash256(b''.join(txi.prevout.serialize() for txi in tx.vin))
+            hash_sequence = hash256(b''.join(struct.pack('<I', txi.nSequence) for txi in tx.vin))
+            tx_entry['hash_outputs'] = hash256(b''.join(txo.serialize() for txo in tx.vout))
+            tx_entry['midstate'] = hashlib.sha256(struct.pack('<i', tx.nVersion) + hash_prevouts + hash_sequence)
+
+        if isinstance(prevout_value, int):
+            amount_bytes = struct.pack('<q', prevout_value)
+        elif isinstance(prevout_value, bytes):
+            amount_bytes = prevout_value
+        else:
+            raise ValueError('Unknown amount type')
+
+        txi = tx.vin[input_n]
+        h = tx_entry['midstate'].copy()
+        h.update(txi.prevout.serialize() + ser_string(prevout_script) + amount_bytes
+                 + struct.pack('<I', txi.nSequence) + tx_entry['hash_outputs']
+                 + struct.pack('<i', tx.nLockTime) + struct.pack('<I', SIGHASH_ALL))
+        return hashlib.sha256(h.digest()).digest()
+
     def getTxid(self, tx):
         if isinstance(tx, str):
             tx = bytes.fromhex(tx)
@@ -80,6 +80,13 @@ class PARTInterface(BTCInterface):
     def getNewAddress(self, use_segwit, label='swap_receive'):
         return self.rpc_callback('getnewaddress', [label])
 
+    def getNewAddresses(self, use_segwit, num_addresses, label='swap_receive'):
+        rpc_conn = self.open_rpc()
+        try:
+            return [self.json_request(rpc_conn, 'getnewaddress', [label]) for i in range(num_addresses)]
+        finally:
+            self.close_rpc(rpc_conn)
+
     def getNewStealthAddress(self, label='swap_stealth'):
         return self.rpc_callback('getnewstealthaddress', [label])
 
@@ -5,10 +5,12 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
 import json
+import time
 import urllib.parse
 
 from .util import (
     toBool,
+    ensure,
 )
 from .basicswap_util import (
     strBidState,
@@ -22,13 +24,16 @@ from .ui.util import (
     PAGE_LIMIT,
     getCoinType,
     inputAmount,
-    describeBid,
     setCoinFilter,
+    describeBidTxns,
+    describeBidCached,
     get_data_entry,
     get_data_entry_or,
     have_data_entry,
     tickerToCoinId,
     listOldBidStates,
+    describeBidTimeline,
+    describeLockTransfers,
 )
 from .ui.page_offers import postNewOffer
 from .protocols.xmr_swap_1 import recoverNoScriptTxnWithKey, getChainBSplitKey
@@ -155,6 +160,8 @@ def js_offers(self, url_split, post_string, is_json, sent=False):
         if b'limit' in post_data:
             filters['limit'] = int(get_data_entry(post_data, 'limit'))
             assert (filters['limit'] > 0 and filters['limit'] <= PAGE_LIMIT), 'Invalid limit'
+        if have_data_entry(post_data, 'include_archived'):
+            filters['include_archived'] = toBool(get_data_entry(post_data, 'include_archived'))
 
     offers = self.server.swap_client.listOffers(sent, filters)
     rv = []
@@ -238,37 +245,56 @@ def js_bids(self, url_split, post_string, is_json):
         bid_id = bytes.fromhex(url_split[3])
         assert (len(bid_id) == 28)
 
+        include_archived = False
         if post_string != '':
             if is_json:
                 post_data = json.loads(post_string)
                 post_data['is_json'] = True
             else:
                 post_data = urllib.parse.parse_qs(post_string)
+            if have_data_entry(post_data, 'include_archived'):
+                include_archived = toBool(get_data_entry(post_data, 'include_archived'))
             if have_data_entry(post_data, 'accept'):
                 swap_client.acceptBid(bid_id)
             elif have_data_entry(post_data, 'debugind'):
                 swap_client.setBidDebugInd(bid_id, int(get_data_entry(post_data, 'debugind')))
 
-        bid, xmr_swap, offer, xmr_offer, events = swap_client.getXmrBidAndOffer(bid_id)
-        assert (bid), 'Unknown bid ID'
-
-        if post_string != '':
             if have_data_entry(post_data, 'chainbkeysplit'):
+                bid, xmr_swap, offer, xmr_offer, events = swap_client.getXmrBidAndOffer(bid_id, list_events=False)
+                assert (bid), 'Unknown bid ID'
                 return bytes(json.dumps({'splitkey': getChainBSplitKey(swap_client, bid, xmr_swap, offer)}), 'UTF-8')
             elif have_data_entry(post_data, 'spendchainblocktx'):
                 remote_key = get_data_entry(post_data, 'remote_key')
                 return bytes(json.dumps({'txid': recoverNoScriptTxnWithKey(swap_client, bid_id, remote_key).hex()}), 'UTF-8')
 
-        if len(url_split) > 4 and url_split[4] == 'states':
-            old_states = listOldBidStates(bid)
-            return bytes(json.dumps(old_states), 'UTF-8')
-
-        edit_bid = False
-        show_txns = False
-        data = describeBid(swap_client, bid, xmr_swap, offer, xmr_offer, events, edit_bid, show_txns, for_api=True)
+        if len(url_split) > 4 and url_split[4] in ('states', 'txns', 'locktransfers', 'timeline'):
+            # Sub-resources loaded on request, kept out of the cached description
+            bid, xmr_swap, offer, xmr_offer, events = swap_client.getXmrBidAndOffer(bid_id, list_events=False, include_archived=include_archived)
+            assert (bid), 'Unknown bid ID'
+            if url_split[4] == 'states':
+                return bytes(json.dumps(listOldBidStates(swap_client, bid)), 'UTF-8')
+            if url_split[4] == 'txns':
+                return bytes(json.dumps(describeBidTxns(swap_client, bid, xmr_swap, offer)), 'UTF-8')
+            if url_split[4] == 'timeline':
+                return bytes(json.dumps(describeBidTimeline(swap_client, bid)), 'UTF-8')
+            assert (offer.swap_type == SwapTypes.XMR_SWAP), 'Bid has no lock transfers'
+            return bytes(json.dumps({'lock_transfers': describeLockTransfers(swap_client, xmr_swap, offer)}), 'UTF-8')
+
+        data, bid, offer = describeBidCached(swap_client, bid_id, for_api=True, include_archived=include_archived)
+        assert (bid), 'Unknown bid ID'
         return bytes(json.dumps(data), 'UTF-8')
 
-    bids = swap_client.listBids()
+    filters = {}
+    if post_string != '':
+        if is_json:
+            post_data = json.loads(post_string)
+            post_data['is_json'] = True
+        else:
+            post_data = urllib.parse.parse_qs(post_string)
+        if have_data_entry(post_data, 'include_archived'):
+            filters['include_archived'] = toBool(get_data_entry(post_data, 'include_archived'))
+
+    bids = swap_client.listBids(filters=filters)
     return bytes(json.dumps([{
         'bid_id': b[2].hex(),
         'offer_id': b[3].hex(),
@@ -281,7 +307,16 @@ def js_bids(self, url_split, post_string, is_json):
 
 
 def js_sentbids(self, url_split, post_string, is_json):
-    return bytes(json.dumps(self.server.swap_client.listBids(sent=True)), 'UTF-8')
+    filters = {}
+    if post_string != '':
+        if is_json:
+            post_data = json.loads(post_string)
+            post_data['is_json'] = True
+        else:
+            post_data = urllib.parse.parse_qs(post_string)
+        if have_data_entry(post_data, 'include_archived'):
+            filters['include_archived'] = toBool(get_data_entry(post_data, 'include_archived'))
+    return bytes(json.dumps(self.server.swap_client.listBids(sent=True, filters=filters)), 'UTF-8')
 
 
 def js_network(self, url_split, post_string, is_json):
@@ -348,6 +383,20 @@ def js_rates_list(self, url_split, query_string, is_json):
     return bytes(json.dumps(sc.lookupRates(coin_from, coin_to, True)), 'UTF-8')
 
 
+def js_rates_history(self, url_split, query_string, is_json):
+    if is_json:
+        get_data = json.loads(query_string)
+        get_data['is_json'] = True
+    else:
+        get_data = urllib.parse.parse_qs(query_string if isinstance(query_string, bytes) else query_string.encode('utf-8'))
+    ensure(have_data_entry(get_data, 'from') and have_data_entry(get_data, 'to'), 'Must specify from and to')
+
+    sc = self.server.swap_client
+    coin_from = getCoinType(get_data_entry(get_data, 'from'))
+    coin_to = getCoinType(get_data_entry(get_data, 'to'))
+    return bytes(json.dumps(sc.getRateHistory(coin_from, coin_to)), 'UTF-8')
+
+
 def js_rate(self, url_split, post_string, is_json):
     if post_string == '':
         raise ValueError('No post data')
@@ -387,6 +436,32 @@ def js_rate(self, url_split, post_string, is_json):
     return bytes(json.dumps({'rate': rate}), 'UTF-8')
 
 
+def js_swaptimings(self, url_split, post_string, is_json):
+    # /json/swaptimings/<days>
+    days = float(url_split[3]) if len(url_split) > 3 and url_split[3] != '' else 7
+    since = int(time.time() - days * 24 * 60 * 60)
+    return bytes(json.dumps(self.server.swap_client.getBidSpanStats(since)), 'UTF-8')
+
+
+def js_profile(self, url_split, post_string, is_json):
+    swap_client = self.server.swap_client
+    if post_string != '':
+        if is_json:
+            post_data = json.loads(post_string)
+            post_data['is_json'] = True
+        else:
+            post_data = urllib.parse.parse_qs(post_string)
+        seconds = int(get_data_entry(post_data, 'seconds'))
+        interval_ms = int(get_data_entry_or(post_data, 'interval_ms', 10))
+        swap_client.startProfile(seconds, interval_ms)
+
+    # /json/profile/collapsed/<thread name prefix>
+    if len(url_split) > 3 and url_split[3] == 'collapsed':
+        thread_prefix = url_split[4] if len(url_split) > 4 and url_split[4] != '' else None
+        return bytes(swap_client.profiler.collapsedStacks(thread_prefix), 'UTF-8')
+    return bytes(json.dumps(swap_client.getProfileStatus()), 'UTF-8')
+
+
 def js_index(self, url_split, post_string, is_json):
     return bytes(json.dumps(self.server.swap_client.getSummary()), 'UTF-8')
 
@@ -406,5 +481,8 @@ def js_url_to_function(url_split):
             'rate': js_rate,
             'rates': js_rates,
             'rateslist': js_rates_list,
+            'rateshistory': js_rates_history,
+            'swaptimings': js_swaptimings,
+            'profile': js_profile,
         }.get(url_split[2], js_index)
     return js_index
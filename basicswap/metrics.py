@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+import json
+import time
+import bisect
+import threading
+import contextlib
+import urllib.parse
+
+from sqlalchemy import event
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0)
+
+
+def escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatLabels(labelnames, labels, extra=None):
+    pairs = ['{}="{}"'.format(k, escapeLabel(v)) for k, v in zip(labelnames, labels)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(extra[0], escapeLabel(extra[1])))
+    return '' if len(pairs) == 0 else '{' + ','.join(pairs) + '}'
+
+
+def formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric():
+    type_name = None
+
+    def __init__(self, name, help_str, labelnames=()):
+        self.name = name
+        self.help_str = help_str
+        self.labelnames = tuple(labelnames)
+        self._mx = threading.Lock()
+        self._values = {}  # labels tuple: value
+
+    def checkLabels(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError('{} expects labels {}'.format(self.name, self.labelnames))
+
+    def render(self, lines):
+        lines.append('# HELP {} {}'.format(self.name, self.help_str))
+        lines.append('# TYPE {} {}'.format(self.name, self.type_name))
+        with self._mx:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append('{}{} {}'.format(self.name, formatLabels(self.labelnames, labels), formatValue(value)))
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self.checkLabels(labels)
+        with self._mx:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name, help_str, labelnames=()):
+        super().__init__(name, help_str, labelnames)
+        self._function = None
+
+    def set(self, value, *labels):
+        self.checkLabels(labels)
+        with self._mx:
+            self._values[labels] = value
+
+    def setFunction(self, function):
+        # function() returns {labels tuple: value}, called when rendered
+        self._function = function
+
+    def render(self, lines):
+        if self._function is not None:
+            try:
+                values = self._function()
+                with self._mx:
+                    self._values = dict(values)
+            except Exception:
+                pass  # Keep the last values
+        super().render(lines)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_str, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        self.checkLabels(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._mx:
+            entry = self._values.get(labels, None)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]  # bucket counts, sum, count
+                self._values[labels] = entry
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def getStats(self):
+        # Returns {labels tuple: (count, sum)}
+        with self._mx:
+            return {labels: (entry[2], entry[1]) for labels, entry in self._values.items()}
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t_start, *labels)
+
+    def render(self, lines):
+        lines.append('# HELP {} {}'.format(self.name, self.help_str))
+        lines.append('# TYPE {} {}'.format(self.name, self.type_name))
+        with self._mx:
+            values = [(labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items()]
+        for labels, (counts, sum_value, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(self.name, formatLabels(self.labelnames, labels, ('le', formatValue(bound))), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, formatLabels(self.labelnames, labels), formatValue(sum_value)))
+            lines.append('{}_count{} {}'.format(self.name, formatLabels(self.labelnames, labels), count))
+
+
+class MetricsRegistry():
+    # Metrics are created on first use and rendered in the Prometheus text format
+
+    def __init__(self):
+        self._mx = threading.Lock()
+        self._metrics = {}
+
+    def getMetric(self, metric_class, name, help_str, labelnames, **kwargs):
+        with self._mx:
+            metric = self._metrics.get(name, None)
+            if metric is None:
+                metric = metric_class(name, help_str, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError('Metric {} exists with type {}'.format(name, metric.type_name))
+            return metric
+
+    def counter(self, name, help_str, labelnames=()):
+        return self.getMetric(Counter, name, help_str, labelnames)
+
+    def gauge(self, name, help_str, labelnames=()):
+        return self.getMetric(Gauge, name, help_str, labelnames)
+
+    def histogram(self, name, help_str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.getMetric(Histogram, name, help_str, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._mx:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+# Process wide, the rpc modules record into it without a reference to the app
+registry = MetricsRegistry()
+
+rpc_seconds = registry.histogram('basicswap_rpc_seconds', 'RPC request latency', ('coin', 'method'))
+rpc_errors = registry.counter('basicswap_rpc_errors_total', 'RPC requests that raised', ('coin', 'method'))
+
+_rpc_endpoint_names = {}
+_rpc_local = threading.local()  # RPC time spent by each thread, read by the bid span recorder
+
+
+def endpointKey(host, port):
+    if '://' in host:
+        host = urllib.parse.urlsplit(host).hostname
+    return '{}:{}'.format(host, port)
+
+
+def nameRPCEndpoint(host, port, name):
+    _rpc_endpoint_names[endpointKey(host, port)] = name
+
+
+def rpcEndpointName(host, port):
+    key = endpointKey(host, port)
+    return _rpc_endpoint_names.get(key, key)
+
+
+def observeRPC(host, port, method, t_start, failed=False):
+    name = rpcEndpointName(host, port)
+    elapsed = time.perf_counter() - t_start
+    _rpc_local.seconds = getattr(_rpc_local, 'seconds', 0.0) + elapsed
+    rpc_seconds.observe(elapsed, name, method)
+    if failed:
+        rpc_errors.inc(name, method)
+
+
+def isFailedRPCResponse(status, body):
+    # Daemons report rpc errors in the body, some with a 200 status
+    if status != 200:
+        return True
+    try:
+        r = json.loads(body)
+    except Exception:
+        return True
+    if isinstance(r, list):
+        return any(isinstance(c, dict) and c.get('error', None) is not None for c in r)
+    return isinstance(r, dict) and r.get('error', None) is not None
+
+
+def threadRPCSeconds():
+    # Total RPC time of the calling thread, take the difference around a block of work
+    return getattr(_rpc_local, 'seconds', 0.0)
+
+
+class TimedRLock():
+    # RLock recording the time spent waiting for and holding the outermost acquire
+
+    def __init__(self, wait_histogram, hold_histogram):
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._wait_histogram = wait_histogram
+        self._hold_histogram = hold_histogram
+
+    def acquire(self, blocking=True, timeout=-1):
+        t_start = time.perf_counter()
+        rv = self._lock.acquire(blocking, timeout)
+        if rv:
+            depth = getattr(self._local, 'depth', 0)
+            if depth == 0:
+                self._local.t_acquired = time.perf_counter()
+                self._wait_histogram.observe(self._local.t_acquired - t_start)
+            self._local.depth = depth + 1
+        return rv
+
+    def release(self):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self._hold_histogram.observe(time.perf_counter() - self._local.t_acquired)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def instrumentEngine(engine, histogram):
+    # Times each statement run through the engine, labelled by the statement type
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def beforeCursorExecute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def afterCursorExecute(conn, cursor, statement, parameters, context, executemany):
+        t_start = conn.info['query_start'].pop()
+        words = statement.split(None, 1)
+        histogram.observe(time.perf_counter() - t_start, words[0].upper() if len(words) > 0 else '')
+
+    @event.listens_for(engine, 'handle_error')
+    def handleError(context):
+        if context.connection is not None and len(context.connection.info.get('query_start', [])) > 0:
+            context.connection.info['query_start'].pop()
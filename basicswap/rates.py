@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+import json
+import time
+import threading
+import collections
+import concurrent.futures
+
+from .chainparams import Coins
+
+
+class RateProvider():
+    # Subclasses set name, the rate_sources settings key, and key, the key of the quote in lookupRates
+    name = None
+    key = None
+    default_url = None
+
+    def __init__(self, base_url=None):
+        self.base_url = self.default_url if base_url is None else base_url
+
+    def readJSON(self, read_url, url):
+        start = time.time()
+        js = json.loads(read_url(url))
+        js['time_taken'] = time.time() - start
+        return js
+
+    def fetch(self, read_url, ci_from, ci_to):
+        # Returns the quote, raises on error
+        raise ValueError('Not implemented')
+
+    def getRate(self, js):
+        # Rate of the quote as a float, for the history
+        return float(js['rate_inferred'])
+
+
+class CoinGeckoProvider(RateProvider):
+    name = 'coingecko.com'
+    key = 'coingecko'
+    default_url = 'https://api.coingecko.com/api/v3'
+
+    def fetch(self, read_url, ci_from, ci_to):
+        name_from = ci_from.chainparams()['name']
+        name_to = ci_to.chainparams()['name']
+        url = '{}/simple/price?ids={},{}&vs_currencies=usd,btc'.format(self.base_url, name_from, name_to)
+        js = self.readJSON(read_url, url)
+        rate = float(js[name_from]['usd']) / float(js[name_to]['usd'])
+        js['rate_inferred'] = ci_to.format_amount(rate, conv_int=True, r=1)
+        return js
+
+
+class BittrexProvider(RateProvider):
+    name = 'bittrex.com'
+    key = 'bittrex'
+    default_url = 'https://api.bittrex.com/v3'
+
+    def readTicker(self, read_url, pair):
+        js = self.readJSON(read_url, f'{self.base_url}/markets/{pair}/ticker')
+        js['pair'] = pair
+        return js
+
+    def fetch(self, read_url, ci_from, ci_to):
+        ticker_from = ci_from.chainparams()['ticker']
+        ticker_to = ci_to.chainparams()['ticker']
+        if ci_from.coin_type() == Coins.BTC:
+            js = self.readTicker(read_url, f'{ticker_to}-{ticker_from}')
+            rate_inverted = ci_from.make_int(1.0 / float(js['lastTradeRate']), r=1)
+            js['rate_inferred'] = ci_to.format_amount(rate_inverted)
+            js['from_btc'] = 1.0
+            js['to_btc'] = js['lastTradeRate']
+            return js
+        if ci_to.coin_type() == Coins.BTC:
+            js = self.readTicker(read_url, f'{ticker_from}-{ticker_to}')
+            js['rate_last'] = js['lastTradeRate']
+            js['from_btc'] = js['lastTradeRate']
+            js['to_btc'] = 1.0
+            return js
+
+        js_from = self.readTicker(read_url, f'{ticker_from}-BTC')
+        js_to = self.readTicker(read_url, f'{ticker_to}-BTC')
+        rate = float(js_from['lastTradeRate']) / float(js_to['lastTradeRate'])
+        return {
+            'from': js_from,
+            'to': js_to,
+            'rate_inferred': ci_to.format_amount(rate, conv_int=True, r=1),
+            'from_btc': js_from['lastTradeRate'],
+            'to_btc': js_to['lastTradeRate']
+        }
+
+    def getRate(self, js):
+        return float(js['rate_last'] if 'rate_last' in js else js['rate_inferred'])
+
+
+class RateService():
+    # Quotes are cached per pair for cache_seconds.
+    # Until stale_seconds the last quotes are returned while they are refreshed in the background.
+    # Providers are queried concurrently, in their own pool so background refreshes can wait on them.
+
+    def __init__(self, log, read_url, cache_seconds=60, stale_seconds=600, history_length=288, timeout=10):
+        self.log = log
+        self.read_url = read_url
+        self.cache_seconds = cache_seconds
+        self.stale_seconds = stale_seconds
+        self.history_length = history_length
+        self.timeout = timeout
+        self._providers = []
+        self._mx = threading.Lock()
+        self._cache = {}  # (coin_from, coin_to): {'rv', 'updated'}
+        self._refreshing = {}  # (coin_from, coin_to): future of the running refresh
+        self._history = {}  # (coin_from, coin_to): {provider key: deque of (time, rate)}
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='rates')
+        self._fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='rates_fetch')
+
+    def addProvider(self, provider):
+        self._providers.append(provider)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+        self._fetch_pool.shutdown(wait=False)
+
+    def readURL(self, url):
+        return self.read_url(url, timeout=self.timeout, headers={'Connection': 'close'})
+
+    def getRates(self, ci_from, ci_to):
+        pair = (int(ci_from.coin_type()), int(ci_to.coin_type()))
+        now = time.time()
+        with self._mx:
+            entry = self._cache.get(pair, None)
+            refresh = self._refreshing.get(pair, None)
+            if entry is not None:
+                age = now - entry['updated']
+                if age < self.cache_seconds:
+                    return entry['rv']
+                if age < self.stale_seconds:
+                    if refresh is None:
+                        self._refreshing[pair] = self._pool.submit(self.refreshRates, pair, ci_from, ci_to)
+                    return entry['rv']
+            if refresh is not None:
+                waiting = True
+            else:
+                waiting = False
+                refresh = concurrent.futures.Future()
+                refresh.set_running_or_notify_cancel()
+                self._refreshing[pair] = refresh
+        if waiting:
+            # Share the refresh already in flight
+            return refresh.result()
+        try:
+            rv = self.refreshRates(pair, ci_from, ci_to)
+        except Exception as e:
+            refresh.set_exception(e)
+            raise
+        refresh.set_result(rv)
+        return rv
+
+    def refreshRates(self, pair, ci_from, ci_to):
+        try:
+            return self.fetchRates(pair, ci_from, ci_to)
+        finally:
+            with self._mx:
+                self._refreshing.pop(pair, None)
+
+    def fetchRates(self, pair, ci_from, ci_to):
+        handles = []
+        for provider in self._providers:
+            self.log.debug('lookupRates: {} {}'.format(provider.name, pair))
+            handles.append((provider, self._fetch_pool.submit(provider.fetch, self.readURL, ci_from, ci_to)))
+
+        rv = {}
+        rates = []
+        deadline = time.time() + self.timeout
+        for provider, handle in handles:
+            try:
+                js = handle.result(timeout=max(0, deadline - time.time()))
+                rv[provider.key] = js
+                rates.append((provider.key, provider.getRate(js)))
+            except concurrent.futures.TimeoutError:
+                rv[provider.key + '_error'] = 'Timed out'
+            except Exception as e:
+                self.log.warning('lookupRates {} error: {}'.format(provider.name, str(e)))
+                rv[provider.key + '_error'] = str(e)
+
+        now = time.time()
+        with self._mx:
+            entry = self._cache.get(pair, None)
+            if len(rates) > 0 or entry is None:
+                self._cache[pair] = {'rv': rv, 'updated': now}
+            # Else keep serving the last quotes, retried at the next request
+            history = self._history.setdefault(pair, {})
+            for key, rate in rates:
+                if key not in history:
+                    history[key] = collections.deque(maxlen=self.history_length)
+                history[key].append((int(now), rate))
+        return rv
+
+    def getRateHistory(self, coin_from, coin_to):
+        with self._mx:
+            history = self._history.get((int(coin_from), int(coin_to)), {})
+            return {key: list(points) for key, points in history.items()}
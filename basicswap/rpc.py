@@ -18,6 +18,7 @@ from xmlrpc.client import (
     SafeTransport,
 )
 from .util import jsonDecimal
+from .metrics import observeRPC, isFailedRPCResponse
 
 
 def waitForRPC(rpc_func, expect_wallet=True, max_tries=7):
@@ -47,6 +48,8 @@ class Jsonrpc():
         if parsed.scheme not in ('http', 'https'):
             raise OSError('unsupported XML-RPC protocol')
         self.__host = parsed.netloc
+        self.__hostname = parsed.hostname
+        self.__port = parsed.port
         self.__handler = parsed.path
         if not self.__handler:
             self.__handler = '/RPC2'
@@ -70,16 +73,25 @@ class Jsonrpc():
             self.__transport.close()
 
     def json_request(self, method, params):
+        request_body = {
+            'method': method,
+            'params': params,
+            'id': self.__request_id
+        }
+        return self.__post(request_body)
+
+    def json_batch_request(self, calls):
+        # Request ids are the index of each call
+        request_body = [{'method': method, 'params': params, 'id': i} for i, (method, params) in enumerate(calls)]
+        return self.__post(request_body)
+
+    def __post(self, request_body):
+        t_start = time.perf_counter()
+        method = request_body['method'] if isinstance(request_body, dict) else 'batch'
         try:
             connection = self.__transport.make_connection(self.__host)
             headers = self.__transport._extra_headers[:]
 
-            request_body = {
-                'method': method,
-                'params': params,
-                'id': self.__request_id
-            }
-
             connection.putrequest('POST', self.__handler)
             headers.append(('Content-Type', 'application/json'))
             headers.append(('User-Agent', 'jsonrpc'))
@@ -88,11 +100,15 @@ class Jsonrpc():
             self.__request_id += 1
 
             resp = connection.getresponse()
-            return resp.read()
+            rv = resp.read()
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=isFailedRPCResponse(resp.status, rv))
+            return rv
 
         except Fault:
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=True)
             raise
         except Exception:
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=True)
             # All unexpected errors leave connection in
             # a strange state, so we clear it.
             self.__transport.close()
@@ -119,6 +135,32 @@ def callrpc(rpc_port, auth, method, params=[], wallet=None, host='127.0.0.1'):
     return r['result']
 
 
+def callrpc_batch(rpc_port, auth, calls, wallet=None, host='127.0.0.1'):
+    # calls is a list of (method, params), results are returned in the same order
+    try:
+        url = 'http://{}@{}:{}/'.format(auth, host, rpc_port)
+        if wallet is not None:
+            url += 'wallet/' + urllib.parse.quote(wallet)
+        x = Jsonrpc(url)
+
+        v = x.json_batch_request(calls)
+        x.close()
+        r = json.loads(v.decode('utf-8'))
+    except Exception as ex:
+        traceback.print_exc()
+        raise ValueError('RPC server error ' + str(ex))
+
+    if isinstance(r, dict):
+        raise ValueError('RPC error ' + str(r.get('error', None)))
+
+    results = [None] * len(calls)
+    for rv in r:
+        if 'error' in rv and rv['error'] is not None:
+            raise ValueError('RPC error ' + str(rv['error']))
+        results[rv['id']] = rv['result']
+    return results
+
+
 def openrpc(rpc_port, auth, wallet=None, host='127.0.0.1'):
     try:
         url = 'http://{}@{}:{}/'.format(auth, host, rpc_port)
@@ -163,3 +205,15 @@ def make_rpc_func(port, auth, wallet=None, host='127.0.0.1'):
         nonlocal port, auth, wallet, host
         return callrpc(port, auth, method, params, wallet if wallet_override is None else wallet_override, host)
     return rpc_func
+
+
+def make_rpc_batch_func(port, auth, wallet=None, host='127.0.0.1'):
+    port = port
+    auth = auth
+    wallet = wallet
+    host = host
+
+    def rpc_batch_func(calls, wallet_override=None):
+        nonlocal port, auth, wallet, host
+        return callrpc_batch(port, auth, calls, wallet if wallet_override is None else wallet_override, host)
+    return rpc_batch_func
@@ -11,6 +11,7 @@ from xmlrpc.client import (
     SafeTransport,
 )
 from .util import jsonDecimal
+from .metrics import observeRPC, isFailedRPCResponse
 
 
 class JsonrpcDigest():
@@ -23,6 +24,8 @@ class JsonrpcDigest():
         if parsed.scheme not in ('http', 'https'):
             raise OSError('unsupported XML-RPC protocol')
         self.__host = parsed.netloc
+        self.__hostname = parsed.hostname
+        self.__port = parsed.port
         self.__handler = parsed.path
 
         if transport is None:
@@ -44,6 +47,7 @@ class JsonrpcDigest():
             self.__transport.close()
 
     def post_request(self, method, params, timeout=None):
+        t_start = time.perf_counter()
         try:
             connection = self.__transport.make_connection(self.__host)
             if timeout:
@@ -58,15 +62,20 @@ class JsonrpcDigest():
             self.__request_id += 1
 
             resp = connection.getresponse()
-            return resp.read()
+            rv = resp.read()
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=isFailedRPCResponse(resp.status, rv))
+            return rv
 
         except Fault:
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=True)
             raise
         except Exception:
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=True)
             self.__transport.close()
             raise
 
     def json_request(self, method, params, username='', password='', timeout=None):
+        t_start = time.perf_counter()
         try:
             connection = self.__transport.make_connection(self.__host)
             if timeout:
@@ -150,11 +159,15 @@ class JsonrpcDigest():
                 resp = connection.getresponse()
 
             self.__request_id += 1
-            return resp.read()
+            rv = resp.read()
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=isFailedRPCResponse(resp.status, rv))
+            return rv
 
         except Fault:
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=True)
             raise
         except Exception:
+            observeRPC(self.__hostname, self.__port, method, t_start, failed=True)
             self.__transport.close()
             raise
 
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+import heapq
+import threading
+
+from sqlalchemy import event
+
+from .db import (
+    Bid,
+    Offer,
+)
+from .basicswap_util import (
+    BidStates,
+)
+
+
+class ExpiringSet():
+    # Keys counted until their expiry time, expired keys are dropped when counted
+
+    def __init__(self):
+        self._expire_at = {}
+        self._heap = []
+
+    def add(self, key, expire_at):
+        if self._expire_at.get(key, None) == expire_at:
+            return
+        self._expire_at[key] = expire_at
+        heapq.heappush(self._heap, (expire_at, key))
+
+    def discard(self, key):
+        self._expire_at.pop(key, None)
+
+    def count(self, now):
+        while len(self._heap) > 0 and self._heap[0][0] <= now:
+            expire_at, key = heapq.heappop(self._heap)
+            if self._expire_at.get(key, None) == expire_at:
+                del self._expire_at[key]
+        return len(self._expire_at)
+
+
+class SummaryCounters():
+    # Bid and offer counts shown on the index page, updated from committed sessions.
+    # Rows changed with raw sql are not seen, reset() replaces all values from the db.
+
+    def __init__(self):
+        self._mx = threading.Lock()
+        self.loaded = False
+        self.num_sent_bids = 0
+        self.num_recv_bids = 0
+        self._available_bids = ExpiringSet()  # Received bids in the BID_RECEIVED state
+        self._active_offers = ExpiringSet()
+        self._sent_offers = set()
+
+    def listen(self, session_factory):
+        event.listen(session_factory, 'after_flush', self.afterFlush)
+        event.listen(session_factory, 'after_commit', self.afterCommit)
+        event.listen(session_factory, 'after_rollback', self.afterRollback)
+
+    def afterFlush(self, session, flush_context):
+        changes = session.info.setdefault('summary_changes', [])
+        for is_new, is_deleted, objs in ((True, False, session.new), (False, False, session.dirty), (False, True, session.deleted)):
+            for obj in objs:
+                if isinstance(obj, Bid):
+                    changes.append((Bid, obj.bid_id, is_new, is_deleted, obj.active_ind == 1, obj.was_sent, obj.was_received, obj.state, obj.expire_at))
+                elif isinstance(obj, Offer):
+                    changes.append((Offer, obj.offer_id, is_new, is_deleted, obj.active_ind == 1, obj.was_sent, None, None, obj.expire_at))
+
+    def afterCommit(self, session):
+        changes = session.info.pop('summary_changes', None)
+        if not changes:
+            return
+        with self._mx:
+            for record_type, record_id, is_new, is_deleted, active, was_sent, was_received, state, expire_at in changes:
+                if record_type == Bid:
+                    if is_new or is_deleted:
+                        amount = -1 if is_deleted else 1
+                        if active and was_sent:
+                            self.num_sent_bids += amount
+                        if active and was_received:
+                            self.num_recv_bids += amount
+                    if not is_deleted and active and was_received and state == BidStates.BID_RECEIVED and expire_at is not None:
+                        self._available_bids.add(record_id, expire_at)
+                    else:
+                        self._available_bids.discard(record_id)
+                    continue
+                if not is_deleted and active and expire_at is not None:
+                    self._active_offers.add(record_id, expire_at)
+                else:
+                    self._active_offers.discard(record_id)
+                if not is_deleted and active and was_sent:
+                    self._sent_offers.add(record_id)
+                else:
+                    self._sent_offers.discard(record_id)
+
+    def afterRollback(self, session):
+        session.info.pop('summary_changes', None)
+
+    def reset(self, num_sent_bids, num_recv_bids, available_bids, active_offers, sent_offers):
+        # available_bids and active_offers are lists of (id, expire_at)
+        with self._mx:
+            self.num_sent_bids = num_sent_bids
+            self.num_recv_bids = num_recv_bids
+            self._available_bids = ExpiringSet()
+            for bid_id, expire_at in available_bids:
+                self._available_bids.add(bid_id, expire_at)
+            self._active_offers = ExpiringSet()
+            for offer_id, expire_at in active_offers:
+                self._active_offers.add(offer_id, expire_at)
+            self._sent_offers = set(sent_offers)
+            self.loaded = True
+
+    def get(self, now):
+        with self._mx:
+            return {
+                'num_network_offers': self._active_offers.count(now),
+                'num_sent_offers': len(self._sent_offers),
+                'num_recv_bids': self.num_recv_bids,
+                'num_sent_bids': self.num_sent_bids,
+                'num_available_bids': self._available_bids.count(now),
+            }
@@ -8,10 +8,12 @@ from .util import (
     PAGE_LIMIT,
     describeBid,
     get_data_entry,
+    describeBidCached,
     have_data_entry,
     get_data_entry_or,
     listBidStates,
     listOldBidStates,
+    describeBidTimeline,
     set_pagination_filters,
 )
 from basicswap.util import (
@@ -43,6 +45,7 @@ def page_bid(self, url_split, post_string):
     show_txns = False
     show_offerer_seq_diagram = False
     show_bidder_seq_diagram = False
+    show_timeline = False
     show_lock_transfers = False
     edit_bid = False
     view_tx_ind = None
@@ -66,6 +69,8 @@ def page_bid(self, url_split, post_string):
             show_offerer_seq_diagram = True
         elif b'show_bidder_seq_diagram' in form_data:
             show_bidder_seq_diagram = True
+        elif b'show_timeline' in form_data:
+            show_timeline = True
         elif b'edit_bid' in form_data:
             edit_bid = True
         elif b'edit_bid_submit' in form_data:
@@ -89,18 +94,24 @@ def page_bid(self, url_split, post_string):
             show_txns = True
             show_lock_transfers = True
 
-    bid, xmr_swap, offer, xmr_offer, events = swap_client.getXmrBidAndOffer(bid_id)
-    ensure(bid, 'Unknown bid ID')
-
-    data = describeBid(swap_client, bid, xmr_swap, offer, xmr_offer, events, edit_bid, show_txns, view_tx_ind, show_lock_transfers=show_lock_transfers)
+    if edit_bid or show_txns:
+        bid, xmr_swap, offer, xmr_offer, events = swap_client.getXmrBidAndOffer(bid_id, include_archived=True)
+        ensure(bid, 'Unknown bid ID')
+        data = describeBid(swap_client, bid, xmr_swap, offer, xmr_offer, events, edit_bid, show_txns, view_tx_ind, show_lock_transfers=show_lock_transfers)
+    else:
+        data, bid, offer = describeBidCached(swap_client, bid_id, include_archived=True)
+        ensure(bid, 'Unknown bid ID')
 
     if bid.debug_ind is not None and bid.debug_ind > 0:
         messages.append('Debug flag set: {}, {}'.format(bid.debug_ind, DebugTypes(bid.debug_ind).name))
 
     data['show_bidder_seq_diagram'] = show_bidder_seq_diagram
     data['show_offerer_seq_diagram'] = show_offerer_seq_diagram
+    data['show_timeline'] = show_timeline
+    if show_timeline:
+        data['timeline'] = describeBidTimeline(swap_client, bid)
 
-    old_states = listOldBidStates(bid)
+    old_states = listOldBidStates(swap_client, bid)
 
     if len(data['addr_from_label']) > 0:
         data['addr_from_label'] = '(' + data['addr_from_label'] + ')'
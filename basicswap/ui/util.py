@@ -5,7 +5,7 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
 import json
-import struct
+import time
 import traceback
 from basicswap.util import (
     make_int,
@@ -22,10 +22,12 @@ from basicswap.basicswap_util import (
     SwapTypes,
     strTxType,
     DebugTypes,
+    SpanTypes,
     strTxState,
     strBidState,
+    strSpanType,
     TxLockTypes,
-    getLastBidState,
+    isActiveBidState,
 )
 
 from basicswap.protocols.xmr_swap_1 import getChainBSplitKey
@@ -196,7 +198,7 @@ def describeBid(swap_client, bid, xmr_swap, offer, xmr_offer, bid_events, edit_b
         elif bid.state == BidStates.BID_ACCEPTED:
             state_description = 'Offerer has accepted bid, waiting for bidder to respond'
         elif bid.state == BidStates.SWAP_DELAYING:
-            last_state = getLastBidState(bid.states)
+            last_state = swap_client.getPreviousBidState(bid.bid_id, archived=bid.archived)
             if last_state == BidStates.BID_RECEIVED:
                 state_description = 'Delaying before accepting bid'
             elif last_state == BidStates.BID_RECEIVING_ACC:
@@ -270,56 +272,10 @@ def describeBid(swap_client, bid, xmr_swap, offer, xmr_offer, bid_events, edit_b
             data['debug_options'] = [(int(t), t.name) for t in DebugTypes]
 
     if show_txns:
-        if offer.swap_type == SwapTypes.XMR_SWAP:
-            txns = []
-            if bid.xmr_a_lock_tx:
-                confirms = None
-                if swap_client.coin_clients[ci_from.coin_type()]['chain_height'] and bid.xmr_a_lock_tx.chain_height:
-                    confirms = (swap_client.coin_clients[ci_from.coin_type()]['chain_height'] - bid.xmr_a_lock_tx.chain_height) + 1
-                txns.append({'type': 'Chain A Lock', 'txid': bid.xmr_a_lock_tx.txid.hex(), 'confirms': confirms})
-            if bid.xmr_a_lock_spend_tx:
-                txns.append({'type': 'Chain A Lock Spend', 'txid': bid.xmr_a_lock_spend_tx.txid.hex()})
-            if bid.xmr_b_lock_tx:
-                confirms = None
-                if swap_client.coin_clients[ci_to.coin_type()]['chain_height'] and bid.xmr_b_lock_tx.chain_height:
-                    confirms = (swap_client.coin_clients[ci_to.coin_type()]['chain_height'] - bid.xmr_b_lock_tx.chain_height) + 1
-                txns.append({'type': 'Chain B Lock', 'txid': bid.xmr_b_lock_tx.txid.hex(), 'confirms': confirms})
-            if bid.xmr_b_lock_tx and bid.xmr_b_lock_tx.spend_txid:
-                txns.append({'type': 'Chain B Lock Spend', 'txid': bid.xmr_b_lock_tx.spend_txid.hex()})
-            if xmr_swap.a_lock_refund_tx:
-                txns.append({'type': strTxType(TxTypes.XMR_SWAP_A_LOCK_REFUND), 'txid': xmr_swap.a_lock_refund_tx_id.hex()})
-            if xmr_swap.a_lock_refund_spend_tx:
-                txns.append({'type': strTxType(TxTypes.XMR_SWAP_A_LOCK_REFUND_SPEND), 'txid': xmr_swap.a_lock_refund_spend_tx_id.hex()})
-            for tx_type, tx in bid.txns.items():
-                if tx_type in (TxTypes.XMR_SWAP_A_LOCK_REFUND, TxTypes.XMR_SWAP_A_LOCK_REFUND_SPEND):
-                    continue
-                txns.append({'type': strTxType(tx_type), 'txid': tx.txid.hex()})
-            data['txns'] = txns
-
-            data['xmr_b_shared_address'] = ci_to.encodeSharedAddress(xmr_swap.pkbv, xmr_swap.pkbs) if xmr_swap.pkbs else None
-            data['xmr_b_shared_viewkey'] = ci_to.encodeKey(xmr_swap.vkbv) if xmr_swap.vkbv else None
-
-            if swap_client.debug_ui:
-                try:
-                    data['xmr_b_half_privatekey'] = getChainBSplitKey(swap_client, bid, xmr_swap, offer)
-                except Exception as e:
-                    swap_client.log.error(traceback.format_exc())
-
-            if show_lock_transfers:
-                if xmr_swap.pkbs:
-                    data['lock_transfers'] = json.dumps(ci_to.showLockTransfers(xmr_swap.pkbv, xmr_swap.pkbs), indent=4)
-                else:
-                    data['lock_transfers'] = 'Shared address not yet known.'
-        else:
-            data['initiate_tx_refund'] = 'None' if not bid.initiate_txn_refund else bid.initiate_txn_refund.hex()
-            data['participate_tx_refund'] = 'None' if not bid.participate_txn_refund else bid.participate_txn_refund.hex()
-            data['initiate_tx_spend'] = getTxSpendHex(bid, TxTypes.ITX)
-            data['participate_tx_spend'] = getTxSpendHex(bid, TxTypes.PTX)
-
-            if bid.initiate_tx and bid.initiate_tx.tx_data is not None:
-                data['initiate_tx_inputs'] = ci_from.listInputs(bid.initiate_tx.tx_data)
-            if bid.participate_tx and bid.participate_tx.tx_data is not None:
-                data['initiate_tx_inputs'] = ci_from.listInputs(bid.participate_tx.tx_data)
+        data.update(describeBidTxns(swap_client, bid, xmr_swap, offer))
+        if show_lock_transfers and offer.swap_type == SwapTypes.XMR_SWAP:
+            lock_transfers = describeLockTransfers(swap_client, xmr_swap, offer)
+            data['lock_transfers'] = 'Shared address not yet known.' if lock_transfers is None else json.dumps(lock_transfers, indent=4)
 
     if offer.swap_type == SwapTypes.XMR_SWAP:
         data['coin_a_lock_refund_tx_est_final'] = 'None'
@@ -360,29 +316,196 @@ def describeBid(swap_client, bid, xmr_swap, offer, xmr_offer, bid_events, edit_b
     return data
 
 
-def listOldBidStates(bid):
+def describeBidTxns(swap_client, bid, xmr_swap, offer):
+    # Kept out of the cached description, confirmations depend on the chain height
+    ci_from = swap_client.ci(Coins(offer.coin_from))
+    ci_to = swap_client.ci(Coins(offer.coin_to))
+    data = {}
+    if offer.swap_type == SwapTypes.XMR_SWAP:
+        txns = []
+        if bid.xmr_a_lock_tx:
+            confirms = None
+            if swap_client.coin_clients[ci_from.coin_type()]['chain_height'] and bid.xmr_a_lock_tx.chain_height:
+                confirms = (swap_client.coin_clients[ci_from.coin_type()]['chain_height'] - bid.xmr_a_lock_tx.chain_height) + 1
+            txns.append({'type': 'Chain A Lock', 'txid': bid.xmr_a_lock_tx.txid.hex(), 'confirms': confirms})
+        if bid.xmr_a_lock_spend_tx:
+            txns.append({'type': 'Chain A Lock Spend', 'txid': bid.xmr_a_lock_spend_tx.txid.hex()})
+        if bid.xmr_b_lock_tx:
+            confirms = None
+            if swap_client.coin_clients[ci_to.coin_type()]['chain_height'] and bid.xmr_b_lock_tx.chain_height:
+                confirms = (swap_client.coin_clients[ci_to.coin_type()]['chain_height'] - bid.xmr_b_lock_tx.chain_height) + 1
+            txns.append({'type': 'Chain B Lock', 'txid': bid.xmr_b_lock_tx.txid.hex(), 'confirms': confirms})
+        if bid.xmr_b_lock_tx and bid.xmr_b_lock_tx.spend_txid:
+            txns.append({'type': 'Chain B Lock Spend', 'txid': bid.xmr_b_lock_tx.spend_txid.hex()})
+        if xmr_swap.a_lock_refund_tx:
+            txns.append({'type': strTxType(TxTypes.XMR_SWAP_A_LOCK_REFUND), 'txid': xmr_swap.a_lock_refund_tx_id.hex()})
+        if xmr_swap.a_lock_refund_spend_tx:
+            txns.append({'type': strTxType(TxTypes.XMR_SWAP_A_LOCK_REFUND_SPEND), 'txid': xmr_swap.a_lock_refund_spend_tx_id.hex()})
+        for tx_type, tx in bid.txns.items():
+            if tx_type in (TxTypes.XMR_SWAP_A_LOCK_REFUND, TxTypes.XMR_SWAP_A_LOCK_REFUND_SPEND):
+                continue
+            txns.append({'type': strTxType(tx_type), 'txid': tx.txid.hex()})
+        data['txns'] = txns
+
+        data['xmr_b_shared_address'] = ci_to.encodeSharedAddress(xmr_swap.pkbv, xmr_swap.pkbs) if xmr_swap.pkbs else None
+        data['xmr_b_shared_viewkey'] = ci_to.encodeKey(xmr_swap.vkbv) if xmr_swap.vkbv else None
+
+        if swap_client.debug_ui:
+            try:
+                data['xmr_b_half_privatekey'] = getChainBSplitKey(swap_client, bid, xmr_swap, offer)
+            except Exception as e:
+                swap_client.log.error(traceback.format_exc())
+    else:
+        data['initiate_tx_refund'] = 'None' if not bid.initiate_txn_refund else bid.initiate_txn_refund.hex()
+        data['participate_tx_refund'] = 'None' if not bid.participate_txn_refund else bid.participate_txn_refund.hex()
+        data['initiate_tx_spend'] = getTxSpendHex(bid, TxTypes.ITX)
+        data['participate_tx_spend'] = getTxSpendHex(bid, TxTypes.PTX)
+
+        if bid.initiate_tx and bid.initiate_tx.tx_data is not None:
+            data['initiate_tx_inputs'] = ci_from.listInputs(bid.initiate_tx.tx_data)
+        if bid.participate_tx and bid.participate_tx.tx_data is not None:
+            data['initiate_tx_inputs'] = ci_from.listInputs(bid.participate_tx.tx_data)
+
+    return data
+
+
+def describeLockTransfers(swap_client, xmr_swap, offer):
+    # Queries the chain B wallet, returns None if the shared address is not yet known
+    if not xmr_swap.pkbs:
+        return None
+    ci_to = swap_client.ci(Coins(offer.coin_to))
+    return ci_to.showLockTransfers(xmr_swap.pkbv, xmr_swap.pkbs)
+
+
+def describeBidCached(swap_client, bid_id, for_api=False, include_archived=False):
+    # Returns (data, bid, offer), reusing the last description until the bid changes
+    version = swap_client.getBidDescriptionVersion(bid_id, include_archived)
+    if version is None:
+        return None, None, None
+
+    cache_key = (bid_id, for_api)
+    cached = swap_client.getCachedBidDescription(cache_key, version)
+    if cached is None:
+        bid, xmr_swap, offer, xmr_offer, events = swap_client.getXmrBidAndOffer(bid_id, include_archived=include_archived)
+        if bid is None:
+            return None, None, None
+        cached = (describeBid(swap_client, bid, xmr_swap, offer, xmr_offer, events, False, False, for_api=for_api), bid, offer)
+        swap_client.setCachedBidDescription(cache_key, version, cached)
+
+    data, bid, offer = cached
+    data = dict(data)
+    if 'coin_a_last_median_time' in data:
+        data['coin_a_last_median_time'] = swap_client.coin_clients[offer.coin_from]['chain_median_time']
+    return data, bid, offer
+
+
+def listOldBidStates(swap_client, bid):
     old_states = []
-    num_states = len(bid.states) // 12
-    for i in range(num_states):
-        up = struct.unpack_from('<iq', bid.states[i * 12:(i + 1) * 12])
-        old_states.append((up[1], 'Bid ' + strBidState(up[0])))
-    if bid.initiate_tx and bid.initiate_tx.states is not None:
-        num_states = len(bid.initiate_tx.states) // 12
-        for i in range(num_states):
-            up = struct.unpack_from('<iq', bid.initiate_tx.states[i * 12:(i + 1) * 12])
-            if up[0] != TxStates.TX_NONE:
-                old_states.append((up[1], 'ITX ' + strTxState(up[0])))
-    if bid.participate_tx and bid.participate_tx.states is not None:
-        num_states = len(bid.participate_tx.states) // 12
-        for i in range(num_states):
-            up = struct.unpack_from('<iq', bid.participate_tx.states[i * 12:(i + 1) * 12])
-            if up[0] != TxStates.TX_NONE:
-                old_states.append((up[1], 'PTX ' + strTxState(up[0])))
+    for created_at, tx_type, state in swap_client.getBidStateHistory(bid.bid_id, archived=bid.archived):
+        if tx_type is None:
+            old_states.append((created_at, 'Bid ' + strBidState(state)))
+        elif state == TxStates.TX_NONE:
+            continue
+        elif tx_type == TxTypes.ITX:
+            old_states.append((created_at, 'ITX ' + strTxState(state)))
+        elif tx_type == TxTypes.PTX:
+            old_states.append((created_at, 'PTX ' + strTxState(state)))
     if len(old_states) > 0:
         old_states.sort(key=lambda x: x[0])
     return old_states
 
 
+TIMELINE_COLOURS = {
+    'state': '#9ab',
+    'confirmations': '#e9b94f',
+    'peer_wait': '#7aa6da',
+    'action_delay': '#b9a0d9',
+    'processing': '#6bbf6b',
+}
+
+
+def spanCategory(span_type):
+    if span_type == SpanTypes.PEER_WAIT:
+        return 'peer_wait'
+    if span_type == SpanTypes.ACTION_DELAY:
+        return 'action_delay'
+    return 'processing'
+
+
+def txTypeLabel(tx_type):
+    # strTxType only names the adaptor sig swap txns
+    label = strTxType(tx_type)
+    if label == 'Unknown':
+        return TxTypes(tx_type).name
+    return label
+
+
+def describeBidTimeline(swap_client, bid):
+    # Rows for a gantt view of where the time of a bid went, times in seconds
+    rows = []
+    now = time.time()
+    history = swap_client.getBidStateHistory(bid.bid_id, archived=bid.archived)
+
+    bid_states = [(created_at, state) for created_at, tx_type, state in history if tx_type is None]
+    for i, (created_at, state) in enumerate(bid_states):
+        if i + 1 < len(bid_states):
+            ended_at = bid_states[i + 1][0]
+        else:
+            ended_at = now if isActiveBidState(state) else created_at
+        rows.append({'category': 'state', 'label': 'Bid ' + strBidState(state), 'start': created_at, 'duration': ended_at - created_at})
+
+    # Confirmation waits, from broadcast to confirmed
+    tx_sent = {}
+    for created_at, tx_type, state in history:
+        if tx_type is None:
+            continue
+        if state == TxStates.TX_SENT:
+            tx_sent.setdefault(tx_type, created_at)
+        elif state == TxStates.TX_CONFIRMED and tx_type in tx_sent:
+            sent_at = tx_sent.pop(tx_type)
+            rows.append({'category': 'confirmations', 'label': txTypeLabel(tx_type) + ' Confirming', 'start': sent_at, 'duration': created_at - sent_at})
+    if isActiveBidState(bid.state):
+        for tx_type, sent_at in tx_sent.items():
+            rows.append({'category': 'confirmations', 'label': txTypeLabel(tx_type) + ' Confirming', 'start': sent_at, 'duration': now - sent_at})
+
+    for span_type, name, started_at, duration, rpc_duration in swap_client.getBidSpans(bid.bid_id, archived=bid.archived):
+        rows.append({
+            'category': spanCategory(span_type),
+            'label': strSpanType(span_type) + ' ' + name,
+            'start': started_at / 1000,
+            'duration': duration / 1000,
+            'rpc': (rpc_duration or 0) / 1000,
+        })
+
+    totals = {k: 0.0 for k in TIMELINE_COLOURS.keys() if k != 'state'}
+    totals['rpc'] = 0.0
+    if len(rows) < 1:
+        return {'started_at': None, 'duration': 0, 'rows': rows, 'totals': totals}
+
+    started_at = min(r['start'] for r in rows)
+    duration = max(max(r['start'] + r['duration'] for r in rows) - started_at, 1)
+    for r in rows:
+        if r['category'] != 'state':
+            totals[r['category']] += r['duration']
+        if r['category'] == 'processing':
+            totals['processing'] -= r['rpc']
+            totals['rpc'] += r['rpc']
+        r['offset'] = round(r['start'] - started_at, 3)
+        r['duration'] = round(r['duration'], 3)
+        r['offset_pct'] = round((r['start'] - started_at) * 100 / duration, 2)
+        r['width_pct'] = round(r['duration'] * 100 / duration, 2)
+        r['colour'] = TIMELINE_COLOURS[r['category']]
+        del r['start']
+    rows.sort(key=lambda r: (r['category'] != 'state', r['offset']))
+
+    return {
+        'started_at': int(started_at),
+        'duration': round(duration, 3),
+        'rows': rows,
+        'totals': {k: round(v, 3) for k, v in totals.items()},
+    }
+
+
 def getCoinName(c):
     if c == Coins.PART_ANON:
         return chainparams[Coins.PART]['name'].capitalize() + 'Anon'
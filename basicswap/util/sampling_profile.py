@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+import os
+import sys
+import time
+import threading
+import collections
+
+
+def frameName(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class SamplingProfiler:
+    # Samples the stacks of all threads from a separate thread for a fixed time.
+    # Nothing is installed in the profiled threads, when not running there is no overhead.
+
+    def __init__(self):
+        self._mx = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._stacks = collections.Counter()  # (thread name, frame names from the root): num samples
+        self.started_at = None
+        self.duration = 0
+        self.interval = 0
+        self.num_samples = 0
+
+    def isRunning(self):
+        with self._mx:
+            return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration, interval=0.01):
+        with self._mx:
+            if self._thread is not None and self._thread.is_alive():
+                raise ValueError('Profiler is already running')
+            self._stacks = collections.Counter()
+            self._stop_event.clear()
+            self.started_at = time.time()
+            self.duration = duration
+            self.interval = interval
+            self.num_samples = 0
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._mx:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        t_end = time.monotonic() + self.duration
+        while not self._stop_event.is_set() and time.monotonic() < t_end:
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(frameName(frame))
+                    frame = frame.f_back
+                names.reverse()
+                stacks.append((thread_names.get(ident, str(ident)), tuple(names)))
+            with self._mx:
+                for stack in stacks:
+                    self._stacks[stack] += 1
+                self.num_samples += 1
+            self._stop_event.wait(self.interval)
+
+    def getStatus(self):
+        with self._mx:
+            running = self._thread is not None and self._thread.is_alive()
+            return {
+                'running': running,
+                'started_at': None if self.started_at is None else int(self.started_at),
+                'duration': self.duration,
+                'interval_ms': int(self.interval * 1000),
+                'num_samples': self.num_samples,
+            }
+
+    def collapsedStacks(self, thread_prefix=None):
+        # One line per stack in the folded format read by flamegraph.pl and speedscope
+        with self._mx:
+            stacks = list(self._stacks.items())
+        lines = []
+        for (thread_name, names), count in sorted(stacks):
+            if thread_prefix is not None and not thread_name.startswith(thread_prefix):
+                continue
+            lines.append('{};{} {}'.format(thread_name, ';'.join(names), count))
+        return '\n'.join(lines) + '\n'
+
+    def topFunctions(self, num_functions=30):
+        # Functions by samples at the top of the stack, and by samples anywhere in the stack
+        own = collections.Counter()
+        total = collections.Counter()
+        with self._mx:
+            stacks = list(self._stacks.items())
+        for (thread_name, names), count in stacks:
+            if len(names) < 1:
+                continue
+            own[names[-1]] += count
+            for name in set(names):
+                total[name] += count
+        return [(name, count, total[name]) for name, count in own.most_common(num_functions)]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+import sys
+import time
+import builtins
+import threading
+import contextlib
+import importlib.util
+
+
+class StartupProfile:
+    # Times module imports and named init phases, like python -X importtime
+    # Only imports from the thread that called install() are recorded.
+
+    def __init__(self):
+        self.imports = []  # (module name, self seconds, cumulative seconds)
+        self.phases = []  # (phase name, seconds)
+        self._stack = []
+        self._import = None
+        self._thread = None
+
+    def install(self):
+        self._import = builtins.__import__
+        self._thread = threading.current_thread()
+        builtins.__import__ = self._timedImport
+
+    def uninstall(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _timedImport(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if threading.current_thread() is not self._thread:
+            return self._import(name, globals, locals, fromlist, level)
+
+        num_modules = len(sys.modules)
+        self._stack.append(0.0)
+        t_start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            t_taken = time.perf_counter() - t_start
+            t_children = self._stack.pop()
+            if len(self._stack) > 0:
+                self._stack[-1] += t_taken
+            if len(sys.modules) > num_modules:
+                if level > 0 and globals is not None:
+                    try:
+                        name = importlib.util.resolve_name('.' * level + name, globals.get('__package__', None))
+                    except Exception:
+                        pass
+                self.imports.append((name, t_taken - t_children, t_taken))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - t_start))
+
+    def report(self, log, num_imports=20):
+        log.info('Startup profile, slowest imports:')
+        log.info('{:>12} | {:>12} | {}'.format('self [us]', 'cumulative', 'module'))
+        for name, t_self, t_cumulative in sorted(self.imports, key=lambda x: x[1], reverse=True)[:num_imports]:
+            log.info('{:>12} | {:>12} | {}'.format(int(t_self * 1e6), int(t_cumulative * 1e6), name))
+        log.info('Startup profile, init phases:')
+        for name, t_taken in self.phases:
+            log.info('{:>10.3f}s | {}'.format(t_taken, name))
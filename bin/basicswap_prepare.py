@@ -25,7 +25,6 @@ from urllib.request import urlretrieve
 
 import basicswap.config as cfg
 from basicswap.base import getaddrinfo_tor
-from basicswap.basicswap import BasicSwap
 from basicswap.chainparams import Coins
 from basicswap.util import toBool
 from basicswap.util.rfc2440 import rfc2440_hash_password
@@ -837,6 +836,9 @@ def finalise_daemon(d):
 
 
 def initialise_wallets(particl_wallet_mnemonic, with_coins, data_dir, settings, chain, use_tor_proxy):
+    # Imported here so --help and the download steps don't load the full application
+    from basicswap.basicswap import BasicSwap
+
     daemons = []
     daemon_args = ['-noconnect', '-nodnsseed']
     if not use_tor_proxy:
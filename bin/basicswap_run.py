@@ -13,13 +13,12 @@ import shutil
 import signal
 import logging
 import traceback
+import contextlib
 import subprocess
 
 import basicswap.config as cfg
 from basicswap import __version__
-from basicswap.basicswap import BasicSwap
-from basicswap.http_server import HttpThread
-from basicswap.contrib.websocket_server import WebsocketServer
+from basicswap.util.startup_profile import StartupProfile
 
 
 logger = logging.getLogger()
@@ -113,7 +112,13 @@ def ws_message_received(client, server, message):
         swap_client.log.debug(f'ws_message_received {client["id"]} {message}')
 
 
-def runClient(fp, data_dir, chain):
+def profilePhase(startup_profile, name):
+    if startup_profile is None:
+        return contextlib.nullcontext()
+    return startup_profile.phase(name)
+
+
+def runClient(fp, data_dir, chain, startup_profile=None):
     global swap_client
     settings_path = os.path.join(data_dir, cfg.CONFIG_FILENAME)
     pids_path = os.path.join(data_dir, '.pids')
@@ -124,7 +129,11 @@ def runClient(fp, data_dir, chain):
     with open(settings_path) as fs:
         settings = json.load(fs)
 
-    swap_client = BasicSwap(fp, data_dir, settings, chain)
+    # Imported here so the cli options are parsed before loading the full application
+    with profilePhase(startup_profile, 'Import basicswap'):
+        from basicswap.basicswap import BasicSwap
+    with profilePhase(startup_profile, 'Initialise BasicSwap'):
+        swap_client = BasicSwap(fp, data_dir, settings, chain)
 
     daemons = []
     pids = []
@@ -137,7 +146,8 @@ def runClient(fp, data_dir, chain):
                 logger.warning('Found pid for daemon {} '.format(ln.strip()))
 
     # Ensure daemons are stopped
-    swap_client.stopDaemons()
+    with profilePhase(startup_profile, 'Stop daemons'):
+        swap_client.stopDaemons()
 
     try:
         # Try start daemons
@@ -175,24 +185,33 @@ def runClient(fp, data_dir, chain):
 
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
-        swap_client.start()
+        with profilePhase(startup_profile, 'Start BasicSwap'):
+            swap_client.start()
 
         if 'htmlhost' in settings:
-            swap_client.log.info('Starting http server at http://%s:%d.' % (settings['htmlhost'], settings['htmlport']))
-            allow_cors = settings['allowcors'] if 'allowcors' in settings else cfg.DEFAULT_ALLOW_CORS
-            thread_http = HttpThread(fp, settings['htmlhost'], settings['htmlport'], allow_cors, swap_client)
-            threads.append(thread_http)
-            thread_http.start()
+            with profilePhase(startup_profile, 'Start http server'):
+                from basicswap.http_server import HttpThread
+                swap_client.log.info('Starting http server at http://%s:%d.' % (settings['htmlhost'], settings['htmlport']))
+                allow_cors = settings['allowcors'] if 'allowcors' in settings else cfg.DEFAULT_ALLOW_CORS
+                thread_http = HttpThread(fp, settings['htmlhost'], settings['htmlport'], allow_cors, swap_client)
+                threads.append(thread_http)
+                thread_http.start()
 
         if 'wshost' in settings:
-            ws_url = 'ws://{}:{}'.format(settings['wshost'], settings['wsport'])
-            swap_client.log.info(f'Starting ws server at {ws_url}.')
+            with profilePhase(startup_profile, 'Start ws server'):
+                from basicswap.contrib.websocket_server import WebsocketServer
+                ws_url = 'ws://{}:{}'.format(settings['wshost'], settings['wsport'])
+                swap_client.log.info(f'Starting ws server at {ws_url}.')
 
-            swap_client.ws_server = WebsocketServer(host=settings['wshost'], port=settings['wsport'])
-            swap_client.ws_server.set_fn_new_client(ws_new_client)
-            swap_client.ws_server.set_fn_client_left(ws_client_left)
-            swap_client.ws_server.set_fn_message_received(ws_message_received)
-            swap_client.ws_server.run_forever(threaded=True)
+                swap_client.ws_server = WebsocketServer(host=settings['wshost'], port=settings['wsport'])
+                swap_client.ws_server.set_fn_new_client(ws_new_client)
+                swap_client.ws_server.set_fn_client_left(ws_client_left)
+                swap_client.ws_server.set_fn_message_received(ws_message_received)
+                swap_client.ws_server.run_forever(threaded=True)
+
+        if startup_profile is not None:
+            startup_profile.uninstall()
+            startup_profile.report(swap_client.log)
 
         logger.info('Exit with Ctrl + c.')
         while swap_client.is_running:
@@ -261,11 +280,13 @@ def printHelp():
     logger.info('--mainnet                Run in mainnet mode.')
     logger.info('--testnet                Run in testnet mode.')
     logger.info('--regtest                Run in regtest mode.')
+    logger.info('--startupprofile         Log the slowest imports and init phases at startup.')
 
 
 def main():
     data_dir = None
     chain = 'mainnet'
+    startup_profile = None
 
     for v in sys.argv[1:]:
         if len(v) < 2 or v[0] != '-':
@@ -292,6 +313,10 @@ def main():
         if name == 'regtest':
             chain = 'regtest'
             continue
+        if name == 'startupprofile':
+            startup_profile = StartupProfile()
+            startup_profile.install()
+            continue
 
         if len(s) == 2:
             if name == 'datadir':
@@ -310,7 +335,7 @@ def main():
 
     with open(os.path.join(data_dir, 'basicswap.log'), 'a') as fp:
         logger.info(os.path.basename(sys.argv[0]) + ', version: ' + __version__ + '\n\n')
-        runClient(fp, data_dir, chain)
+        runClient(fp, data_dir, chain, startup_profile)
 
     logger.info('Done.')
     return swap_client.fail_code if swap_client is not None else 0
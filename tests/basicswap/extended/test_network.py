@@ -247,6 +247,7 @@ class Test(unittest.TestCase):
                 sc.setDaemonPID(Coins.BTC, cls.btc_daemons[i].pid)
                 sc.setDaemonPID(Coins.PART, cls.part_daemons[i].pid)
                 sc.start()
+                sc.waitForCoinsReady()
                 cls.swap_clients.append(sc)
 
                 t = HttpThread(cls.swap_clients[i].fp, TEST_HTTP_HOST, TEST_HTTP_PORT + i, False, cls.swap_clients[i])
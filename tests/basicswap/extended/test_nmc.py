@@ -306,6 +306,7 @@ class Test(unittest.TestCase):
             cls.swap_clients[-1].setDaemonPID(Coins.NMC, cls.daemons[1].pid)
             cls.swap_clients[-1].setDaemonPID(Coins.PART, cls.daemons[2 + i].pid)
             cls.swap_clients[-1].start()
+            cls.swap_clients[-1].waitForCoinsReady()
 
             t = HttpThread(cls.swap_clients[i].fp, TEST_HTTP_HOST, TEST_HTTP_PORT + i, False, cls.swap_clients[i])
             cls.http_threads.append(t)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+"""
+Compares formatted and bound parameter queries on a synthetic database.
+
+export NUM_BENCH_BIDS=100000
+python tests/basicswap/extended/test_query_benchmark.py
+
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+import threading
+import unittest
+import sqlalchemy as sa
+
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from basicswap.basicswap import BasicSwap
+from basicswap.basicswap_util import (
+    BidStates,
+    TxTypes,
+    XmrSplitMsgTypes,
+)
+from basicswap.db import Base
+
+
+logger = logging.getLogger()
+logger.level = logging.DEBUG
+if not len(logger.handlers):
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+NUM_BIDS = int(os.getenv('NUM_BENCH_BIDS', 100000))
+NUM_OFFERS = NUM_BIDS // 10
+NUM_RECEIVING = 500
+NUM_LIST_CALLS = 200
+
+
+def make_id(prefix, i):
+    return prefix + i.to_bytes(24, 'big')
+
+
+class Test(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(Test, cls).setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.engine = sa.create_engine('sqlite:///' + os.path.join(cls.tmp_dir.name, 'db.sqlite'))
+        Base.metadata.create_all(cls.engine)
+
+        logger.info('Creating %d bids', NUM_BIDS)
+        now = int(time.time())
+        offers = [{'offer_id': make_id(b'offr', i), 'coin_from': 1, 'created_at': now} for i in range(NUM_OFFERS)]
+        bids = []
+        txns = []
+        split_data = []
+        for i in range(NUM_BIDS):
+            bid_id = make_id(b'bid_', i)
+            receiving = i < NUM_RECEIVING
+            bids.append({
+                'bid_id': bid_id,
+                'offer_id': make_id(b'offr', i % NUM_OFFERS),
+                'active_ind': 1,
+                'was_received': 1,
+                'state': int(BidStates.BID_RECEIVING if receiving else BidStates.SWAP_COMPLETED),
+                'created_at': now - i,
+                'expire_at': now + 600,
+            })
+            txns.append({'bid_id': bid_id, 'tx_type': int(TxTypes.ITX), 'state': 1})
+            if receiving:
+                split_data.append({'bid_id': bid_id, 'msg_type': int(XmrSplitMsgTypes.BID), 'msg_sequence': 1, 'created_at': now})
+
+        with cls.engine.begin() as conn:
+            conn.execute(sa.text('INSERT INTO offers (offer_id, coin_from, created_at) VALUES (:offer_id, :coin_from, :created_at)'), offers)
+            conn.execute(sa.text('INSERT INTO bids (bid_id, offer_id, active_ind, was_received, state, created_at, expire_at) VALUES (:bid_id, :offer_id, :active_ind, :was_received, :state, :created_at, :expire_at)'), bids)
+            conn.execute(sa.text('INSERT INTO transactions (bid_id, tx_type, state) VALUES (:bid_id, :tx_type, :state)'), txns)
+            conn.execute(sa.text('INSERT INTO xmr_split_data (bid_id, msg_type, msg_sequence, created_at) VALUES (:bid_id, :msg_type, :msg_sequence, :created_at)'), split_data)
+
+        cls.swap_client = BasicSwap.__new__(BasicSwap)
+        cls.swap_client.mxDB = threading.RLock()
+        cls.swap_client.session_factory = sessionmaker(bind=cls.engine, expire_on_commit=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        cls.tmp_dir.cleanup()
+        super(Test, cls).tearDownClass()
+
+    def test_01_list_bids(self):
+        offer_ids = [make_id(b'offr', i) for i in range(NUM_LIST_CALLS)]
+
+        # A session per call, as listBids does
+        t_start = time.time()
+        for offer_id in offer_ids:
+            session = scoped_session(self.swap_client.session_factory)
+            try:
+                query_str = 'SELECT bids.created_at, bids.expire_at, bids.bid_id, bids.offer_id, bids.amount, bids.state, bids.was_received, tx1.state, tx2.state, offers.coin_from, bids.rate, bids.bid_addr FROM bids ' + \
+                            'LEFT JOIN offers ON offers.offer_id = bids.offer_id ' + \
+                            'LEFT JOIN transactions AS tx1 ON tx1.bid_id = bids.bid_id AND tx1.tx_type = {} '.format(int(TxTypes.ITX)) + \
+                            'LEFT JOIN transactions AS tx2 ON tx2.bid_id = bids.bid_id AND tx2.tx_type = {} '.format(int(TxTypes.PTX)) + \
+                            'WHERE bids.active_ind = 1 AND bids.offer_id = x\'{}\' ORDER BY bids.created_at DESC LIMIT 30'.format(offer_id.hex())
+                rows_formatted = session.execute(query_str).fetchall()
+            finally:
+                session.close()
+                session.remove()
+        t_formatted = time.time() - t_start
+
+        t_start = time.time()
+        for offer_id in offer_ids:
+            rows_bound = self.swap_client.listBids(offer_id=offer_id, filters={'limit': 30})
+        t_bound = time.time() - t_start
+        logger.info('listBids x%d: formatted %.3fs, bound %.3fs', NUM_LIST_CALLS, t_formatted, t_bound)
+
+        assert (len(rows_bound) == len(rows_formatted))
+        assert ([r[2] for r in rows_bound] == [r[2] for r in rows_formatted])
+
+    def test_02_list_bids_invalid_sort(self):
+        for filters in ({'sort_by': 'created_at; DROP TABLE bids'}, {'sort_dir': 'asc, bid_id'}):
+            with self.assertRaises(ValueError):
+                self.swap_client.listBids(filters=filters)
+
+    def test_03_check_xmr_swaps_counts(self):
+        # The per bid queries run by checkXmrSwaps
+        session = scoped_session(self.swap_client.session_factory)
+        try:
+            bid_ids = [row[0] for row in session.execute('SELECT bid_id FROM bids WHERE state = :state', {'state': int(BidStates.BID_RECEIVING)})]
+            assert (len(bid_ids) == NUM_RECEIVING)
+
+            t_start = time.time()
+            for bid_id in bid_ids:
+                q = session.execute('SELECT COUNT(*) FROM xmr_split_data WHERE bid_id = x\'{}\' AND msg_type = {}'.format(bid_id.hex(), int(XmrSplitMsgTypes.BID))).first()
+                assert (q[0] == 1)
+            t_formatted = time.time() - t_start
+
+            t_start = time.time()
+            for bid_id in bid_ids:
+                q = session.execute('SELECT COUNT(*) FROM xmr_split_data WHERE bid_id = :bid_id AND msg_type = :msg_type', {'bid_id': bid_id, 'msg_type': int(XmrSplitMsgTypes.BID)}).first()
+                assert (q[0] == 1)
+            t_bound = time.time() - t_start
+        finally:
+            session.close()
+            session.remove()
+        logger.info('checkXmrSwaps counts x%d: formatted %.3fs, bound %.3fs', len(bid_ids), t_formatted, t_bound)
+
+
+if __name__ == '__main__':
+    unittest.main()
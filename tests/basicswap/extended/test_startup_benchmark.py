@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+"""
+Times loading the active bids from a synthetic database at startup.
+
+export NUM_BENCH_BIDS=100000
+python tests/basicswap/extended/test_startup_benchmark.py
+
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+import unittest
+import sqlalchemy as sa
+
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from basicswap.basicswap import BasicSwap
+from basicswap.basicswap_util import (
+    BidStates,
+    SwapTypes,
+    TxTypes,
+)
+from basicswap.db import Base, Bid
+
+
+logger = logging.getLogger()
+logger.level = logging.DEBUG
+if not len(logger.handlers):
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+NUM_BIDS = int(os.getenv('NUM_BENCH_BIDS', 100000))
+NUM_ACTIVE = NUM_BIDS // 100
+NUM_OFFERS = NUM_BIDS // 10
+
+
+def make_id(prefix, i):
+    return prefix + i.to_bytes(24, 'big')
+
+
+class Test(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(Test, cls).setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.engine = sa.create_engine('sqlite:///' + os.path.join(cls.tmp_dir.name, 'db.sqlite'))
+        Base.metadata.create_all(cls.engine)
+
+        logger.info('Creating %d bids, %d active', NUM_BIDS, NUM_ACTIVE)
+        now = int(time.time())
+        offers = []
+        for i in range(NUM_OFFERS):
+            offers.append({'offer_id': make_id(b'offr', i), 'coin_from': 1, 'coin_to': 6, 'swap_type': SwapTypes.XMR_SWAP, 'created_at': now, 'expire_at': now})
+        bids = []
+        txns = []
+        xmr_swaps = []
+        for i in range(NUM_BIDS):
+            bid_id = make_id(b'bid_', i)
+            active = i % (NUM_BIDS // NUM_ACTIVE) == 0
+            bids.append({
+                'bid_id': bid_id,
+                'offer_id': make_id(b'offr', i % NUM_OFFERS),
+                'active_ind': 1,
+                'in_progress': 1 if active else 0,
+                'state': int(BidStates.XMR_SWAP_SCRIPT_COIN_LOCKED if active else BidStates.SWAP_COMPLETED),
+                'created_at': now,
+            })
+            xmr_swaps.append({'bid_id': bid_id})
+            for tx_type in (TxTypes.XMR_SWAP_A_LOCK, TxTypes.XMR_SWAP_B_LOCK):
+                txns.append({'bid_id': bid_id, 'tx_type': int(tx_type), 'state': 1})
+
+        with cls.engine.begin() as conn:
+            conn.execute(sa.text('INSERT INTO offers (offer_id, coin_from, coin_to, swap_type, created_at, expire_at) VALUES (:offer_id, :coin_from, :coin_to, :swap_type, :created_at, :expire_at)'), offers)
+            conn.execute(sa.text('INSERT INTO bids (bid_id, offer_id, active_ind, in_progress, state, created_at) VALUES (:bid_id, :offer_id, :active_ind, :in_progress, :state, :created_at)'), bids)
+            conn.execute(sa.text('INSERT INTO transactions (bid_id, tx_type, state) VALUES (:bid_id, :tx_type, :state)'), txns)
+            conn.execute(sa.text('INSERT INTO xmr_swaps (bid_id) VALUES (:bid_id)'), xmr_swaps)
+        cls.session_factory = sessionmaker(bind=cls.engine, expire_on_commit=False)
+
+        # Only the loading methods are used
+        cls.swap_client = BasicSwap.__new__(BasicSwap)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        cls.tmp_dir.cleanup()
+        super(Test, cls).tearDownClass()
+
+    def test_01_load_active_bids(self):
+        session = scoped_session(self.session_factory)
+        try:
+            t_start = time.time()
+            loaded = self.swap_client.loadActiveBids(session)
+            t_taken = time.time() - t_start
+        finally:
+            session.close()
+            session.remove()
+        logger.info('loadActiveBids: %d bids in %.3fs', len(loaded), t_taken)
+
+        assert (len(loaded) == NUM_ACTIVE)
+        for bid, offer, xmr_swap in loaded:
+            assert (offer is not None and offer.offer_id == bid.offer_id)
+            assert (xmr_swap is not None and xmr_swap.bid_id == bid.bid_id)
+            assert (bid.xmr_a_lock_tx is not None and bid.xmr_b_lock_tx is not None)
+
+    def test_02_full_scan(self):
+        # The previous startup path, for comparison
+        session = scoped_session(self.session_factory)
+        try:
+            t_start = time.time()
+            num_active = 0
+            for bid in session.query(Bid):
+                if bid.in_progress == 1 or (bid.state and bid.state > BidStates.BID_RECEIVED and bid.state < BidStates.SWAP_COMPLETED):
+                    self.swap_client.loadBidTxns(bid, session)
+                    num_active += 1
+            t_taken = time.time() - t_start
+        finally:
+            session.close()
+            session.remove()
+        logger.info('Full scan: %d bids in %.3fs', num_active, t_taken)
+        assert (num_active == NUM_ACTIVE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2022 tecnovert
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php.
+
+"""
+Measures swap throughput of BasicSwap running against in-process stand-in
+particld and bitcoind rpc servers, with smsg messages delivered over zmq.
+
+No daemons are required.
+Offers and bids are published by the test as they would arrive from the network.
+Synthetic swaps waiting on the initiate txn keep the update loop busy.
+Accepting a bid needs signed transactions from a real wallet, bids are followed until basicswap decides to accept them.
+
+export NUM_BENCH_OFFERS=1000
+export NUM_BENCH_BIDS=200
+export NUM_BENCH_SWAPS=1000
+export BENCH_RESULTS=/tmp/swap_benchmark.json
+export BENCH_COMPARE=/tmp/swap_benchmark_previous.json
+python tests/basicswap/extended/test_swap_benchmark.py
+
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import logging
+import platform
+import resource
+import tempfile
+import threading
+import unittest
+import collections
+import zmq
+import sqlalchemy as sa
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from coincurve.keys import PrivateKey
+
+from basicswap import __version__
+from basicswap.basicswap import BasicSwap
+from basicswap.basicswap_util import (
+    BidStates,
+    SwapTypes,
+    TxLockTypes,
+    TxStates,
+    TxTypes,
+    ActionTypes,
+    OfferStates,
+    MessageTypes,
+    NotificationTypes as NT,
+)
+from basicswap.chainparams import chainparams, Coins
+from basicswap.contrib.key import ECKey
+from basicswap.messages_pb2 import (
+    OfferMessage,
+    BidMessage,
+)
+from basicswap.metrics import registry as metrics_registry
+from basicswap.protocols.atomic_swap_1 import buildContractScript
+from basicswap.util.script import SerialiseNumCompact
+from basicswap.util.address import (
+    toWIF,
+    pubkeyToAddress,
+)
+from tests.basicswap.common import PREFIX_SECRET_KEY_REGTEST
+
+
+logger = logging.getLogger()
+logger.level = logging.INFO
+if not len(logger.handlers):
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+NUM_OFFERS = int(os.getenv('NUM_BENCH_OFFERS', 1000))
+NUM_BIDS = int(os.getenv('NUM_BENCH_BIDS', 200))
+NUM_SWAPS = int(os.getenv('NUM_BENCH_SWAPS', 1000))
+MAX_IN_FLIGHT = int(os.getenv('BENCH_MAX_IN_FLIGHT', 100))  # Unprocessed messages, keeps the zmq queues below the high water mark
+UPDATE_INTERVAL = float(os.getenv('BENCH_UPDATE_INTERVAL', 0.01))
+TIMEOUT = int(os.getenv('BENCH_TIMEOUT', 600))
+RESULTS_FILE = os.getenv('BENCH_RESULTS', None)
+COMPARE_FILE = os.getenv('BENCH_COMPARE', None)
+
+COIN = 100000000
+
+
+class MockRPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class MockSmsgBus():
+    # Stores messages and announces them on the smsg zmq topic, as particld does
+
+    def __init__(self, zmq_context):
+        self.messages = {}
+        self.local_addresses = set()
+        self._mx = threading.Lock()
+        self._sequence = 0
+        self.zmq_publisher = zmq_context.socket(zmq.PUB)
+        self.zmq_publisher.bind('tcp://127.0.0.1:*')
+        self.zmq_port = int(self.zmq_publisher.getsockopt_string(zmq.LAST_ENDPOINT).rsplit(':', 1)[1])
+
+    def close(self):
+        self.zmq_publisher.close()
+
+    def publish(self, addr_from, addr_to, payload_hex, ttl):
+        msgid = os.urandom(28)
+        now = int(time.time())
+        with self._mx:
+            self.messages[msgid.hex()] = {
+                'msgid': msgid.hex(),
+                'version': '0300',
+                'location': 'inbox',
+                'received': now,
+                'to': addr_to,
+                'from': addr_from,
+                'sent': now,
+                'ttl': ttl,
+                'hex': payload_hex + '00',
+            }
+            self._sequence += 1
+            self.zmq_publisher.send_multipart([b'smsg', bytes((0, 0)) + msgid, self._sequence.to_bytes(4, 'little')])
+        return msgid
+
+    def getMessage(self, msgid_hex):
+        with self._mx:
+            msg = self.messages.get(msgid_hex, None)
+        if msg is None:
+            raise MockRPCError(-8, 'Unknown message id')
+        return dict(msg)
+
+
+class MockRPCHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length'))))
+        if isinstance(request, list):
+            response = [self.server.mock_daemon.handleRequest(r) for r in request]
+        else:
+            response = self.server.mock_daemon.handleRequest(request)
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockDaemon():
+    # Emulates the rpc methods the coin interfaces call, unknown methods fail as with an old daemon
+
+    def __init__(self, coin_type, smsg_bus=None):
+        self.coin_type = coin_type
+        self.smsg_bus = smsg_bus
+        self.height = 200
+        self.num_calls = collections.Counter()
+        self.unknown_methods = set()
+        self._mx = threading.Lock()
+        self._num_addresses = 0
+        self._methods = {
+            'getwalletinfo': lambda params: {'walletname': 'wallet.dat', 'hdseedid': 'ff' * 20, 'unlocked_until': 0},
+            'getnetworkinfo': lambda params: {'version': 23000300 if coin_type == Coins.PART else 230000},
+            'getblockchaininfo': self.getBlockchainInfo,
+            'getblockcount': lambda params: self.height,
+            'getinsightinfo': lambda params: {'spentindex': True},
+            'extkey': lambda params: {'num_derived': 1},
+            'getstakinginfo': lambda params: {'enabled': False},
+            'getnewaddress': self.getNewAddress,
+            'estimatesmartfee': lambda params: {'feerate': 0.0001, 'blocks': 2},
+            'scantxoutset': lambda params: {'success': True, 'unspents': [{'txid': '00' * 32, 'vout': 0, 'amount': 1000.0, 'height': 100}]},
+            'getrawtransaction': self.txNotFound,
+            'getmempoolentry': self.txNotFound,
+            'gettxout': lambda params: None,
+        }
+        if smsg_bus is not None:
+            self._methods.update({
+                'smsglocalkeys': self.smsgLocalKeys,
+                'smsgimportprivkey': lambda params: {'result': 'Success.'},
+                'smsgaddlocaladdress': self.smsgAddLocalAddress,
+                'smsginbox': lambda params: {'messages': []},
+                'smsg': lambda params: smsg_bus.getMessage(params[0]),
+                'smsgsend': lambda params: {'result': 'Sent.', 'msgid': smsg_bus.publish(params[0], params[1], params[2], params[4]).hex()},
+            })
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockRPCHandler)
+        self.server.daemon_threads = True
+        self.server.mock_daemon = self
+        self.rpc_port = self.server.server_port
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+
+    def handleRequest(self, request):
+        method = request['method']
+        with self._mx:
+            self.num_calls[method] += 1
+        try:
+            if method not in self._methods:
+                with self._mx:
+                    self.unknown_methods.add(method)
+                raise MockRPCError(-32601, 'Method not found')
+            return {'result': self._methods[method](request.get('params', [])), 'error': None, 'id': request.get('id', None)}
+        except MockRPCError as e:
+            return {'result': None, 'error': {'code': e.code, 'message': str(e)}, 'id': request.get('id', None)}
+
+    def getBlockchainInfo(self, params):
+        return {
+            'chain': 'regtest',
+            'blocks': self.height,
+            'bestblockhash': hashlib.sha256(self.height.to_bytes(4, 'big')).hexdigest(),
+            'mediantime': int(time.time()),
+            'verificationprogress': 1.0,
+        }
+
+    def getNewAddress(self, params):
+        with self._mx:
+            self._num_addresses += 1
+            num_address = self._num_addresses
+        pubkey = hashlib.sha256(num_address.to_bytes(4, 'big')).digest()
+        return pubkeyToAddress(chainparams[self.coin_type]['regtest']['pubkey_address'], b'\x02' + pubkey)
+
+    def txNotFound(self, params):
+        raise MockRPCError(-5, 'No such mempool or blockchain transaction')
+
+    def smsgLocalKeys(self, params):
+        if len(params) > 0:
+            self.smsg_bus.local_addresses.add(params[2])
+            return {'result': 'Success.'}
+        return {'smsg_keys': [{'address': addr} for addr in self.smsg_bus.local_addresses]}
+
+    def smsgAddLocalAddress(self, params):
+        self.smsg_bus.local_addresses.add(params[0])
+        return {'result': 'Success.'}
+
+
+def make_addr(coin_type, i):
+    return pubkeyToAddress(chainparams[coin_type]['regtest']['pubkey_address'], b'\x03' + hashlib.sha256(i.to_bytes(4, 'big')).digest())
+
+
+def sign_message(privkey, message, message_magic):
+    # Recoverable signature in the signmessage format
+    message_bytes = SerialiseNumCompact(len(message_magic)) + bytes(message_magic, 'utf-8') + SerialiseNumCompact(len(message)) + bytes(message, 'utf-8')
+    message_hash = hashlib.sha256(hashlib.sha256(message_bytes).digest()).digest()
+    sig = privkey.sign_recoverable(message_hash, hasher=None)
+    return base64.b64encode(bytes((27 + 4 + sig[64], )) + sig[:64]).decode('utf-8')
+
+
+def stats(values):
+    if len(values) == 0:
+        return {'count': 0}
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, (len(values) * 95) // 100)],
+        'max': values[-1],
+    }
+
+
+def flatten(d, prefix=''):
+    rv = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            rv.update(flatten(v, prefix + k + '.'))
+        elif isinstance(v, (int, float)):
+            rv[prefix + k] = v
+    return rv
+
+
+class Test(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(Test, cls).setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.results = {}
+        cls.zmq_context = zmq.Context()
+        cls.smsg_bus = MockSmsgBus(cls.zmq_context)
+        cls.part_daemon = MockDaemon(Coins.PART, cls.smsg_bus)
+        cls.btc_daemon = MockDaemon(Coins.BTC)
+
+        eckey = ECKey()
+        eckey.generate()
+        settings = {
+            'debug': False,
+            'zmqhost': 'tcp://127.0.0.1',
+            'zmqport': cls.smsg_bus.zmq_port,
+            'network_key': toWIF(PREFIX_SECRET_KEY_REGTEST, eckey.get_bytes()),
+            'network_pubkey': eckey.get_pubkey().get_bytes().hex(),
+            'chainclients': {},
+            'check_progress_seconds': 1,
+            'check_watched_seconds': 4,
+            'check_expired_seconds': 60,
+            'check_xmr_swaps_seconds': 1,
+            'chain_poll_seconds': 5,
+            # Keep auto accepted bids queued, accepting needs a real wallet
+            'min_delay_event': 3600,
+            'max_delay_event': 3601,
+        }
+        for coin_type, mock_daemon in ((Coins.PART, cls.part_daemon), (Coins.BTC, cls.btc_daemon)):
+            coin_name = chainparams[coin_type]['name']
+            settings['chainclients'][coin_name] = {
+                'connection_type': 'rpc',
+                'manage_daemon': False,
+                'rpcport': mock_daemon.rpc_port,
+                'rpcuser': 'bench',
+                'rpcpassword': 'bench_pass',
+                'datadir': os.path.join(cls.tmp_dir.name, coin_name),
+                'bindir': '',
+                'use_segwit': coin_type == Coins.BTC,
+            }
+
+        cls.fp = open(os.path.join(cls.tmp_dir.name, 'basicswap.log'), 'w')
+        cls.swap_client = BasicSwap(cls.fp, cls.tmp_dir.name, settings, 'regtest', log_name='BasicSwapBench')
+        sc = cls.swap_client
+
+        cls.createSynthetic()
+        cls.db_size_start = cls.dbSize()
+
+        # Record when offers are received and bids are accepted
+        cls.offers_received = {}
+        cls.bids_accepted = {}
+        notify = sc.notify
+        create_action = sc.createAction
+
+        def benchNotify(event_type, event_data):
+            if event_type == NT.OFFER_RECEIVED:
+                cls.offers_received[event_data['offer_id']] = time.perf_counter()
+            notify(event_type, event_data)
+
+        def benchCreateAction(delay, action_type, linked_id):
+            create_action(delay, action_type, linked_id)
+            if action_type == ActionTypes.ACCEPT_BID:
+                cls.bids_accepted[linked_id.hex()] = time.perf_counter()
+        sc.notify = benchNotify
+        sc.createAction = benchCreateAction
+
+        t_start = time.perf_counter()
+        sc.start()
+        sc.waitForCoinsReady()
+        cls.results['startup_seconds'] = time.perf_counter() - t_start
+
+        cls.update_ticks = []
+        cls.delay_event = threading.Event()
+        cls.update_thread = threading.Thread(target=cls.runUpdateLoop)
+        cls.update_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.delay_event.set()
+        cls.update_thread.join()
+
+        cls.results['update_tick_seconds'] = stats(cls.update_ticks)
+        phase_stats = metrics_registry.histogram('basicswap_update_phase_seconds', '', ('phase', )).getStats()
+        cls.results['update_phase_seconds'] = {labels[0]: {'count': count, 'mean': sum_value / count} for labels, (count, sum_value) in phase_stats.items() if count > 0}
+        db_size_end = cls.dbSize()
+        cls.results['db_size_bytes'] = {'start': cls.db_size_start, 'end': db_size_end, 'growth': db_size_end - cls.db_size_start}
+        cls.results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        cls.results['rpc_calls'] = dict(cls.part_daemon.num_calls + cls.btc_daemon.num_calls)
+        cls.results['rpc_unknown_methods'] = sorted(cls.part_daemon.unknown_methods | cls.btc_daemon.unknown_methods)
+
+        cls.swap_client.finalise()
+        cls.fp.close()
+        cls.part_daemon.close()
+        cls.btc_daemon.close()
+        cls.smsg_bus.close()
+        cls.zmq_context.destroy()
+        cls.tmp_dir.cleanup()
+
+        cls.reportResults()
+        super(Test, cls).tearDownClass()
+
+    @classmethod
+    def runUpdateLoop(cls):
+        while not cls.delay_event.is_set():
+            t_start = time.perf_counter()
+            cls.swap_client.update()
+            cls.update_ticks.append(time.perf_counter() - t_start)
+            cls.delay_event.wait(UPDATE_INTERVAL)
+
+    @classmethod
+    def dbSize(cls):
+        sqlite_file = cls.swap_client.sqlite_file
+        return sum(os.path.getsize(f) for f in (sqlite_file, sqlite_file + '-wal') if os.path.exists(f))
+
+    @classmethod
+    def createSynthetic(cls):
+        # Sent offers with an auto accept strategy for the bids, and swaps waiting on the initiate txn
+        sc = cls.swap_client
+        now = int(time.time())
+        cls.sent_offers = []
+        offers = []
+        links = []
+        for i in range(NUM_BIDS + NUM_SWAPS):
+            offer_id = os.urandom(28)
+            addr_from = make_addr(Coins.PART, i)
+            offers.append({
+                'offer_id': offer_id, 'active_ind': 1, 'protocol_version': 1,
+                'coin_from': int(Coins.PART), 'coin_to': int(Coins.BTC), 'amount_from': COIN, 'rate': COIN // 100, 'min_bid_amount': COIN // 10,
+                'time_valid': 4 * 60 * 60, 'lock_type': int(TxLockTypes.SEQUENCE_LOCK_TIME), 'lock_value': 48 * 60 * 60, 'swap_type': int(SwapTypes.SELLER_FIRST),
+                'amount_negotiable': False, 'rate_negotiable': False, 'addr_to': sc.network_addr, 'addr_from': addr_from,
+                'created_at': now, 'expire_at': now + 4 * 60 * 60, 'was_sent': True, 'state': int(OfferStates.OFFER_RECEIVED),
+            })
+            if i < NUM_BIDS:
+                cls.sent_offers.append((offer_id, addr_from))
+                links.append({'active_ind': 1, 'linked_type': 1, 'linked_id': offer_id, 'strategy_id': 1, 'repeat_limit': 1, 'repeat_count': 0, 'created_at': now})
+
+        bids = []
+        txns = []
+        for i in range(NUM_SWAPS):
+            bid_id = os.urandom(28)
+            script = buildContractScript(48 * 60 * 60, os.urandom(32), os.urandom(20), os.urandom(20))
+            bids.append({
+                'bid_id': bid_id, 'offer_id': offers[NUM_BIDS + i]['offer_id'], 'active_ind': 1, 'protocol_version': 1,
+                'was_sent': False, 'was_received': True, 'created_at': now, 'expire_at': now + 4 * 60 * 60,
+                'amount': COIN, 'rate': COIN // 100, 'amount_to': COIN // 100, 'pkhash_buyer': os.urandom(20),
+                'in_progress': 1, 'state': int(BidStates.BID_ACCEPTED), 'state_time': now,
+                'chain_a_height_start': 100, 'chain_b_height_start': 100,
+            })
+            txns.append({'bid_id': bid_id, 'tx_type': int(TxTypes.ITX), 'txid': os.urandom(32), 'script': script, 'state': int(TxStates.TX_SENT)})
+
+        strategy_data = json.dumps({'exact_rate_only': True, 'max_concurrent_bids': 1}).encode('utf-8')
+        with sc.engine.begin() as conn:
+            conn.execute(sa.text('INSERT INTO automationstrategies (record_id, active_ind, label, type_ind, only_known_identities, num_concurrent, data, created_at) '
+                                 'VALUES (1, 1, :label, 1, 0, 1, :data, :created_at)'), {'label': 'Benchmark', 'data': strategy_data, 'created_at': now})
+            conn.execute(sa.text('INSERT INTO offers (offer_id, active_ind, protocol_version, coin_from, coin_to, amount_from, rate, min_bid_amount, time_valid, lock_type, lock_value, swap_type, amount_negotiable, rate_negotiable, addr_to, addr_from, created_at, expire_at, was_sent, state) '
+                                 'VALUES (:offer_id, :active_ind, :protocol_version, :coin_from, :coin_to, :amount_from, :rate, :min_bid_amount, :time_valid, :lock_type, :lock_value, :swap_type, :amount_negotiable, :rate_negotiable, :addr_to, :addr_from, :created_at, :expire_at, :was_sent, :state)'), offers)
+            if len(links) > 0:
+                conn.execute(sa.text('INSERT INTO automationlinks (active_ind, linked_type, linked_id, strategy_id, repeat_limit, repeat_count, created_at) '
+                                     'VALUES (:active_ind, :linked_type, :linked_id, :strategy_id, :repeat_limit, :repeat_count, :created_at)'), links)
+            if len(bids) > 0:
+                conn.execute(sa.text('INSERT INTO bids (bid_id, offer_id, active_ind, protocol_version, was_sent, was_received, created_at, expire_at, amount, rate, amount_to, pkhash_buyer, in_progress, state, state_time, chain_a_height_start, chain_b_height_start) '
+                                     'VALUES (:bid_id, :offer_id, :active_ind, :protocol_version, :was_sent, :was_received, :created_at, :expire_at, :amount, :rate, :amount_to, :pkhash_buyer, :in_progress, :state, :state_time, :chain_a_height_start, :chain_b_height_start)'), bids)
+                conn.execute(sa.text('INSERT INTO transactions (bid_id, tx_type, txid, script, state) VALUES (:bid_id, :tx_type, :txid, :script, :state)'), txns)
+
+    @classmethod
+    def reportResults(cls):
+        report = {
+            'benchmark': 'swap_throughput',
+            'format_version': 1,
+            'basicswap_version': __version__,
+            'python_version': platform.python_version(),
+            'created_at': int(time.time()),
+            'params': {
+                'num_offers': NUM_OFFERS,
+                'num_bids': NUM_BIDS,
+                'num_swaps': NUM_SWAPS,
+                'max_in_flight': MAX_IN_FLIGHT,
+                'update_interval': UPDATE_INTERVAL,
+            },
+            'results': cls.results,
+        }
+        logger.info('Results:\n%s', json.dumps(report, indent=4))
+        if RESULTS_FILE:
+            with open(RESULTS_FILE, 'w') as fp:
+                json.dump(report, fp, indent=4)
+
+        if COMPARE_FILE and os.path.exists(COMPARE_FILE):
+            with open(COMPARE_FILE) as fp:
+                previous = flatten(json.load(fp)['results'])
+            for key, value in flatten(cls.results).items():
+                if key.startswith('rpc_calls.') or key not in previous:
+                    continue
+                change = '' if previous[key] == 0 else ' ({:+.1f}%)'.format((value - previous[key]) * 100.0 / previous[key])
+                logger.info('%s: %s -> %s%s', key, previous[key], value, change)
+
+    def waitFor(self, received, expect):
+        t_end = time.time() + TIMEOUT
+        while len(received) < expect and time.time() < t_end:
+            time.sleep(0.01)
+
+    def test_01_ingest_offers(self):
+        network_addr = self.swap_client.network_addr
+        offer_ids = []
+        t_start = time.perf_counter()
+        for i in range(NUM_OFFERS):
+            while len(offer_ids) - len(self.offers_received) >= MAX_IN_FLIGHT:
+                time.sleep(0.001)
+            msg_buf = OfferMessage()
+            msg_buf.protocol_version = 1
+            msg_buf.coin_from = int(Coins.PART)
+            msg_buf.coin_to = int(Coins.BTC)
+            msg_buf.amount_from = COIN + i
+            msg_buf.rate = COIN // 100
+            msg_buf.min_bid_amount = COIN // 10
+            msg_buf.time_valid = 60 * 60
+            msg_buf.lock_type = TxLockTypes.SEQUENCE_LOCK_TIME
+            msg_buf.lock_value = 48 * 60 * 60
+            msg_buf.swap_type = SwapTypes.SELLER_FIRST
+            msg_buf.fee_rate_from = 10000
+            msg_buf.fee_rate_to = 10000
+            payload_hex = '{:02x}'.format(MessageTypes.OFFER) + msg_buf.SerializeToString().hex()
+            offer_ids.append(self.smsg_bus.publish(make_addr(Coins.PART, 100000 + i), network_addr, payload_hex, 60 * 60))
+        self.waitFor(self.offers_received, NUM_OFFERS)
+        t_taken = time.perf_counter() - t_start
+
+        num_received = len(self.offers_received)
+        self.results['offers_received'] = num_received
+        self.results['offers_per_second'] = num_received / t_taken
+        logger.info('Ingested %d offers in %.2fs', num_received, t_taken)
+        assert (num_received == NUM_OFFERS)
+
+    def test_02_bid_to_accept(self):
+        message_magic = chainparams[Coins.BTC]['message_magic']
+        bids_sent = {}
+        for offer_id, addr_offer in self.sent_offers:
+            while len(bids_sent) - len(self.bids_accepted) >= MAX_IN_FLIGHT:
+                time.sleep(0.001)
+            privkey = PrivateKey(os.urandom(32))
+            proof_address = pubkeyToAddress(chainparams[Coins.BTC]['regtest']['pubkey_address'], privkey.public_key.format())
+            msg_buf = BidMessage()
+            msg_buf.protocol_version = 1
+            msg_buf.offer_msg_id = offer_id
+            msg_buf.time_valid = 60 * 60
+            msg_buf.amount = COIN
+            msg_buf.rate = COIN // 100
+            msg_buf.pkhash_buyer = os.urandom(20)
+            msg_buf.proof_address = proof_address
+            msg_buf.proof_signature = sign_message(privkey, proof_address + '_swap_proof_' + offer_id.hex(), message_magic)
+            payload_hex = '{:02x}'.format(MessageTypes.BID) + msg_buf.SerializeToString().hex()
+            t_sent = time.perf_counter()
+            bid_id = self.smsg_bus.publish(make_addr(Coins.PART, 200000 + random.randrange(1000000)), addr_offer, payload_hex, 60 * 60)
+            bids_sent[bid_id.hex()] = t_sent
+        self.waitFor(self.bids_accepted, len(bids_sent))
+
+        latencies = [self.bids_accepted[bid_id] - t_sent for bid_id, t_sent in bids_sent.items() if bid_id in self.bids_accepted]
+        self.results['bid_to_accept_seconds'] = stats(latencies)
+        logger.info('Accepted %d of %d bids', len(latencies), len(bids_sent))
+        assert (len(latencies) == len(bids_sent))
+
+    def test_03_swaps_in_progress(self):
+        # Let the progress checks run over the synthetic swaps for a few rounds
+        num_ticks = len(self.update_ticks)
+        time.sleep(5)
+        self.results['swaps_in_progress'] = len(self.swap_client.swaps_in_progress)
+        logger.info('%d update ticks with %d swaps in progress', len(self.update_ticks) - num_ticks, self.results['swaps_in_progress'])
+        assert (self.results['swaps_in_progress'] >= NUM_SWAPS)
+
+
+if __name__ == '__main__':
+    unittest.main()
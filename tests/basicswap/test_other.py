@@ -5,9 +5,20 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
+import os
+import json
+import time
 import hashlib
 import secrets
+import logging
+import tempfile
 import unittest
+import threading
+import urllib.request
+import concurrent.futures
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 import basicswap.contrib.ed25519_fast as edf
 import basicswap.ed25519_fast_util as edu
@@ -21,14 +32,67 @@ from coincurve.ecdsaotves import (
 from coincurve.keys import (
     PrivateKey)
 
+from basicswap.rpc import callrpc_batch
 from basicswap.util import i2b, h2b
 from basicswap.util.crypto import ripemd160
 from basicswap.util.rfc2440 import rfc2440_hash_password
+from basicswap.util.sampling_profile import SamplingProfiler
 from basicswap.interface.btc import BTCInterface
 from basicswap.interface.xmr import XMRInterface
+from basicswap.interface.ltc import LTCInterface
+from basicswap.rates import (
+    RateService,
+    CoinGeckoProvider,
+    BittrexProvider,
+)
+from basicswap.explorers import (
+    ExplorerInsight,
+    queryExplorers)
+from basicswap.metrics import (
+    MetricsRegistry,
+    TimedRLock,
+    instrumentEngine,
+    isFailedRPCResponse,
+)
+from basicswap.contrib.test_framework.messages import (
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxOut)
+from basicswap.contrib.test_framework.script import (
+    CScript,
+    SIGHASH_ALL,
+    SegwitV0SignatureHash)
 
 from basicswap.basicswap_util import (
-    TxLockTypes)
+    TxLockTypes,
+    TxTypes,
+    TxStates,
+    BidStates,
+    SpanTypes,
+    SwapTypes,
+    summariseDurations)
+from basicswap.ui.util import (
+    describeBidCached,
+    describeBidTimeline)
+from basicswap.chainparams import Coins
+from basicswap.db import (
+    Base,
+    Bid,
+    Offer,
+    SwapTx,
+    EventLog,
+    Concepts,
+    KnownIdentity,
+    BidStateHistory,
+    CURRENT_DB_VERSION,
+    bidDescriptionVersion,
+    listenPendingStates)
+from basicswap.db_archive import (
+    archiveSwaps,
+    createArchiveDB,
+    archiveSessionFactory)
+from basicswap.summary import SummaryCounters
 from basicswap.util import (
     make_int,
     SerialiseNum,
@@ -37,6 +101,99 @@ from basicswap.util import (
     validate_amount)
 
 
+class MockRatesHandler(BaseHTTPRequestHandler):
+    # Serves coingecko and bittrex style quotes
+    def do_GET(self):
+        self.server.num_requests += 1
+        if self.path.startswith('/coingecko/simple/price'):
+            rv = {'bitcoin': {'usd': 20000.0, 'btc': 1.0}, 'litecoin': {'usd': 50.0, 'btc': 0.0025}}
+        elif self.path == '/bittrex/markets/LTC-BTC/ticker':
+            rv = {'symbol': 'LTC-BTC', 'lastTradeRate': self.server.ltc_btc}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(rv).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockRPCHandler(BaseHTTPRequestHandler):
+    # Answers batched getrawtransaction calls in reverse id order
+    def do_POST(self):
+        calls = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append([c['params'][0] for c in calls])
+        rv = []
+        for call in reversed(calls):
+            txid = call['params'][0]
+            if txid in self.server.error_txids:
+                rv.append({'result': None, 'error': {'code': -5, 'message': 'No such mempool or blockchain transaction'}, 'id': call['id']})
+                continue
+            vout = [{'value': '{}.{:08d}'.format(int(txid[:2], 16), n), 'scriptPubKey': {'type': 'witness_v0_keyhash'}} for n in range(2)]
+            rv.append({'result': {'txid': txid, 'vout': vout}, 'error': None, 'id': call['id']})
+        data = json.dumps(rv).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockExplorerHandler(BaseHTTPRequestHandler):
+    # Serves insight style responses over keep-alive connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.num_requests += 1
+        self.server.client_ports.add(self.client_address[1])
+        if self.path == '/insight/sync':
+            rv = {'blockChainHeight': self.server.height}
+        elif self.path.startswith('/insight/addr/'):
+            rv = self.server.balance
+        elif self.path.startswith('/insight/tx/'):
+            rv = {'txid': self.path[len('/insight/tx/'):], 'confirmations': self.server.height - 99}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(rv).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockSwapClient():
+    def __init__(self):
+        self.log = logging
+        self.settings = {}
+        self.use_tor_proxy = False
+        self.bid_state_history = []
+        self.bid_spans = []
+
+    def getBidStateHistory(self, bid_id, session=None, archived=False):
+        return self.bid_state_history
+
+    def getBidSpans(self, bid_id, session=None, archived=False):
+        return self.bid_spans
+
+
+def read_url(url, timeout=10, headers=None):
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return resp.read()
+
+
 class Test(unittest.TestCase):
     REQUIRED_SETTINGS = {'blocks_confirmed': 1, 'conf_target': 1, 'use_segwit': True, 'connection_type': 'rpc'}
 
@@ -214,6 +371,35 @@ class Test(unittest.TestCase):
         assert (len(sig) == 64)
         ci.verifyCompact(pk, 'test signing message', sig)
 
+    def test_sighash_cache(self):
+        coin_settings = {'rpcport': 0, 'rpcauth': 'none', 'tx_cache_size': 2}
+        coin_settings.update(self.REQUIRED_SETTINGS)
+        ci = BTCInterface(coin_settings, 'regtest')
+
+        tx = CTransaction()
+        tx.nVersion = ci.txVersion()
+        for i in range(3):
+            tx.vin.append(CTxIn(COutPoint(int.from_bytes(secrets.token_bytes(32), 'big'), i), nSequence=i))
+        for i in range(2):
+            tx.vout.append(CTxOut(1000 * (i + 1), CScript(secrets.token_bytes(22))))
+        tx_bytes = tx.serialize()
+        prevout_script = secrets.token_bytes(71)
+
+        tx_entry = ci.loadTxCached(tx_bytes)
+        assert (ci.loadTxCached(tx_bytes) is tx_entry)
+        assert (ci.getCachedTxid(tx_entry) == ci.getTxid(tx_bytes))
+        for input_n in range(3):
+            for prevout_value in (12345, secrets.token_bytes(33)):
+                expect_hash = SegwitV0SignatureHash(prevout_script, ci.loadTx(tx_bytes), input_n, SIGHASH_ALL, prevout_value)
+                assert (ci.getSigHash(tx_entry, input_n, prevout_script, prevout_value) == expect_hash)
+
+        # Least recently used entry is evicted
+        tx.nLockTime = 1
+        ci.loadTxCached(tx.serialize())
+        tx.nLockTime = 2
+        ci.loadTxCached(tx.serialize())
+        assert (ci.loadTxCached(tx_bytes) is not tx_entry)
+
     def test_pubkey_to_address(self):
         coin_settings = {'rpcport': 0, 'rpcauth': 'none'}
         coin_settings.update(self.REQUIRED_SETTINGS)
@@ -281,6 +467,582 @@ class Test(unittest.TestCase):
         amount_to_recreate = int((amount_from * rate) // (10 ** scale_from))
         assert ('10.00000000' == format_amount(amount_to_recreate, scale_to))
 
+    def test_rate_service(self):
+        server = HTTPServer(('127.0.0.1', 0), MockRatesHandler)
+        server.num_requests = 0
+        server.ltc_btc = '0.00250000'
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        try:
+            base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+            rs = RateService(logging, read_url, cache_seconds=60, stale_seconds=600)
+            rs.addProvider(CoinGeckoProvider(base_url + '/coingecko'))
+            rs.addProvider(BittrexProvider(base_url + '/bittrex'))
+
+            coin_settings = {'rpcport': 0, 'rpcauth': 'none'}
+            coin_settings.update(self.REQUIRED_SETTINGS)
+            ci_ltc = LTCInterface(coin_settings, 'regtest')
+            ci_btc = BTCInterface(coin_settings, 'regtest')
+
+            rv = rs.getRates(ci_ltc, ci_btc)
+            assert (rv['coingecko']['rate_inferred'] == '0.00250000')
+            assert (rv['bittrex']['rate_last'] == '0.00250000')
+            assert (server.num_requests == 2)
+
+            # Served from the cache
+            assert (rs.getRates(ci_ltc, ci_btc) is rv)
+            assert (server.num_requests == 2)
+
+            # Stale quotes are returned while refreshing
+            server.ltc_btc = '0.00300000'
+            rs.cache_seconds = 0
+            assert (rs.getRates(ci_ltc, ci_btc) is rv)
+            for i in range(50):
+                if server.num_requests == 4 and rs.getRateHistory(ci_ltc.coin_type(), ci_btc.coin_type())['bittrex'][-1][1] == 0.003:
+                    break
+                time.sleep(0.1)
+            history = rs.getRateHistory(ci_ltc.coin_type(), ci_btc.coin_type())
+            assert ([r for t, r in history['bittrex']] == [0.0025, 0.003])
+            assert (len(history['coingecko']) == 2)
+
+            # One refresh per pair while it is in flight
+            server.ltc_btc = '0.00350000'
+            rs.cache_seconds = 60
+            rs._cache[(int(ci_ltc.coin_type()), int(ci_btc.coin_type()))]['updated'] = 0
+            threads = [threading.Thread(target=rs.getRates, args=(ci_ltc, ci_btc)) for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert (server.num_requests == 6)
+            rs.shutdown()
+        finally:
+            server.shutdown()
+            server_thread.join()
+
+    def test_get_prevouts(self):
+        server = HTTPServer(('127.0.0.1', 0), MockRPCHandler)
+        server.requests = []
+        server.error_txids = set()
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        try:
+            txid_a, txid_b, txid_c = ('0a' * 32, '0b' * 32, '0c' * 32)
+
+            # Results are matched to calls by id
+            rv = callrpc_batch(server.server_port, 'none', [('getrawtransaction', [txid_a, True]), ('getrawtransaction', [txid_b, True])])
+            assert ([r['txid'] for r in rv] == [txid_a, txid_b])
+
+            # An error in one call fails the batch
+            server.error_txids.add(txid_b)
+            with self.assertRaises(ValueError) as cm:
+                callrpc_batch(server.server_port, 'none', [('getrawtransaction', [txid_a, True]), ('getrawtransaction', [txid_b, True])])
+            assert ('No such mempool' in str(cm.exception))
+            server.error_txids.clear()
+
+            coin_settings = {'rpcport': server.server_port, 'rpcauth': 'none', 'prevout_cache_size': 3}
+            coin_settings.update(self.REQUIRED_SETTINGS)
+            ci = BTCInterface(coin_settings, 'regtest')
+            server.requests.clear()
+
+            # Inputs spending the same parent tx fetch it once
+            rv = ci.getPrevouts([(txid_a, 0), (txid_b, 1), (txid_a, 1)])
+            assert (rv == [(1000000000, 'witness_v0_keyhash'), (1100000001, 'witness_v0_keyhash'), (1000000001, 'witness_v0_keyhash')])
+            assert (server.requests == [[txid_a, txid_b]])
+
+            assert (ci.getPrevouts([(txid_a, 0), (txid_b, 1), (txid_a, 1)]) == rv)
+            assert (len(server.requests) == 1)
+
+            # The least recently used prevout is evicted
+            ci.getPrevouts([(txid_c, 0)])
+            assert (server.requests[-1] == [txid_c])
+            ci.getPrevouts([(txid_b, 1), (txid_a, 1)])
+            assert (len(server.requests) == 2)
+            assert (ci.getPrevouts([(txid_a, 0)]) == [(1000000000, 'witness_v0_keyhash')])
+            assert (server.requests[-1] == [txid_a])
+
+            # Nothing is cached from a failed batch
+            server.error_txids.add(txid_b)
+            with self.assertRaises(ValueError):
+                ci.getPrevouts([(txid_c, 1), (txid_b, 0)])
+            assert ((txid_c, 1) not in ci._prevout_cache)
+        finally:
+            server.shutdown()
+            server_thread.join()
+
+    def test_explorer(self):
+        server = HTTPServer(('127.0.0.1', 0), MockExplorerHandler)
+        server.num_requests = 0
+        server.client_ports = set()
+        server.height = 100
+        server.balance = 1000
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        base_url = 'http://127.0.0.1:{}/insight'.format(server.server_port)
+        exp = ExplorerInsight(MockSwapClient(), 1, base_url)
+        try:
+            assert (exp.getChainHeight() == 100)
+            assert (exp.getTransaction('aa')['confirmations'] == 1)
+            assert (server.num_requests == 2)
+
+            # Served from the cache until the height changes
+            assert (exp.getTransaction('aa')['confirmations'] == 1)
+            assert (exp.getChainHeight() == 100)
+            assert (exp.getTransaction('aa')['confirmations'] == 1)
+            assert (server.num_requests == 3)
+
+            server.height = 101
+            assert (exp.getChainHeight() == 101)
+            assert (exp.getTransaction('aa')['confirmations'] == 2)
+            assert (server.num_requests == 5)
+
+            # Address lookups are never cached
+            assert (exp.getBalance('addr1') == 1000)
+            server.balance = 2000
+            assert (exp.getBalance('addr1') == 2000)
+            assert (server.num_requests == 7)
+
+            # All requests went over the one pooled connection
+            assert (len(server.client_ports) == 1)
+        finally:
+            exp.close()
+            server.shutdown()
+            server_thread.join()
+
+    def test_query_explorers(self):
+        class MockExplorer():
+            def __init__(self, name, balance, delay=0.0):
+                self.base_url = name
+                self.balance = balance
+                self.delay = delay
+                self.num_calls = 0
+
+            def getBalance(self, address):
+                self.num_calls += 1
+                time.sleep(self.delay)
+                if isinstance(self.balance, Exception):
+                    raise self.balance
+                return self.balance
+
+        swap_client = MockSwapClient()
+        swap_client.explorer_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        swap_client.coin_clients = {Coins.PART: {'explorers': []}}
+
+        def query(quorum, explorers):
+            swap_client.explorer_quorum = quorum
+            swap_client.coin_clients[Coins.PART]['explorers'] = explorers
+            return queryExplorers(swap_client, Coins.PART, 'getBalance', 'addr')
+
+        try:
+            with self.assertRaises(ValueError):
+                query('any', [])
+
+            # Failures and answers of None are skipped, starting from a random explorer
+            explorers = [MockExplorer('a', ValueError('down')), MockExplorer('b', None), MockExplorer('c', 5)]
+            first_called = set()
+            for i in range(30):
+                num_calls = [e.num_calls for e in explorers]
+                assert (query('any', explorers) == 5)
+                first_called.add(min(j for j, e in enumerate(explorers) if e.num_calls > num_calls[j]))
+            assert (len(first_called) > 1)
+            with self.assertRaises(ValueError) as cm:
+                query('any', explorers[:2])
+            assert ('down' in str(cm.exception))
+
+            # The fastest answer that is not None
+            explorers = [MockExplorer('a', ValueError('down')), MockExplorer('b', None), MockExplorer('c', 1, delay=0.5), MockExplorer('d', 2, delay=0.05)]
+            assert (query('first', explorers) == 2)
+            with self.assertRaises(ValueError) as cm:
+                query('first', explorers[:2])
+            assert ('answered' in str(cm.exception))
+
+            # More than half of all explorers must agree, failed explorers count against the majority
+            assert (query('majority', [MockExplorer('a', 1), MockExplorer('b', 2), MockExplorer('c', 2)]) == 2)
+            assert (query('majority', [MockExplorer('a', {'x': 1, 'y': 2}), MockExplorer('b', {'y': 2, 'x': 1}), MockExplorer('c', ValueError('down'))]) == {'x': 1, 'y': 2})
+            # Confirmations and heights may differ between explorers
+            utxo_a = [{'txid': 'aa', 'index': 0, 'height': 10, 'n_conf': 2, 'value': 5}, {'txid': 'bb', 'index': 1, 'height': 11, 'n_conf': 1, 'value': 6}]
+            utxo_b = [{'txid': 'bb', 'index': 1, 'height': 11, 'n_conf': 2, 'value': 6}, {'txid': 'aa', 'index': 0, 'height': 10, 'n_conf': 3, 'value': 5}]
+            assert (query('majority', [MockExplorer('a', utxo_a), MockExplorer('b', utxo_b, delay=0.05), MockExplorer('c', ValueError('down'))]) == utxo_b)
+            utxo_b[0]['value'] = 7
+            with self.assertRaises(ValueError):
+                query('majority', [MockExplorer('a', utxo_a), MockExplorer('b', utxo_b), MockExplorer('c', ValueError('down'))])
+            with self.assertRaises(ValueError) as cm:
+                query('majority', [MockExplorer('a', 1), MockExplorer('b', 2), MockExplorer('c', ValueError('down'))])
+            assert ('majority' in str(cm.exception))
+            with self.assertRaises(ValueError) as cm:
+                query('majority', [MockExplorer('a', None), MockExplorer('b', ValueError('down'))])
+            assert ('answered' in str(cm.exception))
+        finally:
+            swap_client.explorer_pool.shutdown()
+
+    def test_metrics(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('test_total', 'Test counter', ('coin', ))
+        counter.inc('btc')
+        counter.inc('btc', amount=2)
+        registry.gauge('test_gauge', 'Test gauge', ('state', )).setFunction(lambda: {('Sent', ): 3})
+        histogram = registry.histogram('test_seconds', 'Test histogram', ('method', ), buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'getblockcount')
+        histogram.observe(0.5, 'getblockcount')
+        histogram.observe(5.0, 'getblockcount')
+        assert (registry.counter('test_total', 'Test counter', ('coin', )) is counter)
+
+        lines = registry.render().split('\n')
+        assert ('# TYPE test_total counter' in lines)
+        assert ('test_total{coin="btc"} 3' in lines)
+        assert ('test_gauge{state="Sent"} 3' in lines)
+        assert ('test_seconds_bucket{method="getblockcount",le="0.1"} 1' in lines)
+        assert ('test_seconds_bucket{method="getblockcount",le="1.0"} 2' in lines)
+        assert ('test_seconds_bucket{method="getblockcount",le="+Inf"} 3' in lines)
+        assert ('test_seconds_sum{method="getblockcount"} 5.55' in lines)
+        assert ('test_seconds_count{method="getblockcount"} 3' in lines)
+
+        # Only the outermost acquire of the reentrant lock is timed
+        wait_histogram = registry.histogram('test_lock_wait_seconds', 'Test lock wait')
+        hold_histogram = registry.histogram('test_lock_hold_seconds', 'Test lock hold')
+        mx = TimedRLock(wait_histogram, hold_histogram)
+        with mx:
+            mx.acquire()
+            mx.release()
+        mx.acquire()
+        mx.release()
+        assert (wait_histogram._values[()][2] == 2)
+        assert (hold_histogram._values[()][2] == 2)
+
+        engine = sa.create_engine('sqlite://')
+        query_histogram = registry.histogram('test_query_seconds', 'Test queries', ('statement', ))
+        instrumentEngine(engine, query_histogram)
+        engine.execute('SELECT 1')
+        try:
+            engine.execute('SELECT * FROM missing_table')
+        except Exception:
+            pass
+        assert (query_histogram._values[('SELECT', )][2] == 1)
+        engine.dispose()
+
+        assert (isFailedRPCResponse(200, b'{"result": 1, "error": null, "id": 1}') is False)
+        assert (isFailedRPCResponse(200, b'{"jsonrpc": "2.0", "result": {}, "id": 1}') is False)
+        assert (isFailedRPCResponse(500, b'{"result": null, "error": {"code": -5}, "id": 1}') is True)
+        assert (isFailedRPCResponse(200, b'{"jsonrpc": "2.0", "error": {"code": -1}, "id": 1}') is True)
+        assert (isFailedRPCResponse(200, b'[{"result": 1, "error": null, "id": 0}, {"result": null, "error": {"code": -8}, "id": 1}]') is True)
+        assert (isFailedRPCResponse(200, b'<html>') is True)
+
+    def test_bid_timeline(self):
+        assert (summariseDurations([]) == {'count': 0})
+        stats = summariseDurations(list(range(1, 101)))
+        assert (stats['p50'] == 50 and stats['p90'] == 90 and stats['p99'] == 99 and stats['max'] == 100)
+
+        swap_client = MockSwapClient()
+        swap_client.bid_state_history = [
+            (1000, None, BidStates.BID_SENT),
+            (1010, None, BidStates.BID_ACCEPTED),
+            (1020, TxTypes.ITX, TxStates.TX_SENT),
+            (1080, TxTypes.ITX, TxStates.TX_CONFIRMED),
+            (1100, None, BidStates.SWAP_COMPLETED),
+        ]
+        swap_client.bid_spans = [
+            (SpanTypes.PEER_WAIT, 'BID_ACCEPT', 1000000, 9000, 0),
+            (SpanTypes.PROCESS_MSG, 'BID_ACCEPT', 1009000, 1000, 400),
+            (SpanTypes.ACTION_DELAY, 'REDEEM_ITX', 1085000, 5000, 0),
+        ]
+
+        class MockBid():
+            bid_id = bytes(28)
+            state = BidStates.SWAP_COMPLETED
+
+        timeline = describeBidTimeline(swap_client, MockBid())
+        assert (timeline['started_at'] == 1000 and timeline['duration'] == 100)
+        assert ([r['category'] for r in timeline['rows'][:3]] == ['state', 'state', 'state'])
+        assert (len(timeline['rows']) == 7)
+        assert (timeline['totals'] == {'confirmations': 60.0, 'peer_wait': 9.0, 'action_delay': 5.0, 'processing': 0.6, 'rpc': 0.4})
+        confirming = [r for r in timeline['rows'] if r['category'] == 'confirmations'][0]
+        assert (confirming['offset'] == 20 and confirming['offset_pct'] == 20.0 and confirming['width_pct'] == 60.0)
+
+    def test_sampling_profiler(self):
+        stop_event = threading.Event()
+
+        def busyLoop():
+            while not stop_event.is_set():
+                sum(range(1000))
+
+        t = threading.Thread(target=busyLoop, name='busy')
+        t.start()
+        profiler = SamplingProfiler()
+        try:
+            profiler.start(0.2, interval=0.005)
+            with self.assertRaises(ValueError):
+                profiler.start(1)
+            profiler.stop()
+        finally:
+            stop_event.set()
+            t.join()
+
+        status = profiler.getStatus()
+        assert (status['running'] is False and status['num_samples'] > 0)
+        lines = profiler.collapsedStacks('busy').strip().split('\n')
+        assert (len(lines) > 0)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            assert (stack.startswith('busy;') and 'busyLoop (test_other.py:' in stack and int(count) > 0)
+        assert (profiler.collapsedStacks('missing') == '\n')
+        assert (any(name.startswith('busyLoop') for name, count, total in profiler.topFunctions()))
+
+    def test_bid_description_cache(self):
+        coin_settings = {'rpcport': 0, 'rpcauth': 'none'}
+        coin_settings.update(self.REQUIRED_SETTINGS)
+        ci = BTCInterface(coin_settings, 'regtest')
+
+        engine = sa.create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+        session = session_factory()
+
+        bid_id = bytes(28)
+        offer = Offer(offer_id=bytes(28), coin_from=Coins.BTC, coin_to=Coins.BTC, rate=ci.COIN(), swap_type=SwapTypes.SELLER_FIRST)
+        bid = Bid(bid_id=bid_id, offer_id=offer.offer_id, amount=ci.COIN(), state=BidStates.BID_SENT, state_time=1000, bid_addr='addr', created_at=1000, expire_at=2000)
+        session.add(offer)
+        session.add(bid)
+        session.commit()
+
+        swap_client = MockSwapClient()
+        swap_client.debug_ui = False
+        swap_client.num_loaded = 0
+        cache = {}
+
+        def getBidDescriptionVersion(bid_id, include_archived=False):
+            version_session = session_factory()
+            try:
+                return bidDescriptionVersion(version_session, bid_id)
+            finally:
+                version_session.close()
+
+        def getXmrBidAndOffer(bid_id, list_events=True, include_archived=False):
+            swap_client.num_loaded += 1
+            return bid, None, offer, None, []
+
+        def getAddressLabel(addresses):
+            label_session = session_factory()
+            try:
+                rv = []
+                for a in addresses:
+                    v = label_session.query(KnownIdentity).filter_by(address=a).first()
+                    rv.append('' if (not v or not v.label) else v.label)
+                return rv
+            finally:
+                label_session.close()
+
+        swap_client.ci = lambda coin_type: ci
+        swap_client.getAddressLabel = getAddressLabel
+        swap_client.getXmrBidAndOffer = getXmrBidAndOffer
+        swap_client.getBidDescriptionVersion = getBidDescriptionVersion
+        swap_client.getCachedBidDescription = lambda cache_key, version: cache[cache_key][1] if cache.get(cache_key, (None, ))[0] == version else None
+        swap_client.setCachedBidDescription = lambda cache_key, version, description: cache.update({cache_key: (version, description)})
+
+        data, _, _ = describeBidCached(swap_client, bid_id)
+        assert (data['bid_state'] == 'Sent' and swap_client.num_loaded == 1)
+        data['addr_from_label'] = '(changed by the caller)'
+
+        data, _, _ = describeBidCached(swap_client, bid_id)
+        assert (swap_client.num_loaded == 1 and data['addr_from_label'] == '')
+
+        data, _, _ = describeBidCached(swap_client, bid_id, for_api=True)
+        assert (swap_client.num_loaded == 2 and data['created_at'] == 1000)
+
+        def assertVersionChanged():
+            nonlocal version
+            new_version = getBidDescriptionVersion(bid_id)
+            assert (new_version != version)
+            version = new_version
+
+        # State change
+        version = getBidDescriptionVersion(bid_id)
+        bid.setState(BidStates.BID_ACCEPTED)
+        session.add(bid)
+        session.commit()
+        assertVersionChanged()
+        data, _, _ = describeBidCached(swap_client, bid_id)
+        assert (data['bid_state'] == 'Accepted' and swap_client.num_loaded == 3)
+
+        # New event
+        session.add(EventLog(active_ind=1, created_at=1100, linked_type=Concepts.BID, linked_id=bid_id, event_type=1, event_msg=''))
+        session.commit()
+        assertVersionChanged()
+
+        # Tx confirmation
+        tx = SwapTx(bid_id=bid_id, tx_type=TxTypes.ITX, txid=bytes(32), conf=0, state=TxStates.TX_SENT)
+        session.add(tx)
+        session.commit()
+        assertVersionChanged()
+        tx.conf = 1
+        session.add(tx)
+        session.commit()
+        assertVersionChanged()
+
+        # Label edit
+        identity = KnownIdentity(address='addr', label='first')
+        session.add(identity)
+        session.commit()
+        assertVersionChanged()
+        data, _, _ = describeBidCached(swap_client, bid_id)
+        assert (data['addr_from_label'] == 'first' and swap_client.num_loaded == 4)
+        identity.label = 'second'
+        session.add(identity)
+        session.commit()
+        assertVersionChanged()
+        data, _, _ = describeBidCached(swap_client, bid_id)
+        assert (data['addr_from_label'] == 'second' and swap_client.num_loaded == 5)
+
+        data, _, _ = describeBidCached(swap_client, bid_id)
+        assert (swap_client.num_loaded == 5)
+
+        assert (describeBidCached(swap_client, bytes(27) + b'\x01') == (None, None, None))
+        session.close()
+        engine.dispose()
+
+    def test_bid_state_history(self):
+        engine = sa.create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+        listenPendingStates(session_factory)
+
+        def num_states():
+            return engine.execute('SELECT COUNT(*) FROM bid_state_history').scalar()
+
+        session = session_factory()
+        bid = Bid(bid_id=bytes(28), state=BidStates.BID_SENT)
+        session.add(bid)
+        session.commit()
+
+        # Rolled back states are written again with the next commit
+        bid.setState(BidStates.BID_ACCEPTED)
+        session.add(bid)
+        session.flush()
+        session.rollback()
+        assert (num_states() == 0)
+        bid.state = BidStates.BID_ACCEPTED
+        session.add(bid)
+        session.commit()
+        assert (num_states() == 1)
+
+        # Each state is written once over several flushes
+        bid.setState(BidStates.SWAP_INITIATED)
+        session.add(bid)
+        session.flush()
+        bid.setState(BidStates.SWAP_PARTICIPATING)
+        session.flush()
+        session.commit()
+        session.add(bid)
+        session.commit()
+        assert (num_states() == 3)
+        assert (bid.__dict__['_pending_states'] == [])
+
+        # Sessions from other factories are not affected
+        other_session = sessionmaker(bind=engine)()
+        other_bid = other_session.query(Bid).first()
+        other_bid.setState(BidStates.SWAP_COMPLETED)
+        other_session.commit()
+        assert (num_states() == 3)
+        other_session.close()
+        session.close()
+        engine.dispose()
+
+    def test_summary_counters(self):
+        engine = sa.create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+        counters = SummaryCounters()
+        counters.listen(session_factory)
+        counters.reset(0, 0, [], [], [])
+
+        now = int(time.time())
+        session = session_factory()
+        session.add(Offer(offer_id=b'\x01', active_ind=1, was_sent=True, expire_at=now + 100))
+        session.add(Offer(offer_id=b'\x02', active_ind=1, was_sent=False, expire_at=now + 200))
+        bid = Bid(bid_id=b'\x01', active_ind=1, was_sent=False, was_received=True, state=BidStates.BID_RECEIVED, expire_at=now + 50)
+        session.add(bid)
+        session.commit()
+        assert (counters.get(now) == {'num_network_offers': 2, 'num_sent_offers': 1, 'num_recv_bids': 1, 'num_sent_bids': 0, 'num_available_bids': 1})
+        assert (counters.get(now + 150)['num_network_offers'] == 1 and counters.get(now + 150)['num_available_bids'] == 0)
+
+        bid.state = BidStates.BID_ACCEPTED
+        session.add(bid)
+        session.commit()
+        assert (counters.get(now)['num_available_bids'] == 0)
+
+        # Rolled back changes are not counted
+        session.add(Bid(bid_id=b'\x02', active_ind=1, was_sent=True, was_received=False, state=BidStates.BID_SENT, expire_at=now + 50))
+        session.flush()
+        session.rollback()
+        assert (counters.get(now)['num_sent_bids'] == 0)
+
+        offer = session.query(Offer).filter_by(offer_id=b'\x01').first()
+        offer.active_ind = 2
+        session.commit()
+        assert (counters.get(now)['num_sent_offers'] == 0)
+        session.close()
+        engine.dispose()
+
+    def test_archive_swaps(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            swap_client = MockSwapClient()
+            swap_client.mxDB = threading.RLock()
+            swap_client.swaps_in_progress = {}
+            swap_client.archive_file = os.path.join(tmp_dir, 'db_archive.sqlite')
+            swap_client.engine = sa.create_engine('sqlite:///' + os.path.join(tmp_dir, 'db.sqlite'))
+            Base.metadata.create_all(swap_client.engine)
+            session_factory = sessionmaker(bind=swap_client.engine)
+
+            def addFinishedBid(bid_id):
+                session = session_factory()
+                session.add(Bid(bid_id=bid_id, offer_id=bytes(28), active_ind=1, state=BidStates.SWAP_COMPLETED, state_time=1000, created_at=1000))
+                session.add(BidStateHistory(bid_id=bid_id, state=BidStates.SWAP_COMPLETED, created_at=1000))
+                session.add(EventLog(active_ind=1, linked_type=Concepts.BID, linked_id=bid_id, created_at=1000))
+                session.commit()
+                session.close()
+
+            # The rowids of the archived rows are reused by the next rows in the main db
+            addFinishedBid(bytes((1, )) * 28)
+            assert (archiveSwaps(swap_client, 2000) == (1, 0))
+            addFinishedBid(bytes((2, )) * 28)
+            assert (archiveSwaps(swap_client, 2000) == (1, 0))
+
+            with swap_client.engine.connect() as conn:
+                conn.execute('ATTACH DATABASE :archive_file AS archive', {'archive_file': swap_client.archive_file})
+                for table in ('bids', 'bid_state_history', 'eventlog'):
+                    assert (conn.execute(f'SELECT COUNT(*) FROM main.{table}').scalar() == 0)
+                    assert (conn.execute(f'SELECT COUNT(*) FROM archive.{table}').scalar() == 2)
+                conn.execute('DETACH DATABASE archive')
+            swap_client.engine.dispose()
+
+            # Archived bids can still be looked up by id
+            swap_client._archive_session_factory = None
+            session = archiveSessionFactory(swap_client)()
+            bid = session.query(Bid).filter_by(bid_id=bytes((2, )) * 28).first()
+            assert (bid.state == BidStates.SWAP_COMPLETED)
+            assert (session.query(EventLog).filter_by(linked_id=bid.bid_id).count() == 1)
+            session.close()
+            session.get_bind().dispose()
+
+    def test_archive_upgrade(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            swap_client = MockSwapClient()
+            swap_client.archive_file = os.path.join(tmp_dir, 'db_archive.sqlite')
+            createArchiveDB(swap_client)
+
+            engine = sa.create_engine('sqlite:///' + swap_client.archive_file)
+            assert (engine.execute('PRAGMA user_version').scalar() == CURRENT_DB_VERSION)
+
+            # Missing tables are recreated
+            engine.execute('DROP TABLE bid_spans')
+            createArchiveDB(swap_client)
+            assert ('bid_spans' in engine.table_names())
+
+            # No upgrade path exists from an unknown older version
+            engine.execute('PRAGMA user_version = {}'.format(CURRENT_DB_VERSION - 1))
+            with self.assertRaises(ValueError):
+                createArchiveDB(swap_client)
+            engine.dispose()
+
     def test_rfc2440(self):
         password = 'test'
         salt = bytes.fromhex('B7A94A7E4988630E')
@@ -481,6 +481,7 @@ class BaseTest(unittest.TestCase):
                     sc.setDaemonPID(Coins.LTC, cls.ltc_daemons[i].pid)
 
                 sc.start()
+                sc.waitForCoinsReady()
                 if cls.start_xmr_nodes:
                     # Set XMR main wallet address
                     xmr_ci = sc.ci(Coins.XMR)